@@ -2,6 +2,8 @@
 settings のうち、どの環境でも共通の部分
 """
 
+import sys
+
 import environ
 from pathlib import Path
 
@@ -32,6 +34,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # リクエストの処理時間などのメトリクス (config/metrics.py)。ほかのミドルウェアの処理も含めるので先頭に置く
+    'config.metrics.MetricsMiddleware',
+    # ビューごとのクエリ数・処理時間の予算 (log/budgets.py)。ほかのミドルウェアのクエリも数えるので先頭に置く
+    'log.budgets.QueryBudgetMiddleware',
+    # 遅いクエリ・リクエストの記録 (log/slowlog.py)
+    'log.slowlog.SlowRequestMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,3 +110,71 @@ ACCOUNT_LOGOUT_REDIRECT_URL = '/accounts/login/'
 ACCOUNT_ADAPTER = 'accounts.adapter.NoNewUsersAccountAdapter'
 
 SITE_ID = 1
+
+# log app
+# True にすると記事一覧を COUNT / OFFSET を使わないカーソルページネーションで表示する
+LOG_CURSOR_PAGINATION = env.bool('LOG_CURSOR_PAGINATION', default=False)
+
+# アップロードされた写真を保存前に縮小・メタデータ除去・再エンコードする
+LOG_PHOTO_NORMALIZE = env.bool('LOG_PHOTO_NORMALIZE', default=True)
+LOG_PHOTO_MAX_DIMENSION = env.int('LOG_PHOTO_MAX_DIMENSION', default=2560)
+LOG_PHOTO_QUALITY = env.int('LOG_PHOTO_QUALITY', default=85)
+
+# True にすると記事一覧・タグ別一覧・詳細を非同期版のビュー (log/async_views.py) にする。ASGI で動かすとき用
+LOG_ASYNC_VIEWS = env.bool('LOG_ASYNC_VIEWS', default=False)
+
+# 全文検索で関連度を計算する、一致した記事の件数の上限 (新しいものから。0 なら一致したすべて)
+LOG_SEARCH_RANK_WINDOW = env.int('LOG_SEARCH_RANK_WINDOW', default=1000)
+
+# ビューのクエリ数・処理時間の予算 (log/budgets.py) を超えたときの動作。log: 警告をログに出す / raise: 例外 / off: 調べない
+LOG_QUERY_BUDGET = env.str('LOG_QUERY_BUDGET', default='log')
+# テストでは予算を超えたら失敗させる
+if 'test' in sys.argv:
+    LOG_QUERY_BUDGET = 'raise'
+
+# 遅いクエリ・リクエストを記録するディレクトリ (log/slowlog.py。空なら記録しない)。slow_queries コマンドで集計する
+LOG_SLOW_QUERY_DIR = env.str('LOG_SLOW_QUERY_DIR', default='')
+# 記録するクエリ・リクエストの時間 (ミリ秒)
+LOG_SLOW_QUERY_MS = env.int('LOG_SLOW_QUERY_MS', default=100)
+LOG_SLOW_REQUEST_MS = env.int('LOG_SLOW_REQUEST_MS', default=1000)
+# しきい値を超えたもののうち記録する割合と、1 プロセスで 1 秒あたりに記録する件数の上限
+LOG_SLOW_QUERY_SAMPLE_RATE = env.float('LOG_SLOW_QUERY_SAMPLE_RATE', default=1.0)
+LOG_SLOW_QUERY_MAX_PER_SECOND = env.int('LOG_SLOW_QUERY_MAX_PER_SECOND', default=10)
+
+# 変更フィード (/log/api/changes, log/changes.py) の 1 回の件数の既定値と上限
+LOG_CHANGES_PAGE_SIZE = env.int('LOG_CHANGES_PAGE_SIZE', default=500)
+LOG_CHANGES_MAX_PAGE_SIZE = env.int('LOG_CHANGES_MAX_PAGE_SIZE', default=1000)
+# 追記からこの秒数がたつまでは返さない (後からコミットされた記録を読み飛ばさないため)
+LOG_CHANGES_SETTLE_SECONDS = env.float('LOG_CHANGES_SETTLE_SECONDS', default=5.0)
+
+# JSON API (/log/api/articles など, log/api.py) の 1 ページの件数の既定値と上限、?include=comments で記事ごとに返すコメントの件数
+LOG_API_PAGE_SIZE = env.int('LOG_API_PAGE_SIZE', default=20)
+LOG_API_MAX_PAGE_SIZE = env.int('LOG_API_MAX_PAGE_SIZE', default=100)
+LOG_API_INCLUDED_COMMENTS = env.int('LOG_API_INCLUDED_COMMENTS', default=20)
+
+# メトリクス (/metrics, config/metrics.py)
+# 複数のプロセス (gunicorn のワーカーなど) の値を合計するときは、全プロセスから書き込めるディレクトリを指定する
+METRICS_DIR = env.str('METRICS_DIR', default='')
+# プロセスの値を METRICS_DIR に書き出す間隔 (秒)
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=5.0)
+# 指定すると /metrics に Authorization: Bearer <METRICS_TOKEN> が必要になる
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+
+# キャッシュ。CACHE_URL で指定する
+# ページのキャッシュのバージョン (log/cache.py) はすべてのプロセスで共有していないと、書き込んだプロセス以外が
+# 古いページと 304 を返し続ける。locmemcache:// はプロセスごとに別のキャッシュになるので、1 プロセスで動かすときだけにする
+# (config/gunicorn.conf.py は複数のワーカーで locmemcache:// を使うと起動しない)。
+# 1 台で動かすなら filecache:///var/tmp/django_cache 、複数台で動かすときは rediscache://host:6379/1 などにする
+CACHES = {'default': env.cache('CACHE_URL', default='filecache:///var/tmp/django_cache')}
+# テストはテストごとにデータベースが巻き戻されるので、キャッシュを使わない (使うテストは override_settings で指定する)
+if 'test' in sys.argv:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+# ログインしていないユーザ向けの記事一覧・詳細ページをキャッシュする秒数 (0 ならキャッシュしない)
+LOG_PAGE_CACHE_TIMEOUT = env.int('LOG_PAGE_CACHE_TIMEOUT', default=300)
+# デプロイごとに変える値 (イメージのタグなど)。ページの ETag に含めて、テンプレートの変更後に古いページで 304 を返さないようにする
+LOG_RELEASE = env.str('LOG_RELEASE', default='')
+# 記事一覧のカードをキャッシュする秒数
+LOG_FRAGMENT_CACHE_TIMEOUT = env.int('LOG_FRAGMENT_CACHE_TIMEOUT', default=3600)
+# 記事一覧・タグ別一覧に表示するタグの件数 (記事数の多い順。0 ならすべて)。すべてのタグはタグの一覧ページに表示する
+LOG_LIST_TAG_LIMIT = env.int('LOG_LIST_TAG_LIMIT', default=30)
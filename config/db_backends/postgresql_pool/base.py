@@ -0,0 +1,89 @@
+"""
+psycopg 3 のコネクションプール (psycopg_pool) を使う PostgreSQL のバックエンド
+
+Django 4.2 の PostgreSQL バックエンドにはプールの機能がない(5.1 で OPTIONS['pool'] として追加された)ので、
+同じ設定の書き方で、接続をプールから借りて close() でプールに返すようにしたもの。
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'config.db_backends.postgresql_pool',
+            'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': True,  # 貸し出す前に接続が生きているか確認する
+            'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10}},
+            ...
+        }
+    }
+
+プールはプロセスごとに作られる。gunicorn などで fork する場合も、最初に接続するときに作るので子プロセス間で共有されない。
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+from psycopg import IsolationLevel
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # DB の alias ごとのプール (プロセス内のスレッドで共有する)
+    _connection_pools = {}
+    _pools_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self.alias not in self._connection_pools:
+            with self._pools_lock:
+                if self.alias not in self._connection_pools:
+                    self._connection_pools[self.alias] = self._create_pool()
+        return self._connection_pools[self.alias]
+
+    def get_pool_options(self):
+        """
+        ConnectionPool に渡す引数 (check 以外)。settings の OPTIONS['pool'] と接続の設定から作る
+        """
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            # 接続を持ち続けるとプールに返されないため
+            raise ImproperlyConfigured('コネクションプールを使うときは CONN_MAX_AGE を 0 にしてください。')
+
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        pool_options = {} if pool_options is True else dict(pool_options or {})
+        kwargs = self.get_connection_params()
+        # 自動コミットで貸し出し、Django が接続ごとに設定し直す
+        kwargs['autocommit'] = True
+        return {'kwargs': kwargs, 'open': True, 'name': f'django-{self.alias}', **pool_options}
+
+    def _create_pool(self):
+        pool_options = self.get_pool_options()
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise ImproperlyConfigured('psycopg_pool を読み込めません。psycopg-pool をインストールしてください。') from e
+
+        return ConnectionPool(
+            check=ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+            **pool_options,
+        )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        except ValueError:
+            raise ImproperlyConfigured(f'Invalid transaction isolation level {options["isolation_level"]} specified.')
+        connection = self.pool.getconn()
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            # 閉じずにプールに返す。トランザクションが残っていればプールがロールバックする
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
+            self.connection = None
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -29,6 +30,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.metrics.MetricsMiddleware',
+    'log.budgets.QueryBudgetMiddleware',
+    'log.slowlog.SlowRequestMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,8 +72,22 @@ DATABASES = {
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
         'ATOMIC_REQUESTS': True,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
     }
 }
+if os.environ.get('DB_POOL', '0') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'config.db_backends.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            },
+        },
+    })
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -118,6 +136,43 @@ ACCOUNT_ADAPTER = 'accounts.adapter.NoNewUsersAccountAdapter'
 
 SITE_ID = 1
 
+LOG_CURSOR_PAGINATION = os.environ.get('LOG_CURSOR_PAGINATION', '0') == '1'
+LOG_PHOTO_NORMALIZE = os.environ.get('LOG_PHOTO_NORMALIZE', '1') == '1'
+LOG_PHOTO_MAX_DIMENSION = int(os.environ.get('LOG_PHOTO_MAX_DIMENSION', '2560'))
+LOG_PHOTO_QUALITY = int(os.environ.get('LOG_PHOTO_QUALITY', '85'))
+LOG_ASYNC_VIEWS = os.environ.get('LOG_ASYNC_VIEWS', '0') == '1'
+LOG_SEARCH_RANK_WINDOW = int(os.environ.get('LOG_SEARCH_RANK_WINDOW', '1000'))
+LOG_QUERY_BUDGET = os.environ.get('LOG_QUERY_BUDGET', 'log')
+LOG_SLOW_QUERY_DIR = os.environ.get('LOG_SLOW_QUERY_DIR', '')
+LOG_SLOW_QUERY_MS = int(os.environ.get('LOG_SLOW_QUERY_MS', '100'))
+LOG_SLOW_REQUEST_MS = int(os.environ.get('LOG_SLOW_REQUEST_MS', '1000'))
+LOG_SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('LOG_SLOW_QUERY_SAMPLE_RATE', '1'))
+LOG_SLOW_QUERY_MAX_PER_SECOND = int(os.environ.get('LOG_SLOW_QUERY_MAX_PER_SECOND', '10'))
+LOG_CHANGES_PAGE_SIZE = int(os.environ.get('LOG_CHANGES_PAGE_SIZE', '500'))
+LOG_CHANGES_MAX_PAGE_SIZE = int(os.environ.get('LOG_CHANGES_MAX_PAGE_SIZE', '1000'))
+LOG_CHANGES_SETTLE_SECONDS = float(os.environ.get('LOG_CHANGES_SETTLE_SECONDS', '5'))
+LOG_API_PAGE_SIZE = int(os.environ.get('LOG_API_PAGE_SIZE', '20'))
+LOG_API_MAX_PAGE_SIZE = int(os.environ.get('LOG_API_MAX_PAGE_SIZE', '100'))
+LOG_API_INCLUDED_COMMENTS = int(os.environ.get('LOG_API_INCLUDED_COMMENTS', '20'))
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', '/var/tmp/django_cache'),
+    }
+}
+if 'test' in sys.argv:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+LOG_PAGE_CACHE_TIMEOUT = int(os.environ.get('LOG_PAGE_CACHE_TIMEOUT', '300'))
+LOG_RELEASE = os.environ.get('LOG_RELEASE', '')
+LOG_FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('LOG_FRAGMENT_CACHE_TIMEOUT', '3600'))
+LOG_LIST_TAG_LIMIT = int(os.environ.get('LOG_LIST_TAG_LIMIT', '30'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
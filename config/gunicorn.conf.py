@@ -0,0 +1,82 @@
+"""
+gunicorn の設定
+
+python -m config.serve から使う (gunicorn -c config/gunicorn.conf.py でも起動できる)。
+値はすべて環境変数で変更できる。
+
+- WEB_WORKER_CLASS: sync / gthread / uvicorn (uvicorn のときは config.asgi を使う)
+- WEB_WORKERS: ワーカー数。省略時は CPU 数から決める (sync / uvicorn は 2 * CPU + 1、gthread は CPU + 1)
+- WEB_THREADS: gthread のワーカーあたりのスレッド数
+- WEB_MAX_REQUESTS / WEB_MAX_REQUESTS_JITTER: この件数を処理したワーカーは入れ替える (メモリの肥大化対策)
+- WEB_PRELOAD: 1 ならアプリを読み込んでから fork する (メモリを共有でき、起動も速い)
+- WEB_TIMEOUT / WEB_GRACEFUL_TIMEOUT: 応答のないワーカーを落とすまでの秒数 / 停止・再起動時に処理中のリクエストを待つ秒数
+
+設定の再読み込みとワーカーの入れ替えは、マスタープロセスに SIGHUP を送る (kill -HUP <pid>)。
+WEB_PRELOAD=1 のときはアプリのコードはマスターで読み込み済みなので、コードを更新したときは再起動する。
+"""
+import multiprocessing
+import os
+
+worker_mode = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn_worker.UvicornWorker',
+}
+if worker_mode not in WORKER_CLASSES:
+    raise ValueError(f'WEB_WORKER_CLASS は {", ".join(WORKER_CLASSES)} のいずれかです: {worker_mode}')
+
+
+def default_workers(mode, cpu_count):
+    # gthread はスレッドでも並行して処理するので、プロセスは少なめにする
+    if mode == 'gthread':
+        return cpu_count + 1
+    return cpu_count * 2 + 1
+
+
+wsgi_app = 'config.asgi:application' if worker_mode == 'uvicorn' else 'config.wsgi:application'
+worker_class = WORKER_CLASSES[worker_mode]
+workers = int(os.environ.get('WEB_WORKERS') or default_workers(worker_mode, multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', '4')) if worker_mode == 'gthread' else 1
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', '100'))
+timeout = int(os.environ.get('WEB_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', '5'))
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def check_shared_cache(processes, caches):
+    """
+    ページのキャッシュのバージョン (log/cache.py) をワーカー間で共有できないキャッシュなら起動しない
+    """
+    backend = caches['default']['BACKEND']
+    if processes > 1 and backend == 'django.core.cache.backends.locmem.LocMemCache':
+        raise RuntimeError(f'ワーカーが {processes} 個のときは LocMemCache は使えません。'
+                           'CACHE_URL (config/docker.py では CACHE_BACKEND) に共有のキャッシュを指定してください。')
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    from django.conf import settings
+    check_shared_cache(server.cfg.workers, settings.CACHES)
+
+
+def pre_fork(server, worker):
+    # preload したマスターで DB に接続していた場合に、その接続をワーカーへ引き継がないように閉じておく
+    if preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def child_exit(server, worker):
+    # 終了したワーカーのメトリクスのファイルを archive.json にまとめる (config/metrics.py)
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        from config.metrics import archive_process
+        archive_process(directory, worker.pid)
@@ -0,0 +1,143 @@
+"""
+ワーカーの種類ごとに gunicorn を起動して負荷をかけ、スループットとレイテンシを比べる
+
+    $ python -m config.loadtest --modes sync gthread uvicorn --paths /log/ /log/1/ --requests 1000 --concurrency 32
+
+    # 非同期版のビュー (LOG_ASYNC_VIEWS) も含めて、遅いクライアントが 200 接続いる状態で比べる
+    $ python -m config.loadtest --modes gthread uvicorn --async-views --slow-clients 200
+
+モードごとに python -m config.serve でサーバを起動し、/readyz/ が 200 を返すようになってから計測して停止する。
+ワーカー数などは通常どおり環境変数 (config/gunicorn.conf.py) で指定する。
+遅いクライアントは、リクエストを少しずつ送り、レスポンスを少しずつ読む接続を計測の間ずっと張り続ける。
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from config.metrics import percentile
+from config.serve import MODES
+
+
+def fetch(url, timeout=30):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return (time.perf_counter() - start) * 1000, status
+
+
+def wait_until_ready(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        if fetch(f'{base_url}/readyz/', timeout=2)[1] == 200:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def slow_client(port, path, delay, stop):
+    request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode()
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+                for i in range(0, len(request), 16):
+                    sock.sendall(request[i:i + 16])
+                    time.sleep(delay)
+                while sock.recv(1024) and not stop.is_set():
+                    time.sleep(delay)
+        except OSError:
+            time.sleep(delay)
+
+
+def run_mode(mode, args, extra_env=None):
+    base_url = f'http://127.0.0.1:{args.port}'
+    env = {**os.environ, 'WEB_ACCESS_LOG': '', **(extra_env or {})}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'config.serve', '--mode', mode, '--bind', f'127.0.0.1:{args.port}'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.verbose else None)
+    stop = threading.Event()
+    try:
+        if not wait_until_ready(base_url, process, args.startup_timeout):
+            return None
+
+        urls = [f'{base_url}{path}' for path in args.paths]
+        # ウォームアップ (各ワーカーの初回のテンプレートの読み込みなどを計測に含めない)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(fetch, [urls[i % len(urls)] for i in range(args.concurrency * 2)]))
+
+        for i in range(args.slow_clients):
+            threading.Thread(target=slow_client, daemon=True,
+                             args=(args.port, args.paths[i % len(args.paths)], args.slow_delay, stop)).start()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(fetch, [urls[i % len(urls)] for i in range(args.requests)]))
+        wall = time.perf_counter() - started
+    finally:
+        stop.set()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    timings = [elapsed for elapsed, _ in results]
+    return {
+        'rps': len(results) / wall,
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'mean': statistics.mean(timings),
+        'errors': sum(1 for _, status in results if status == 0 or status >= 400),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ワーカーの種類ごとに gunicorn の性能を比べます。')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--paths', nargs='+', default=['/log/'])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--async-views', action='store_true',
+                        help='uvicorn のときは LOG_ASYNC_VIEWS=1 (非同期版のビュー) でも計測する')
+    parser.add_argument('--slow-clients', type=int, default=0, help='計測中に接続し続ける遅いクライアントの数')
+    parser.add_argument('--slow-delay', type=float, default=0.5, help='遅いクライアントが送受信する間隔 (秒)')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--verbose', action='store_true', help='サーバのログを表示する')
+    args = parser.parse_args(argv)
+
+    runs = []
+    for mode in args.modes:
+        runs.append((mode, mode, {'LOG_ASYNC_VIEWS': '0'} if args.async_views else {}))
+        if args.async_views and mode == 'uvicorn':
+            runs.append(('uvicorn+async', mode, {'LOG_ASYNC_VIEWS': '1'}))
+
+    print(f'{"mode":<15}{"req/s":>10}{"mean ms":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for label, mode, extra_env in runs:
+        result = run_mode(mode, args, extra_env)
+        if result is None:
+            print(f'{label:<15} 起動できませんでした (--verbose でログを確認してください)')
+            continue
+        print(f'{label:<15}{result["rps"]:>10.1f}{result["mean"]:>10.2f}{result["p50"]:>10.2f}'
+              f'{result["p90"]:>10.2f}{result["p99"]:>10.2f}{result["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
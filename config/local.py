@@ -56,6 +56,7 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # 本番ではすべての SQL ではなく、遅いものだけを log/slowlog.py (LOG_SLOW_QUERY_DIR) で記録する
         # 'django.db.backends': {  # 発行されるSQL文を出力するための設定
         #     'handlers': ['console'],
         #     'level': 'DEBUG',
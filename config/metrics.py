@@ -0,0 +1,497 @@
+"""
+リクエストの計測と Prometheus 形式のメトリクス (/metrics)
+
+- MetricsMiddleware: ビューごとのレイテンシのヒストグラム、DB のクエリ数・時間、テンプレートの描画時間
+- キャッシュの get / get_many のヒット・ミス (キャッシュのバックエンドのクラスに計測を付ける)
+- 画像処理の時間 (log/imaging.py で timed を使う)
+
+値はスレッドごとの辞書に加算するので、記録するときにロックを取らない (読むときに全スレッドの分を合計する)。
+gunicorn の複数のワーカーやサムネイルのワーカーの値は、METRICS_DIR にプロセスごとのファイルとして
+METRICS_FLUSH_INTERVAL 秒ごとに書き出し、/metrics でそれらを合計する。終了したプロセスのファイルは
+archive.json にまとめる。METRICS_DIR が空のときは、/metrics はそのプロセスの値だけを返す。
+"""
+import atexit
+import bisect
+import fcntl
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.db import connections
+from django.template.backends.django import Template
+from django.views.generic import View
+
+from log import budgets
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+IMAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 名前: (種類, 説明, ヒストグラムのバケット)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'ビューごとのリクエストの処理時間', LATENCY_BUCKETS),
+    'db_queries_total': ('counter', 'ビューごとの DB のクエリ数', None),
+    'db_query_duration_seconds_total': ('counter', 'ビューごとの DB のクエリの合計時間', None),
+    'template_render_duration_seconds': ('histogram', 'ビューごとのテンプレートの描画時間 (描画中のクエリの時間を除く)',
+                                         LATENCY_BUCKETS),
+    'cache_requests_total': ('counter', 'キャッシュの get のヒット・ミス (キーの名前空間ごと)', None),
+    'image_processing_duration_seconds': ('histogram', '写真の処理時間', IMAGE_BUCKETS),
+}
+
+ARCHIVE = 'archive.json'
+LOCK = '.lock'
+UNMATCHED = '<unmatched>'
+
+
+class _Shard:
+    """
+    1 スレッドが記録する値。書き込むのはそのスレッドだけ
+    """
+
+    def __init__(self):
+        # (名前, ラベル) -> 値
+        self.counters = {}
+        # (名前, ラベル) -> [バケットごとの件数..., +Inf の件数, 合計]
+        self.histograms = {}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+
+    def reset(self):
+        with self._lock:
+            self._local = threading.local()
+            self._shards = []
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            # ロックを取るのは、スレッドが初めて記録するときだけ
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(buckets) + 2)
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self):
+        """
+        すべてのスレッドの値を合計した {'counters': {...}, 'histograms': {...}}
+        """
+        with self._lock:
+            shards = list(self._shards)
+        result = {'counters': {}, 'histograms': {}}
+        for shard in shards:
+            # dict.copy() は GIL を持ったまま行われるので、記録中のスレッドと競合しない
+            merge(result, {'counters': shard.counters.copy(), 'histograms': shard.histograms.copy()})
+        return result
+
+
+def merge(into, values):
+    for key, value in values['counters'].items():
+        into['counters'][key] = into['counters'].get(key, 0) + value
+    for key, histogram in values['histograms'].items():
+        current = into['histograms'].get(key)
+        into['histograms'][key] = list(histogram) if current is None else [a + b for a, b in zip(current, histogram)]
+    return into
+
+
+registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, tuple(labels.items()), value)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, tuple(labels.items()))
+
+
+def timed(name, **labels):
+    """
+    関数の実行時間をヒストグラム name に記録するデコレータ
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+                store.maybe_flush()
+        return wrapper
+    return decorator
+
+
+def percentile(values, p):
+    """
+    values の p パーセンタイル (並べて p % の位置の値。ベンチマーク・負荷試験の結果の表示用)
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# ファイルへの保存 (複数プロセスの合計)
+
+def _dump(values):
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in values['counters'].items()],
+        'histograms': [[name, list(labels), value] for (name, labels), value in values['histograms'].items()],
+    }
+
+
+def _load(data):
+    return {
+        kind: {(name, tuple(tuple(label) for label in labels)): value for name, labels, value in data.get(kind, [])}
+        for kind in ('counters', 'histograms')
+    }
+
+
+def _read(path):
+    try:
+        return _load(json.loads(path.read_text()))
+    except FileNotFoundError:
+        return None
+
+
+def _write(path, values):
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    tmp.write_text(json.dumps(_dump(values)))
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Store:
+    """
+    プロセスの値を METRICS_DIR/<ホスト名>-<pid>.json に書き出し、すべてのファイルを合計する
+    """
+
+    def __init__(self):
+        self._flush_lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._exit_registered = False
+
+    @property
+    def directory(self):
+        return Path(settings.METRICS_DIR) if settings.METRICS_DIR else None
+
+    @staticmethod
+    def filename(pid=None):
+        return f'{socket.gethostname()}-{pid or os.getpid()}.json'
+
+    def flush(self):
+        directory = self.directory
+        if directory is None:
+            return
+        # 同時に書き出そうとしたスレッドは待たずに戻る
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            _write(directory / self.filename(), registry.snapshot())
+            self._flushed_at = time.monotonic()
+        finally:
+            self._flush_lock.release()
+
+    def maybe_flush(self):
+        if self.directory is None:
+            return
+        if not self._exit_registered:
+            # 最後に書き出してから終了までの値も残す
+            atexit.register(self.flush)
+            self._exit_registered = True
+        if time.monotonic() - self._flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def collect(self):
+        """
+        すべてのプロセスの値の合計。METRICS_DIR がなければこのプロセスの値
+        """
+        directory = self.directory
+        if directory is None:
+            return registry.snapshot()
+        self.flush()
+        archive_dead_processes(directory)
+        total = {'counters': {}, 'histograms': {}}
+        for path in sorted(directory.glob('*.json')):
+            values = _read(path)
+            if values is not None:
+                merge(total, values)
+        return total
+
+
+store = Store()
+
+
+def archive_process(directory, pid, hostname=None):
+    """
+    終了したプロセスのファイルを archive.json に加えて削除する (gunicorn の child_exit からも呼ぶ)
+    """
+    directory = Path(directory)
+    path = directory / f'{hostname or socket.gethostname()}-{pid}.json'
+    with open(directory / LOCK, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        values = _read(path)
+        if values is None:
+            return
+        archive = _read(directory / ARCHIVE) or {'counters': {}, 'histograms': {}}
+        _write(directory / ARCHIVE, merge(archive, values))
+        path.unlink()
+
+
+def archive_dead_processes(directory):
+    prefix = f'{socket.gethostname()}-'
+    for path in directory.glob(f'{prefix}*.json'):
+        pid = path.stem[len(prefix):]
+        if pid.isdigit() and not _alive(int(pid)):
+            archive_process(directory, int(pid))
+
+
+# fork した子プロセス (gunicorn のワーカー) は親の値を引き継がない
+os.register_at_fork(after_in_child=registry.reset)
+
+
+# 出力 (Prometheus のテキスト形式)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def exposition(values):
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if kind == 'counter':
+            series = sorted((labels, value) for (metric, labels), value in values['counters'].items() if metric == name)
+        else:
+            series = sorted((labels, value) for (metric, labels), value in values['histograms'].items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for le, count in zip((*buckets, '+Inf'), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# Django の計測
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'render_seconds', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.rendering = False
+
+
+_stats = ContextVar('metrics_request_stats', default=None)
+
+
+@contextmanager
+def collecting():
+    """
+    ブロックの中のクエリ数・DB の時間・テンプレートの描画時間を RequestStats に集める (計測は install() で付ける)
+
+    すでに集めている中では、それをそのまま使う (benchmark_views がテストクライアントのリクエストを囲んで測るときなど)。
+    """
+    stats = _stats.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def _query_executed(sql, seconds, many, context):
+    stats = _stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+
+
+def _instrument_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context=None, request=None):
+        stats = _stats.get()
+        # render_to_string を入れ子に呼んだときは、いちばん外側だけを測る
+        if stats is None or stats.rendering:
+            return render(self, context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        db_before = stats.db_seconds
+        try:
+            return render(self, context, request)
+        finally:
+            stats.rendering = False
+            stats.render_seconds += time.perf_counter() - started - (stats.db_seconds - db_before)
+    wrapper.metrics_instrumented = True
+    return wrapper
+
+
+def cache_namespace(key):
+    """
+    キャッシュのキーの名前空間 (log:page:... -> log:page、テンプレートの {% cache %} -> template.cache)
+    """
+    if key.startswith('template.cache.'):
+        return 'template.cache'
+    parts = key.split(':', 2)
+    return ':'.join(parts[:2]) if len(parts) > 1 else 'other'
+
+
+_MISSING = object()
+
+
+def _instrument_cache(backend):
+    """
+    backend のクラスの get (と、独自に実装していれば get_many) でヒット・ミスを数える
+
+    BaseCache.get_many は get を呼ぶので、そのままにしておく (二重に数えないように)。
+    """
+    get, get_many = backend.get, backend.get_many
+
+    @functools.wraps(get)
+    def instrumented_get(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version)
+        inc('cache_requests_total', namespace=cache_namespace(key), result='miss' if value is _MISSING else 'hit')
+        return default if value is _MISSING else value
+
+    @functools.wraps(get_many)
+    def instrumented_get_many(self, keys, version=None):
+        keys = list(keys)
+        found = get_many(self, keys, version)
+        for key in keys:
+            inc('cache_requests_total', namespace=cache_namespace(key), result='hit' if key in found else 'miss')
+        return found
+
+    backend.get = instrumented_get
+    if get_many is not BaseCache.get_many:
+        backend.get_many = instrumented_get_many
+    backend.metrics_instrumented = True
+
+
+def install():
+    """
+    DB の接続・テンプレート・キャッシュのバックエンドに計測を付ける (何度呼んでも 1 回だけ)
+    """
+    # クエリの時間は log/budgets.py の execute_wrapper で測ったものを受け取る。新しい接続には log/budgets.py が付ける
+    budgets.add_listener(_query_executed)
+    for connection in connections.all(initialized_only=True):
+        budgets.install(connection)
+    if not getattr(Template.render, 'metrics_instrumented', False):
+        Template.render = _instrument_render(Template.render)
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if not backend.__dict__.get('metrics_instrumented'):
+            _instrument_cache(backend)
+
+
+def request_method(request):
+    """
+    ラベルに使うメソッド。クライアントが任意のメソッドを送れるので、標準のもの以外は other にまとめる
+    """
+    method = request.method or ''
+    return method if method.lower() in View.http_method_names else 'other'
+
+
+class MetricsMiddleware:
+    """
+    リクエストの処理時間・クエリ数・DB の時間・テンプレートの描画時間をビューごとに記録する
+
+    ほかのミドルウェアの処理も含めるため、MIDDLEWARE のなるべく先頭に置く。
+    計測のフック (install) は LogConfig.ready() で付ける。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with collecting() as stats:
+            response = self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with collecting() as stats:
+            response = await self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or UNMATCHED) if match else UNMATCHED
+        observe('http_request_duration_seconds', elapsed, view=view, method=request_method(request),
+                status=response.status_code)
+        inc('db_queries_total', stats.queries, view=view)
+        inc('db_query_duration_seconds_total', stats.db_seconds, view=view)
+        if stats.render_seconds:
+            observe('template_render_duration_seconds', stats.render_seconds, view=view)
+        store.maybe_flush()
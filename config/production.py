@@ -26,8 +26,24 @@ DATABASES = {
         'HOST': env('DB_HOST'),
         'PORT': env('DB_PORT'),
         'ATOMIC_REQUESTS': True,
+        # 接続を使い回す秒数 (0 ならリクエストごとに接続し直す) と、使い回す前に接続が生きているかの確認
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
     }
 }
+# psycopg のコネクションプールを使う (config/db_backends/postgresql_pool)
+if env.bool('DB_POOL', default=False):
+    DATABASES['default'].update({
+        'ENGINE': 'config.db_backends.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+                'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+                'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+            },
+        },
+    })
 
 LOGGING = {
     'version': 1,
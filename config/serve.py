@@ -0,0 +1,37 @@
+"""
+本番用のアプリケーションサーバ (gunicorn) を起動する
+
+    $ python -m config.serve                    # WEB_WORKER_CLASS (既定は gthread) で起動
+    $ python -m config.serve --mode uvicorn     # ワーカーの種類を指定して起動
+    $ python -m config.serve --mode sync --bind 127.0.0.1:8001
+
+設定は config/gunicorn.conf.py と環境変数で行う。--mode 以外の引数はそのまま gunicorn に渡す。
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+CONFIG_FILE = Path(__file__).resolve().parent / 'gunicorn.conf.py'
+MODES = ('sync', 'gthread', 'uvicorn')
+
+
+def build_command(extra_args):
+    return [sys.executable, '-m', 'gunicorn', '--config', str(CONFIG_FILE), *extra_args]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='gunicorn でアプリケーションサーバを起動します。')
+    parser.add_argument('--mode', choices=MODES, default=os.environ.get('WEB_WORKER_CLASS', 'gthread'),
+                        help='ワーカーの種類')
+    args, extra_args = parser.parse_known_args(argv)
+
+    # gunicorn.conf.py はワーカーの種類を環境変数から読む
+    os.environ['WEB_WORKER_CLASS'] = args.mode
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.docker')
+    command = build_command(extra_args)
+    os.execv(command[0], command)
+
+
+if __name__ == '__main__':
+    main()
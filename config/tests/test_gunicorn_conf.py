@@ -0,0 +1,26 @@
+"""
+config/gunicorn.conf.py のテスト
+"""
+import importlib.util
+
+from django.test import SimpleTestCase
+
+from config.serve import CONFIG_FILE
+
+
+def load_config():
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', CONFIG_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestSharedCache(SimpleTestCase):
+    def test_locmem_with_workers(self):
+        conf = load_config()
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        # ワーカーごとに別のキャッシュになると、キャッシュのバージョンが他のワーカーに伝わらない
+        with self.assertRaises(RuntimeError):
+            conf.check_shared_cache(2, locmem)
+        conf.check_shared_cache(1, locmem)
+        conf.check_shared_cache(4, {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'}})
@@ -0,0 +1,199 @@
+import json
+import socket
+import tempfile
+import threading
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from config import metrics
+from log import budgets
+from log.models import Article
+
+User = get_user_model()
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_metrics'}}
+
+
+def _counter(values, name, **labels):
+    return values['counters'].get((name, tuple(labels.items())), 0)
+
+
+def _histogram_count(values, name, **labels):
+    histogram = values['histograms'].get((name, tuple(labels.items())))
+    return sum(histogram[:-1]) if histogram else 0
+
+
+class TestRegistry(TestCase):
+    def test_threads(self):
+        """
+        スレッドごとに記録した値が合計される
+        """
+        registry = metrics.Registry()
+
+        def work():
+            for _ in range(1000):
+                registry.inc('db_queries_total', (('view', 'a'),))
+                registry.observe('http_request_duration_seconds', 0.02, (('view', 'a'),))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        values = registry.snapshot()
+        self.assertEqual(_counter(values, 'db_queries_total', view='a'), 4000)
+        histogram = values['histograms'][('http_request_duration_seconds', (('view', 'a'),))]
+        self.assertEqual(histogram[metrics.LATENCY_BUCKETS.index(0.025)], 4000)
+        self.assertAlmostEqual(histogram[-1], 80.0)
+
+    def test_exposition(self):
+        registry = metrics.Registry()
+        registry.observe('http_request_duration_seconds', 0.003, (('view', 'a'),))
+        registry.observe('http_request_duration_seconds', 0.2, (('view', 'a'),))
+        registry.observe('http_request_duration_seconds', 20, (('view', 'a'),))
+        registry.inc('cache_requests_total', (('namespace', 'x"y\\z'), ('result', 'hit')), 2)
+        text = metrics.exposition(registry.snapshot())
+        self.assertIn('# TYPE http_request_duration_seconds histogram\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="0.005"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="0.1"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="0.25"} 2\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="+Inf"} 3\n', text)
+        self.assertIn('http_request_duration_seconds_count{view="a"} 3\n', text)
+        self.assertIn('cache_requests_total{namespace="x\\"y\\\\z",result="hit"} 2\n', text)
+        self.assertNotIn('db_queries_total', text)
+
+    def test_cache_namespace(self):
+        self.assertEqual(metrics.cache_namespace('log:page:abc:def'), 'log:page')
+        self.assertEqual(metrics.cache_namespace('template.cache.article_card.0123'), 'template.cache')
+        self.assertEqual(metrics.cache_namespace('plain'), 'other')
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(metrics.percentile(values, 0), 1)
+        self.assertEqual(metrics.percentile(values, 50), 3)
+        self.assertEqual(metrics.percentile(values, 100), 5)
+
+    def test_timed(self):
+        @metrics.timed('image_processing_duration_seconds', operation='test')
+        def work():
+            return 1
+
+        before = _histogram_count(metrics.registry.snapshot(), 'image_processing_duration_seconds', operation='test')
+        self.assertEqual(work(), 1)
+        after = _histogram_count(metrics.registry.snapshot(), 'image_processing_duration_seconds', operation='test')
+        self.assertEqual(after, before + 1)
+
+
+class TestMetricsMiddleware(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=user)
+
+    def test_request(self):
+        before = metrics.registry.snapshot()
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        after = metrics.registry.snapshot()
+        labels = {'view': 'log:article_detail'}
+        self.assertEqual(_histogram_count(after, 'http_request_duration_seconds', **labels, method='GET', status=200)
+                         - _histogram_count(before, 'http_request_duration_seconds', **labels, method='GET', status=200),
+                         1)
+        self.assertGreater(_counter(after, 'db_queries_total', **labels), _counter(before, 'db_queries_total', **labels))
+        self.assertEqual(_histogram_count(after, 'template_render_duration_seconds', **labels)
+                         - _histogram_count(before, 'template_render_duration_seconds', **labels), 1)
+
+    def test_collecting(self):
+        # 外側で集めているときは、ミドルウェアも同じ RequestStats に集める (benchmark_views)
+        metrics.install()
+        with metrics.collecting() as stats:
+            self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+            with metrics.collecting() as inner:
+                self.assertIs(inner, stats)
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.render_seconds, 0)
+
+    def test_shared_execute_wrapper(self):
+        # クエリは log/budgets.py の execute_wrapper で 1 回だけ測り、その時間を受け取る
+        metrics.install()
+        metrics.install()
+        self.assertEqual(budgets._listeners.count(metrics._query_executed), 1)
+        self.assertEqual(connection.execute_wrappers.count(budgets._execute_wrapper), 1)
+        self.assertEqual(len(connection.execute_wrappers), 1)
+        with metrics.collecting() as stats:
+            Article.objects.count()
+        self.assertEqual(stats.queries, 1)
+        self.assertGreater(stats.db_seconds, 0)
+
+    def test_unmatched(self):
+        before = metrics.registry.snapshot()
+        self.client.get('/no/such/page/')
+        after = metrics.registry.snapshot()
+        labels = {'view': metrics.UNMATCHED, 'method': 'GET', 'status': 404}
+        self.assertEqual(_histogram_count(after, 'http_request_duration_seconds', **labels)
+                         - _histogram_count(before, 'http_request_duration_seconds', **labels), 1)
+
+    def test_unknown_method(self):
+        # クライアントが送った任意のメソッドごとに系列を増やさない
+        for method in ('X0', 'X1'):
+            self.client.generic(method, reverse('log:article_list'))
+        methods = {dict(labels).get('method') for name, labels in metrics.registry.snapshot()['histograms']
+                   if name == 'http_request_duration_seconds'}
+        self.assertNotIn('X0', methods)
+        self.assertIn('other', methods)
+
+    @override_settings(CACHES=LOCMEM)
+    def test_cache(self):
+        cache.clear()
+        # 差し替えたキャッシュのバックエンドに計測を付ける (通常は LogConfig.ready() で設定のバックエンドに付ける)
+        metrics.install()
+        before = metrics.registry.snapshot()
+        cache.set('log:test:a', None)
+        self.assertIsNone(cache.get('log:test:a', 'default'))
+        self.assertEqual(cache.get('log:test:b', 'default'), 'default')
+        self.assertEqual(cache.get_many(['log:test:a', 'log:test:c']), {'log:test:a': None})
+        after = metrics.registry.snapshot()
+        for result, count in (('hit', 2), ('miss', 2)):
+            with self.subTest(result=result):
+                self.assertEqual(_counter(after, 'cache_requests_total', namespace='log:test', result=result)
+                                 - _counter(before, 'cache_requests_total', namespace='log:test', result=result),
+                                 count)
+
+
+class TestMetricsView(TestCase):
+    def test_metrics(self):
+        self.client.get(reverse('readiness'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'http_request_duration_seconds_count{view="readiness",method="GET",status="200"}')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_processes(self):
+        """
+        METRICS_DIR にあるほかのプロセスのファイルも合計し、終了したプロセスのファイルは archive.json にまとめる
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            other = {'counters': [['db_queries_total', [['view', 'other']], 5]], 'histograms': []}
+            Path(directory, 'otherhost-1.json').write_text(json.dumps(other))
+            # 存在しない pid のファイル
+            dead = Path(directory, f'{socket.gethostname()}-99999999.json')
+            dead.write_text(json.dumps(other))
+            response = self.client.get(reverse('metrics'))
+            self.assertContains(response, 'db_queries_total{view="other"} 10\n')
+            self.assertFalse(dead.exists())
+            self.assertTrue(Path(directory, metrics.ARCHIVE).exists())
+            self.assertTrue(Path(directory, metrics.store.filename()).exists())
+
+            # まとめた後も値は変わらない
+            response = self.client.get(reverse('metrics'))
+            self.assertContains(response, 'db_queries_total{view="other"} 10\n')
@@ -0,0 +1,68 @@
+"""
+config/db_backends/postgresql_pool のテスト
+
+psycopg (と psycopg_pool) がインストールされていなければスキップする。データベースには接続しない。
+"""
+import importlib.util
+from unittest import mock, skipUnless
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+HAS_PSYCOPG = importlib.util.find_spec('psycopg') is not None
+HAS_PSYCOPG_POOL = HAS_PSYCOPG and importlib.util.find_spec('psycopg_pool') is not None
+
+
+def make_wrapper(**settings):
+    from config.db_backends.postgresql_pool.base import DatabaseWrapper
+
+    settings_dict = {
+        'ENGINE': 'config.db_backends.postgresql_pool',
+        'NAME': 'log',
+        'USER': 'log_user',
+        'PASSWORD': 'secret',
+        'HOST': 'db',
+        'PORT': '5432',
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10.0}},
+        'TIME_ZONE': None,
+        'TEST': {},
+        **settings,
+    }
+    return DatabaseWrapper(settings_dict, alias='pool-test')
+
+
+@skipUnless(HAS_PSYCOPG, 'psycopg がインストールされていない')
+class TestPoolOptions(SimpleTestCase):
+    def test_from_settings(self):
+        options = make_wrapper(OPTIONS={'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10.0},
+                                        'isolation_level': 1}).get_pool_options()
+        self.assertEqual({key: value for key, value in options.items() if key != 'kwargs'}, {
+            'open': True, 'name': 'django-pool-test', 'min_size': 2, 'max_size': 10, 'timeout': 10.0,
+        })
+        kwargs = options['kwargs']
+        self.assertEqual((kwargs['dbname'], kwargs['user'], kwargs['password'], kwargs['host'], kwargs['port']),
+                         ('log', 'log_user', 'secret', 'db', '5432'))
+        self.assertIs(kwargs['autocommit'], True)
+        # プールの設定と分離レベルは接続の引数には渡さない
+        self.assertNotIn('pool', kwargs)
+        self.assertNotIn('isolation_level', kwargs)
+
+    def test_default_pool(self):
+        # OPTIONS['pool'] が True ならプールの既定値を使う
+        options = make_wrapper(OPTIONS={'pool': True}).get_pool_options()
+        self.assertEqual(set(options), {'kwargs', 'open', 'name'})
+
+    def test_conn_max_age(self):
+        with self.assertRaises(ImproperlyConfigured):
+            make_wrapper(CONN_MAX_AGE=60).get_pool_options()
+
+
+@skipUnless(HAS_PSYCOPG_POOL, 'psycopg_pool がインストールされていない')
+class TestCreatePool(SimpleTestCase):
+    def test_create_pool(self):
+        wrapper = make_wrapper(CONN_HEALTH_CHECKS=False)
+        with mock.patch('psycopg_pool.ConnectionPool') as pool_class:
+            self.assertIs(wrapper._create_pool(), pool_class.return_value)
+        pool_class.assert_called_once_with(check=None, **wrapper.get_pool_options())
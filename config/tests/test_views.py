@@ -1,4 +1,10 @@
+from unittest import mock
+
+from django.db import OperationalError
 from django.test import TestCase
+from django.urls import reverse
+
+from config import views
 
 
 class TestHome(TestCase):
@@ -13,4 +19,22 @@ class TestHome(TestCase):
     def test_html(self):
         response = self.client.get('/')
         self.assertContains(response, '<li class="breadcrumb-item active" aria-current="page">ホーム</li>')
-    
\ No newline at end of file
+    
+
+class TestReadiness(TestCase):
+    """
+    /readyz/ は DB とキャッシュに接続できれば 200、できなければ 503 を返す
+    """
+
+    def test_ready(self):
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok', 'checks': {'database': 'ok', 'cache': 'ok'}})
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_database_error(self):
+        with mock.patch.dict(views.READINESS_CHECKS, database=mock.Mock(side_effect=OperationalError('down'))):
+            with self.assertLogs('config.views', 'WARNING'):
+                response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks'], {'database': 'error', 'cache': 'ok'})
@@ -21,11 +21,15 @@ from django.urls import path, include
 from django.views.generic import TemplateView
 import sys
 
+from config import views
+
 urlpatterns = [
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('log/', include('log.urls')),
+    path('readyz/', views.readiness, name='readiness'),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # Add debug toolbar if DEBUG is True and not executed by manage.py test command
@@ -0,0 +1,63 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+
+from config import metrics as metrics_store
+
+logger = logging.getLogger(__name__)
+
+
+def _check_database():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def _check_cache():
+    cache.set('config:readiness', 1, 10)
+    cache.get('config:readiness')
+
+
+READINESS_CHECKS = {
+    'database': _check_database,
+    'cache': _check_cache,
+}
+
+
+@never_cache
+def readiness(request):
+    """
+    リクエストを受け付けられる状態か (DB とキャッシュに接続できるか) を返す
+
+    ロードバランサや docker compose の healthcheck から使う。問題があれば 503 を返す。
+    """
+    checks = {}
+    for name, check in READINESS_CHECKS.items():
+        try:
+            check()
+        except Exception as e:
+            logger.warning('readiness check failed: %s: %s', name, e)
+            checks[name] = 'error'
+        else:
+            checks[name] = 'ok'
+    ok = all(status == 'ok' for status in checks.values())
+    return JsonResponse({'status': 'ok' if ok else 'error', 'checks': checks}, status=200 if ok else 503)
+
+
+@never_cache
+def metrics(request):
+    """
+    Prometheus のテキスト形式のメトリクス (config/metrics.py)
+
+    METRICS_TOKEN を指定したときは Authorization: Bearer <METRICS_TOKEN> がなければ 401 を返す。
+    """
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics_store.exposition(metrics_store.store.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from log.models import Tag, Article, Comment
+from log import search
+from log.imaging import enqueue_image_job
+from log.models import Tag, Article, Comment, ImageJob
 
 
 @admin.register(Tag)
@@ -10,11 +12,35 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Article)
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('user', 'title', 'created_at', 'updated_at',)
-    search_fields = ('title', 'content')
+    list_display = ('user', 'title', 'comment_count', 'created_at', 'updated_at',)
+    # 検索は LIKE ではなく全文検索のインデックスで行う (get_search_results)
+    search_fields = ('title', 'body')
+    search_help_text = 'タイトル・本文・コメントを全文検索します。'
+    # updated_at と version は保存時に更新される (log/models.py の TrackedModel)
+    readonly_fields = ('comment_count', 'last_commented_at', 'tag_count', 'thumbnail_ready', 'variants_ready',
+                       'photo_width', 'photo_height', 'updated_at', 'version',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search.filter_articles(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'photo' in form.changed_data:
+            enqueue_image_job(obj)
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('user', 'body', 'created_at', 'updated_at',)
+    # Comment.__str__ は記事のタイトルを使うので、記事も一緒に取得する
+    list_select_related = ('user', 'article')
     search_fields = ('body',)
+    readonly_fields = ('updated_at', 'version',)
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('article', 'photo', 'attempts', 'available_at', 'created_at',)
+    list_select_related = ('article',)
@@ -0,0 +1,224 @@
+"""
+読み取り専用の JSON API (/log/api/articles, /log/api/comments, /log/api/tags)
+
+- ?fields=title,created_at で返す項目を絞る (id は常に返す)。モデルのインスタンスは作らず、
+  必要な列だけを .values() で取得した dict からそのまま組み立てる
+- 記事の ?include=tags,comments は、ページの記事の分を関係ごとに 1 回のクエリでまとめて取得する
+- 一覧は (created_at, id) のカーソルページネーション (log/pagination.py)。?cursor= に next / previous を指定する
+- 項目は常に同じ順に並べ、区切りの空白を入れず、日本語もエスケープしない (gzip で縮みやすい)。
+  ビュー (log/views.py) はレスポンスを gzip で圧縮する
+
+レスポンスの形式
+
+    {"data": [{"id": 3, "title": "...", "tags": [{"id": 1, "name": "...", "slug": "..."}]}, ...],
+     "next": "<cursor>", "previous": null}
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.http import JsonResponse
+
+from log.models import MAX_ID, Article, Comment
+from log.pagination import CursorPaginator
+
+# 項目の名前と .values() の参照先。この順にレスポンスに並べる
+ARTICLE_FIELDS = {
+    'id': 'id',
+    'user': 'user__username',
+    'title': 'title',
+    'body': 'body',
+    'photo': 'photo',
+    'photo_width': 'photo_width',
+    'photo_height': 'photo_height',
+    'tag_count': 'tag_count',
+    'comment_count': 'comment_count',
+    'last_commented_at': 'last_commented_at',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'version': 'version',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'article': 'article_id',
+    'user': 'user__username',
+    'body': 'body',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'version': 'version',
+}
+# タグはレジストリ (log/tag_registry.py) の TagEntry の属性
+TAG_FIELDS = {
+    'id': 'pk',
+    'name': 'name',
+    'slug': 'slug',
+    'article_count': 'article_count',
+}
+ARTICLE_INCLUDES = ('tags', 'comments')
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def _parse_names(value, allowed, param):
+    names = {name.strip() for name in value.split(',')} - {''}
+    unknown = names.difference(allowed)
+    if unknown:
+        raise InvalidQuery(f'{param} に指定できない名前です: {", ".join(sorted(unknown))}')
+    return [name for name in allowed if name in names]
+
+
+def parse_fields(value, allowed):
+    """
+    ?fields= を allowed の順に並べた項目のリストにする。未指定なら全項目。id は常に含める
+    """
+    if not value:
+        return list(allowed)
+    return _parse_names(f'id,{value}', allowed, 'fields')
+
+
+def parse_include(value, allowed):
+    return _parse_names(value or '', allowed, 'include')
+
+
+def parse_limit(value):
+    """
+    ?limit= を 1 ページの件数にする。未指定なら LOG_API_PAGE_SIZE、最大 LOG_API_MAX_PAGE_SIZE
+    """
+    if not value:
+        return settings.LOG_API_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise InvalidQuery('limit には 1 以上の整数を指定してください。')
+    return min(limit, settings.LOG_API_MAX_PAGE_SIZE)
+
+
+def parse_id(value, param):
+    try:
+        number = int(value)
+    except ValueError:
+        raise InvalidQuery(f'{param} には整数を指定してください。')
+    if not 1 <= number <= MAX_ID:
+        raise InvalidQuery(f'{param} には 1 から {MAX_ID} までの整数を指定してください。')
+    return number
+
+
+def _photo_url(name):
+    return default_storage.url(name) if name else None
+
+
+# 保存されている値のままでは返せない項目の変換
+CONVERTERS = {'photo': _photo_url}
+
+
+def _values(queryset, fields, lookups):
+    """
+    fields の参照先と、カーソルに使う id / created_at だけを取得する queryset
+    """
+    return queryset.values(*dict.fromkeys(['id', 'created_at', *(lookups[name] for name in fields)]))
+
+
+def _serialize(row, fields, lookups):
+    item = {}
+    for name in fields:
+        value = row[lookups[name]]
+        convert = CONVERTERS.get(name)
+        item[name] = value if convert is None else convert(value)
+    return item
+
+
+def _include_tags(article_ids):
+    result = {pk: [] for pk in article_ids}
+    links = Article.tags.through.objects.filter(article__in=article_ids).order_by('tag__name', 'tag_id')
+    for article_id, pk, name, slug in links.values_list('article_id', 'tag_id', 'tag__name', 'tag__slug'):
+        result[article_id].append({'id': pk, 'name': name, 'slug': slug})
+    return result
+
+
+def _include_comments(article_ids):
+    """
+    記事ごとに新しい順で最大 LOG_API_INCLUDED_COMMENTS 件。すべてのコメントは /log/api/comments?article= で読む
+    """
+    fields = [name for name in COMMENT_FIELDS if name != 'article']
+    rank = Window(RowNumber(), partition_by=F('article_id'), order_by=[F('created_at').desc(), F('id').desc()])
+    rows = _values(
+        Comment.objects.filter(article__in=article_ids).annotate(rank=rank).filter(
+            rank__lte=settings.LOG_API_INCLUDED_COMMENTS).order_by('-created_at', '-id'),
+        [*fields, 'article'], COMMENT_FIELDS)
+    result = {pk: [] for pk in article_ids}
+    for row in rows:
+        result[row['article_id']].append(_serialize(row, fields, COMMENT_FIELDS))
+    return result
+
+
+INCLUDES = {'tags': _include_tags, 'comments': _include_comments}
+
+
+def _serialize_articles(rows, fields, include):
+    data = [_serialize(row, fields, ARTICLE_FIELDS) for row in rows]
+    if not data:
+        return data
+    article_ids = [item['id'] for item in data]
+    for name in include:
+        related = INCLUDES[name](article_ids)
+        for item in data:
+            item[name] = related[item['id']]
+    return data
+
+
+def _page(queryset, fields, lookups, params):
+    paginator = CursorPaginator(_values(queryset, fields, lookups), parse_limit(params.get('limit')))
+    return paginator.page(params.get('cursor'))
+
+
+def _page_payload(page, data):
+    return {'data': data, 'next': page.next_cursor, 'previous': page.previous_cursor}
+
+
+def list_articles(queryset, params):
+    """
+    記事の一覧の 1 ページ分。params は request.GET
+    """
+    fields = parse_fields(params.get('fields'), ARTICLE_FIELDS)
+    include = parse_include(params.get('include'), ARTICLE_INCLUDES)
+    page = _page(queryset, fields, ARTICLE_FIELDS, params)
+    return _page_payload(page, _serialize_articles(page.object_list, fields, include))
+
+
+def get_article(pk, params):
+    """
+    記事 1 件。記事がなければ None
+    """
+    if not 1 <= pk <= MAX_ID:
+        return None
+    fields = parse_fields(params.get('fields'), ARTICLE_FIELDS)
+    include = parse_include(params.get('include'), ARTICLE_INCLUDES)
+    data = _serialize_articles(list(_values(Article.objects.filter(pk=pk), fields, ARTICLE_FIELDS)), fields, include)
+    return {'data': data[0]} if data else None
+
+
+def list_comments(queryset, params):
+    """
+    コメントの一覧の 1 ページ分 (新しい順)
+    """
+    fields = parse_fields(params.get('fields'), COMMENT_FIELDS)
+    parse_include(params.get('include'), ())
+    page = _page(queryset, fields, COMMENT_FIELDS, params)
+    return _page_payload(page, [_serialize(row, fields, COMMENT_FIELDS) for row in page.object_list])
+
+
+def list_tags(tags, params):
+    """
+    タグの一覧 (名前順)。タグは数が少なくレジストリにそろっているので、ページネーションはしない
+    """
+    fields = parse_fields(params.get('fields'), TAG_FIELDS)
+    parse_include(params.get('include'), ())
+    return {'data': [{name: getattr(tag, TAG_FIELDS[name]) for name in fields} for tag in tags]}
+
+
+def json_response(payload, status=200):
+    return JsonResponse(payload, status=status, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class LogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'log'
+
+    def ready(self):
+        from django.conf import settings
+
+        from config import metrics
+        from log import signals  # noqa: F401
+        from log import slowlog
+        # DB の接続・テンプレート・キャッシュのバックエンドに、プロセス全体で 1 回だけ計測を付ける
+        if 'config.metrics.MetricsMiddleware' in settings.MIDDLEWARE:
+            metrics.install()
+        # 遅いクエリの記録 (LOG_SLOW_QUERY_DIR が空なら何もしない)
+        slowlog.install()
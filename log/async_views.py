@@ -0,0 +1,143 @@
+"""
+読み取り専用のビューの非同期版 (ASGI 向け)
+
+log/views.py の同名のビューを継承し、データの取得だけを非同期の ORM (aiterator / aget / acount) で行う。
+LOG_ASYNC_VIEWS が有効なときに log/urls.py で使われる。
+
+- prefetch_related() は Django 4.2 では非同期で使えないので、関連するオブジェクトは別のクエリで
+  取得して、prefetch したときと同じ場所に入れる (テンプレートで追加のクエリが発生しないようにする)
+- テンプレートはビューの中で描画する。描画中に DB へアクセスすると SynchronousOnlyOperation になるので、
+  request.user とメッセージ(セッション)はビューの最初にまとめて読み込んでおく
+- Django は ATOMIC_REQUESTS の有効な DB があると非同期のビューを実行しない (RuntimeError) ので、
+  リクエスト全体のトランザクションから外す。コメントの投稿は保存をトランザクションの中で行っている
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.core.exceptions import BadRequest
+from django.core.paginator import InvalidPage
+from django.db import connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404
+from django.shortcuts import render
+
+from log import views
+from log.cache import aget_versions
+from log.models import Article, Comment, Tag
+from log.pagination import CursorPaginator, InvalidCursor
+from log.tag_registry import aget_tags, get_tag
+
+
+def _load_request(request):
+    # 遅延評価されるユーザとメッセージを読み込む (どちらもセッションを読むので DB にアクセスする)
+    request.user.is_authenticated
+    len(messages.get_messages(request))
+
+
+def _set_prefetched(instance, name, objects):
+    """
+    prefetch_related(name) で取得したときと同じように、instance の name の関連を objects にする
+    """
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    instance.__dict__.setdefault('_prefetched_objects_cache', {})[name] = queryset
+
+
+class AsyncRequestMixin:
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        for alias in connections:
+            view = transaction.non_atomic_requests(using=alias)(view)
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        await sync_to_async(_load_request)(request)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class ArticleListView(AsyncRequestMixin, views.ArticleListView):
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_article_queryset()
+        if self.use_cursor_pagination():
+            paginator = CursorPaginator(queryset, self.paginate_by)
+            try:
+                page_obj = await paginator.apage(request.GET.get('cursor'))
+            except InvalidCursor as e:
+                raise BadRequest(str(e))
+        else:
+            paginator, page_obj = await self.apaginate(queryset)
+        articles = list(page_obj.object_list)
+        await self.aload_latest_comments(articles)
+
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page_obj,
+            'is_paginated': page_obj.has_other_pages(),
+            'object_list': articles,
+            'articles': articles,
+        }
+        versions = await aget_versions(*self.get_card_versions(articles))
+        if self.registry_tags is None:
+            self.registry_tags = await aget_tags()
+        context.update(self.get_page_context(page_obj, articles, self.registry_tags, versions))
+        return render(request, self.template_name, context)
+
+    async def apaginate(self, queryset):
+        """
+        ListView.paginate_queryset() と同じページを、acount() と aiterator() で取得する
+        """
+        paginator = self.get_paginator(queryset, self.paginate_by)
+        # Paginator.count は cached_property なので、先に非同期で数えた値を入れておく
+        paginator.count = await queryset.acount()
+        page_number = self.request.GET.get(self.page_kwarg) or 1
+        try:
+            number = paginator.num_pages if page_number == 'last' else paginator.validate_number(page_number)
+        except InvalidPage as e:
+            raise Http404(f'Invalid page ({page_number}): {e}')
+        bottom = (number - 1) * paginator.per_page
+        rows = [article async for article in queryset[bottom:bottom + paginator.per_page].aiterator()]
+        return paginator, paginator._get_page(rows, number, paginator)
+
+    async def aload_latest_comments(self, articles):
+        """
+        記事ごとの最新のコメントを 1 クエリで取得して article.latest_comments に入れる
+        """
+        latest = {article.pk: [] for article in articles}
+        if latest:
+            comments = self.get_latest_comments_queryset().filter(article_id__in=latest).annotate(
+                rank=Window(RowNumber(), partition_by=F('article_id'), order_by=[F('created_at').desc(), F('id').desc()]),
+            ).filter(rank__lte=self.latest_comments_count)
+            async for comment in comments.aiterator():
+                latest[comment.article_id].append(comment)
+        for article in articles:
+            article.latest_comments = latest[article.pk]
+
+
+class ArticleTagListView(ArticleListView, views.ArticleTagListView):
+    async def get(self, request, *args, **kwargs):
+        self.registry_tags = await aget_tags()
+        self.tag = get_tag(self.kwargs['slug'], self.registry_tags)
+        if self.tag is None:
+            raise Http404('タグが見つかりません。')
+        return await super().get(request, *args, **kwargs)
+
+
+class ArticleDetailView(AsyncRequestMixin, views.ArticleDetailView):
+    async def get(self, request, *args, **kwargs):
+        try:
+            article = await Article.objects.select_related('user').aget(pk=self.kwargs['pk'])
+        except Article.DoesNotExist:
+            raise Http404('記事が見つかりません。')
+        _set_prefetched(article, 'tags', [tag async for tag in Tag.objects.filter(article=article).aiterator()])
+        _set_prefetched(article, 'comments', [
+            comment async for comment in Comment.objects.filter(article=article).select_related('user').aiterator()
+        ])
+        self.object = article
+        return render(request, self.template_name, {'view': self, 'object': article, 'article': article})
+
+    async def post(self, request, *args, **kwargs):
+        # コメントの投稿は同期版の処理をそのまま使う
+        return await sync_to_async(super().post)(request, *args, **kwargs)
@@ -0,0 +1,143 @@
+"""
+ビューのベンチマーク (benchmark_views コマンド)
+
+代表的な画面 (記事一覧・深いページ・タグ別一覧・詳細・コメントの投稿) にテストクライアントでリクエストを送り、
+リクエストごとのクエリ数・DB の時間・テンプレートの描画時間・レイテンシと、1 秒あたりのリクエスト数を測る。
+結果は JSON にして保存し、別のコミットで測った結果と比べられる (compare)。
+"""
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from config import metrics
+from config.metrics import percentile
+from log.models import Article, Comment, Tag
+
+# 比べる指標と、値が大きいほど悪いかどうか
+METRICS = {
+    'queries': True,
+    'db_ms': True,
+    'render_ms': True,
+    'mean_ms': True,
+    'p90_ms': True,
+    'rps': False,
+}
+
+
+def build_scenarios(per_page=5):
+    """
+    データベースにある記事・タグから、ベンチマークする (名前, メソッド, パス, データ) のリストを作る
+    """
+    scenarios = [('article_list', 'get', reverse('log:article_list'), None)]
+    count = Article.objects.count()
+    if count > per_page * 50:
+        scenarios.append(('article_list_deep', 'get', f'{reverse("log:article_list")}?page=50', None))
+    tag = Tag.objects.annotate(n=Count('article')).order_by('-n').first()
+    if tag:
+        scenarios.append(('article_tag_list', 'get', reverse('log:article_tag_list', args=[tag.slug]), None))
+    article = Article.objects.order_by('-comment_count', '-id').first()
+    if article:
+        detail = reverse('log:article_detail', args=[article.pk])
+        scenarios.append(('article_detail', 'get', detail, None))
+        scenarios.append(('comment_post', 'post', detail, {'body': 'ベンチマークのコメント'}))
+    scenarios.append(('article_search', 'get', f'{reverse("log:article_search")}?q=写真', None))
+    return scenarios
+
+
+def run_scenario(client, method, path, data, requests):
+    samples = []
+    statuses = set()
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        # クエリ数・DB の時間・テンプレートの描画時間は、メトリクス (config/metrics.py) と同じ計測で測る
+        with metrics.collecting() as stats:
+            response = getattr(client, method)(path, data) if data else getattr(client, method)(path)
+        elapsed = time.perf_counter() - request_started
+        statuses.add(response.status_code)
+        samples.append((elapsed * 1000, stats.queries, stats.db_seconds * 1000, stats.render_seconds * 1000))
+    wall = time.perf_counter() - started
+
+    latencies = [sample[0] for sample in samples]
+    return {
+        'requests': requests,
+        'status': sorted(statuses),
+        'queries': statistics.median(sample[1] for sample in samples),
+        'db_ms': statistics.median(sample[2] for sample in samples),
+        'render_ms': statistics.median(sample[3] for sample in samples),
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'rps': requests / wall,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(requests=20, warmup=2, user=None, only=None, host='localhost'):
+    """
+    すべてのシナリオを実行し、結果を JSON にできる dict で返す
+
+    user を指定するとログインした状態でリクエストする (コメントの投稿はログインが必要)。
+    ログインしていない場合はコメントの投稿を省く。
+    """
+    # INTERNAL_IPS (127.0.0.1) 以外のアドレスにして、開発環境の debug toolbar が表示されないようにする
+    client = Client(HTTP_HOST=host, REMOTE_ADDR='192.0.2.1')
+    if user is not None:
+        client.force_login(user)
+    metrics.install()
+    results = {}
+    for name, method, path, data in build_scenarios():
+        if only and name not in only:
+            continue
+        if method == 'post' and user is None:
+            continue
+        if warmup:
+            run_scenario(client, method, path, data, warmup)
+        results[name] = {'path': path, **run_scenario(client, method, path, data, requests)}
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'debug': settings.DEBUG,
+            'articles': Article.objects.count(),
+            'comments': Comment.objects.count(),
+            'tags': Tag.objects.count(),
+            'requests': requests,
+            'logged_in': user is not None,
+        },
+        'results': results,
+    }
+
+
+def compare(base, current, threshold=10.0):
+    """
+    2 つの結果を比べて、(シナリオ, 指標, 前の値, 今の値, 変化率 %, 悪化したか) のリストを返す
+
+    悪化したかどうかは、変化率が threshold % を超えて悪い方へ変わったかで判断する。
+    """
+    rows = []
+    for name, result in current['results'].items():
+        previous = base['results'].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_worse in METRICS.items():
+            before, after = previous[metric], result[metric]
+            change = (after - before) / before * 100 if before else (0.0 if after == before else float('inf'))
+            worse = change > threshold if higher_is_worse else change < -threshold
+            rows.append((name, metric, before, after, change, worse))
+    return rows
@@ -0,0 +1,271 @@
+"""
+ビューごとのクエリ数・重複クエリ・処理時間の予算 (query budget)
+
+予算はビューのクラス属性 query_budget に QueryBudget (メソッドごとに変えるときは {'get': ..., 'post': ...})
+で宣言する (log/views.py)。QueryBudgetMiddleware がリクエストごとに実行されたクエリを記録して予算と比べ、
+超えたときは LOG_QUERY_BUDGET に応じて次のようにする。
+
+- 'raise' (テストのとき): クエリ数・重複クエリ数を超えたら QueryBudgetExceeded を送出してテストを失敗させる。
+  処理時間はマシンの負荷で変わるので、'raise' でも送出せずに警告をログに出すだけにする
+- 'log' (既定): 超えた内容と SQL の指紋 (fingerprint) を構造化した警告としてログに出す
+- 'off': 記録しない (ミドルウェアを使わない)
+
+重複クエリは、リテラルを取り除いた SQL (指紋) が同じクエリの 2 回目以降の数で、N+1 を検出するためのもの。
+ビュー以外のコードは、テストで assert_query_budget() を使って同じように確かめられる。
+
+StreamingHttpResponse の本文を送信している間のクエリは、ミドルウェアを抜けた後なので数えない。
+"""
+import json
+import logging
+import re
+import time
+from collections import namedtuple, Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# queries: クエリ数の上限、duplicates: 重複クエリ数の上限、wall_ms: 処理時間の上限 (ミリ秒)。None は無制限
+QueryBudget = namedtuple('QueryBudget', ['queries', 'duplicates', 'wall_ms'], defaults=[None, 0, None])
+
+# 'raise' でも送出しない (ログに出すだけの) 項目
+LOG_ONLY = frozenset({'wall_ms'})
+
+# ログに出す指紋の数と長さ
+REPORT_FINGERPRINTS = 5
+FINGERPRINT_MAX_LENGTH = 300
+
+# トランザクションの制御文は数えない (テストではセーブポイントになり、本番と数が変わるため)
+_IGNORED = re.compile(r'\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT)\b', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, report):
+        self.report = report
+        super().__init__(f'query budget exceeded: {json.dumps(report, ensure_ascii=False, indent=2)}')
+
+
+def fingerprint(sql):
+    """
+    SQL の文字列・数値・パラメータを ? にし、IN (?, ?, ...) を IN (...) にまとめた文字列
+    """
+    sql = _STRING.sub('?', sql.replace('%s', '?'))
+    sql = _IN_LIST.sub('IN (...)', _NUMBER.sub('?', sql))
+    return _SPACES.sub(' ', sql).strip()
+
+
+def get_budget(view_func, method):
+    """
+    ビュー (関数か as_view() の戻り値) に宣言された、method のリクエストの予算 (なければ None)
+    """
+    budget = getattr(getattr(view_func, 'view_class', view_func), 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(method.lower())
+    return budget
+
+
+class QueryRecorder:
+    """
+    recording() のブロックの中で実行されたクエリの (SQL, 秒数) を記録し、予算と比べる
+    """
+
+    def __init__(self, budget=None, label=''):
+        self.budget = budget
+        self.label = label
+        self.queries = []
+        self.started = time.perf_counter()
+        self.finished = None
+        # URL の名前 (log:article_detail など)。log/slowlog.py が遅いクエリの記録に付ける
+        self.view_name = None
+
+    def record(self, sql, seconds):
+        if not _IGNORED.match(sql):
+            self.queries.append((sql, seconds))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def wall_ms(self):
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def fingerprints(self):
+        """
+        指紋ごとの (回数, 合計ミリ秒) を、回数の多い順の (指紋, 回数, 合計ミリ秒) のリストで返す
+        """
+        counts = Counter()
+        elapsed = Counter()
+        for sql, seconds in self.queries:
+            key = fingerprint(sql)
+            counts[key] += 1
+            elapsed[key] += seconds * 1000
+        return [(key, count, elapsed[key]) for key, count in counts.most_common()]
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for _, count, _ in self.fingerprints())
+
+    def violations(self):
+        if self.budget is None:
+            return []
+        measured = {'queries': len(self.queries), 'duplicates': self.duplicates, 'wall_ms': self.wall_ms}
+        return [name for name, limit in self.budget._asdict().items()
+                if limit is not None and measured[name] > limit]
+
+    def report(self, violations):
+        return {
+            'event': 'query_budget_exceeded',
+            'view': self.label,
+            'violations': violations,
+            'budget': self.budget._asdict(),
+            'queries': len(self.queries),
+            'duplicates': self.duplicates,
+            'wall_ms': round(self.wall_ms, 1),
+            'fingerprints': [
+                {'sql': key[:FINGERPRINT_MAX_LENGTH], 'count': count, 'ms': round(ms, 2)}
+                for key, count, ms in self.fingerprints()[:REPORT_FINGERPRINTS]
+            ],
+        }
+
+    def check(self, mode='raise', **extra):
+        """
+        予算を超えていれば、mode が 'raise' なら QueryBudgetExceeded を送出し、それ以外なら警告をログに出す
+        (LOG_ONLY の項目だけを超えたときは、mode によらずログに出す)
+        """
+        violations = self.violations()
+        if not violations:
+            return
+        report = {**self.report(violations), **extra}
+        if mode == 'raise' and not LOG_ONLY.issuperset(violations):
+            raise QueryBudgetExceeded(report)
+        logger.warning('query budget exceeded: %s', json.dumps(report, ensure_ascii=False),
+                       extra={'query_budget': report})
+
+
+# 記録中の QueryRecorder のタプル (リクエストと、それを囲む assert_query_budget のブロック)。
+# 非同期のビューで sync_to_async のスレッドから実行されるクエリにも引き継がれる
+_recorders = ContextVar('query_budget_recorders', default=())
+# 記録中かどうかによらず、すべてのクエリを (SQL, 秒数, many, context) で受け取る関数 (log/slowlog.py)
+_listeners = []
+
+
+def add_listener(listener):
+    """
+    すべてのクエリを受け取る関数を登録する (何度呼んでも 1 つだけ)
+
+    クエリの時間はこのモジュールの execute_wrapper でまとめて測り、機能ごとに execute_wrapper を増やさない。
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def current_recorder():
+    """
+    いちばん外側で記録中の QueryRecorder (リクエストのもの)。記録中でなければ None
+    """
+    recorders = _recorders.get()
+    return recorders[0] if recorders else None
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    recorders = _recorders.get()
+    if not recorders and not _listeners:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.record(sql, seconds)
+        for listener in _listeners:
+            listener(sql, seconds, many, context)
+
+
+@contextmanager
+def recording(recorder):
+    token = _recorders.set((*_recorders.get(), recorder))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+        recorder.finish()
+
+
+def install(connection, **kwargs):
+    """
+    接続に、記録中 (か add_listener() で登録された関数がある) ときだけクエリの時間を測る execute_wrapper を付ける
+    (何度呼んでも 1 つだけ)
+    """
+    if _execute_wrapper not in connection.execute_wrappers:
+        # connection.execute_wrapper() は末尾から外すので、先頭に入れてそれと干渉しないようにする
+        connection.execute_wrappers.insert(0, _execute_wrapper)
+
+
+# 新しいスレッドの接続・再接続した接続に付ける
+connection_created.connect(install, dispatch_uid='log.budgets.install')
+
+
+@contextmanager
+def assert_query_budget(budget, label=''):
+    """
+    ブロックの中で実行したクエリが budget を超えたら QueryBudgetExceeded を送出する (テスト用)
+    """
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    with recording(QueryRecorder(budget, label)) as recorder:
+        yield recorder
+    recorder.check('raise')
+
+
+class QueryBudgetMiddleware:
+    """
+    ビューの query_budget とリクエストのクエリ数・重複クエリ数・処理時間を比べる
+
+    セッションやユーザの読み込みも数えるため、MIDDLEWARE の先頭に置く。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.mode = settings.LOG_QUERY_BUDGET
+        if self.mode not in ('raise', 'log'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # ミドルウェアより先に開かれていた接続 (テストのデータベースなど) にも付ける
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with recording(QueryRecorder()) as recorder:
+            request.query_recorder = recorder
+            response = self.get_response(request)
+        recorder.check(self.mode, method=request.method, path=request.path)
+        return response
+
+    async def __acall__(self, request):
+        with recording(QueryRecorder()) as recorder:
+            request.query_recorder = recorder
+            response = await self.get_response(request)
+        recorder.check(self.mode, method=request.method, path=request.path)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        request.query_recorder.budget = get_budget(view_func, request.method)
+        request.query_recorder.label = f'{view.__module__}.{view.__qualname__}'
@@ -0,0 +1,305 @@
+"""
+記事一覧・タグ別一覧・詳細ページのキャッシュ
+
+キャッシュのキーにはバージョン(ランダムなトークン)を含めておき、書き込みがあったときは
+影響するバージョンだけを更新する(古いキーは参照されなくなり、そのうち期限切れで消える)。
+バージョンの更新は log/signals.py から行う。
+
+バージョンの名前
+- list: 記事一覧
+- tags: タグ名の表示 (詳細ページ)
+- tag:<slug>: タグ別一覧
+- article:<pk>: 記事の詳細ページと、一覧のカード
+- tag_registry: タグの一覧と記事数 (log/tag_registry.py)
+- feed / feed:<slug>: 新着記事のフィードとタグ別のフィード (log/feeds.py)。フィードに出ないコメントの変更では更新しない
+
+ページの ETag もバージョンから作るので、条件付き GET (If-None-Match) にはテンプレートを描画せずに 304 を返せる。
+"""
+import hashlib
+import uuid
+import weakref
+
+from asgiref.local import Local
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from log.models import Tag
+
+KEY_PREFIX = 'log'
+# バージョンを保存しておく秒数。期限が切れても新しいトークンになってページと ETag が 1 回作り直されるだけなので、
+# 参照されなくなったバージョン (存在しない記事やタグの URL で作られたものなど) がキャッシュに残り続けないようにする
+VERSION_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _version_key(name):
+    return f'{KEY_PREFIX}:version:{name}'
+
+
+def get_versions(*names, create=True):
+    """
+    バージョンを {名前: トークン} で返す。まだないものは create ならここで作り、そうでなければ結果に含めない
+    """
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing and create:
+        cache.set_many(missing, timeout=VERSION_TIMEOUT)
+        found.update(missing)
+    return {keys[key]: token for key, token in found.items()}
+
+
+async def aget_versions(*names, create=True):
+    """
+    get_versions() の非同期版
+    """
+    keys = {_version_key(name): name for name in names}
+    found = await cache.aget_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing and create:
+        await cache.aset_many(missing, timeout=VERSION_TIMEOUT)
+        found.update(missing)
+    return {keys[key]: token for key, token in found.items()}
+
+
+def bump(*names):
+    """
+    バージョンを更新して、そのバージョンを含むキーのキャッシュを無効にする
+    """
+    if names:
+        cache.set_many({_version_key(name): uuid.uuid4().hex for name in names}, timeout=VERSION_TIMEOUT)
+
+
+def discard_versions(*names):
+    """
+    バージョンを削除する。次に参照したときに新しいトークンになるので、bump() と同じくキャッシュを無効にする
+    """
+    if names:
+        cache.delete_many([_version_key(name) for name in names])
+
+
+async def adiscard_versions(*names):
+    """
+    discard_versions() の非同期版
+    """
+    if names:
+        await cache.adelete_many([_version_key(name) for name in names])
+
+
+def bump_on_commit(*names):
+    """
+    トランザクションのコミット後にバージョンを更新する
+
+    コミット前に更新すると、並行するリクエストが古いデータで新しいバージョンのキャッシュを作ってしまうため。
+    """
+    if names:
+        transaction.on_commit(lambda: bump(*names))
+
+
+def version_names(article_ids=(), tag_ids=(), tag_slugs=(), feeds=True):
+    """
+    記事・タグへの書き込みで無効にするバージョンの名前(記事一覧・記事・関係するタグ別一覧と、feeds なら各フィード)
+    """
+    slugs = set(tag_slugs)
+    if tag_ids:
+        slugs.update(Tag.objects.filter(pk__in=tag_ids).values_list('slug', flat=True))
+    if article_ids:
+        slugs.update(Tag.objects.filter(article__in=article_ids).values_list('slug', flat=True))
+    names = {'list', *[f'article:{pk}' for pk in article_ids], *[f'tag:{slug}' for slug in slugs]}
+    if feeds:
+        names.update(['feed', *[f'feed:{slug}' for slug in slugs]])
+    return names
+
+
+class _PendingInvalidation:
+    """
+    トランザクションの中で invalidate_on_commit() に渡された記事とタグ。コミット後にまとめて名前にして更新する
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.article_ids = set()
+        self.tag_ids = set()
+        # フィードに出ない変更 (コメント) だけがあった記事
+        self.article_ids_without_feeds = set()
+
+    def add(self, article_ids, tag_ids, feeds):
+        (self.article_ids if feeds else self.article_ids_without_feeds).update(article_ids)
+        self.tag_ids.update(tag_ids)
+
+    def __call__(self):
+        # 以降に呼ばれた invalidate_on_commit() は、新しく登録する
+        if _pending_invalidations().get(self.key) is self:
+            del _pending_invalidations()[self.key]
+        names = set()
+        if self.article_ids or self.tag_ids:
+            names |= version_names(article_ids=sorted(self.article_ids), tag_ids=sorted(self.tag_ids))
+        without_feeds = self.article_ids_without_feeds - self.article_ids
+        if without_feeds:
+            names |= version_names(article_ids=sorted(without_feeds), feeds=False)
+        bump(*names)
+
+
+# 登録した _PendingInvalidation を (DB の alias, セーブポイント) ごとに持つ。接続 (django.db.connections) と同じく
+# スレッド・非同期のコンテキストごとに分ける。ロールバックで on_commit から取り除かれたものは参照がなくなって消える
+_local = Local()
+
+
+def _pending_invalidations():
+    if not hasattr(_local, 'pending'):
+        _local.pending = weakref.WeakValueDictionary()
+    return _local.pending
+
+
+def invalidate_on_commit(article_ids=(), tag_ids=(), feeds=True, using=None):
+    """
+    コミット後に version_names() のバージョンを更新する
+
+    記事のタグはコミットの後に 1 回だけ読むので、記事の保存・タグの付け外し・サムネイルの状態の保存などで
+    同じトランザクションの中で何度呼んでもクエリは増えない。コミットの後には記事から辿れなくなるタグ
+    (外したタグ) は tag_ids で渡し、削除される記事やタグは先に version_names() で名前にして bump_on_commit() する。
+    """
+    connection = transaction.get_connection(using)
+    # 同じセーブポイントの中で登録したものだけを使う。savepoint_ids の None は atomic(savepoint=False) のブロック
+    key = (connection.alias, *[sid for sid in connection.savepoint_ids if sid is not None])
+    pending = _pending_invalidations().get(key)
+    if pending is None:
+        pending = _PendingInvalidation(key)
+        pending.add(article_ids, tag_ids, feeds)
+        _pending_invalidations()[key] = pending
+        transaction.on_commit(pending, using=connection.alias)
+    else:
+        pending.add(article_ids, tag_ids, feeds)
+
+
+def invalidate_articles(article_ids):
+    """
+    記事を update() などシグナルの送られない方法で更新したときに呼ぶ
+    """
+    invalidate_on_commit(article_ids=list(article_ids))
+
+
+def _versions_digest(versions):
+    return hashlib.md5(':'.join(f'{name}={token}' for name, token in sorted(versions.items())).encode()).hexdigest()
+
+
+def page_cache_key(request, versions):
+    url = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:page:{url}:{_versions_digest(versions)}'
+
+
+def page_etag(versions):
+    """
+    ページの ETag。ページが依存するバージョンと LOG_RELEASE から作る (URL ごとの値なので URL は含めない)
+    """
+    return f'"{_versions_digest({**versions, "release": settings.LOG_RELEASE})}"'
+
+
+class AnonymousPageCacheMixin:
+    """
+    ログインしていないユーザへの GET のレスポンスをまるごとキャッシュし、ETag を付けて条件付き GET に 304 を返す
+
+    get_page_cache_versions() でページが依存するバージョンの名前を返す。
+    表示待ちのメッセージ(messages)があるリクエストはキャッシュせず、ETag も付けない。
+    このリクエストで作ったバージョンは、200 以外を返したときに削除する (存在しない記事やタグの URL でキャッシュに書き込まない)。
+    非同期のビューでも使えるが、その場合は request.user とメッセージを先に読み込んでおくこと (log/async_views.py)。
+    """
+
+    def get_page_cache_versions(self):
+        raise NotImplementedError
+
+    def is_page_conditional(self, request):
+        # ログインしているときはユーザ名や CSRF トークンを含むので、ETag を付けない
+        return (request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+                and not len(messages.get_messages(request)))
+
+    def is_page_cacheable(self, request):
+        return settings.LOG_PAGE_CACHE_TIMEOUT > 0 and self.is_page_conditional(request)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_dispatch(request, *args, **kwargs)
+        if not self.is_page_conditional(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        names = self.get_page_cache_versions()
+        versions = get_versions(*names, create=False)
+        missing = [name for name in names if name not in versions]
+        versions.update(get_versions(*missing))
+        etag = page_etag(versions)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        cacheable = self.is_page_cacheable(request)
+        key = page_cache_key(request, versions)
+        cached = cache.get(key) if cacheable else None
+        if cached is not None:
+            return self._cached_response(cached, etag)
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except Exception:
+            # Http404 など
+            discard_versions(*missing)
+            raise
+        if self._should_store(response):
+            response['ETag'] = etag
+            if cacheable:
+                cache.set(key, self._store_value(response), settings.LOG_PAGE_CACHE_TIMEOUT)
+        elif response.status_code != 200:
+            discard_versions(*missing)
+        return response
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        if not self.is_page_conditional(request):
+            return await super().dispatch(request, *args, **kwargs)
+
+        names = self.get_page_cache_versions()
+        versions = await aget_versions(*names, create=False)
+        missing = [name for name in names if name not in versions]
+        versions.update(await aget_versions(*missing))
+        etag = page_etag(versions)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        cacheable = self.is_page_cacheable(request)
+        key = page_cache_key(request, versions)
+        cached = await cache.aget(key) if cacheable else None
+        if cached is not None:
+            return self._cached_response(cached, etag)
+
+        try:
+            response = await super().dispatch(request, *args, **kwargs)
+        except Exception:
+            await adiscard_versions(*missing)
+            raise
+        if self._should_store(response):
+            response['ETag'] = etag
+            if cacheable:
+                await cache.aset(key, self._store_value(response), settings.LOG_PAGE_CACHE_TIMEOUT)
+        elif response.status_code != 200:
+            await adiscard_versions(*missing)
+        return response
+
+    def _cached_response(self, cached, etag):
+        content, content_type = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Page-Cache'] = 'hit'
+        response['ETag'] = etag
+        return response
+
+    def _should_store(self, response):
+        return response.status_code == 200 and not response.cookies and not response.streaming
+
+    def _store_value(self, response):
+        if hasattr(response, 'render'):
+            response.render()
+        response['X-Page-Cache'] = 'miss'
+        return response.content, response['Content-Type']
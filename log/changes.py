@@ -0,0 +1,127 @@
+"""
+変更フィード (/log/api/changes)
+
+記事・コメント・タグ・記事のタグの付け外しの変更を Change に追記しておき (log/signals.py)、
+クライアント (モバイルアプリや検索のインデクサ) は前回のカーソルより後の変更だけを読む。
+
+- 記録は対象の種類と pk だけで、内容は読み出すときに種類ごとに 1 回のクエリでまとめて取得する (常に最新の値)
+- 削除は deleted の記録 (tombstone) で表す。記事の削除は、その記事のコメントとタグの付け外しの削除も表す
+- 同じ対象の古い記録は compact() (compact_changes コマンド) で削除する。最新の記録は削除しないので、
+  どのカーソルから読んでも (0 から読んでも) すべての対象の最新の状態がそろう
+- 記録は変更と同じトランザクションで追記する。先に pk を振られた記録が後からコミットされても読み飛ばさないように、
+  追記から LOG_CHANGES_SETTLE_SECONDS 秒たっていない記録と、それより後の記録はまだ返さない
+
+読み飛ばさないのは best-effort で、追記からコミットまでが LOG_CHANGES_SETTLE_SECONDS より長いトランザクション
+(と、それ以上のサーバ間の時計のずれ) があると、その記録はコミットされる前にカーソルを追い越されて読み飛ばされる。
+そのため record() はトランザクションのなるべく最後 (画像の処理やインポートの登録が終わった後) に呼ぶ。
+読み飛ばしが許されないクライアントは、ときどき since=0 から読み直して全件の最新の状態をそろえる。
+
+レスポンスの形式
+
+    {"changes": [{"cursor": 12, "type": "article", "id": 3, "deleted": false, "data": {...}}, ...],
+     "next": 12, "has_more": false}
+
+次は ?since=<next> で読む。has_more が true ならすぐに続きを読める。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import BigIntegerField, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from log.models import MAX_ID, Article, Change, Comment, Tag
+
+ARTICLE = 'article'
+COMMENT = 'comment'
+TAG = 'tag'
+ARTICLE_TAGS = 'article_tags'
+
+
+def record(kind, object_ids, deleted=False):
+    """
+    object_ids の変更を追記する (呼び出し元のトランザクションの中で)
+    """
+    Change.objects.bulk_create([Change(kind=kind, object_id=pk, deleted=deleted) for pk in object_ids])
+
+
+def _articles(pks):
+    rows = Article.objects.filter(pk__in=pks).values(
+        'id', 'user__username', 'title', 'body', 'photo', 'created_at', 'updated_at', 'version')
+    return {row['id']: {**row, 'user': row.pop('user__username')} for row in rows}
+
+
+def _comments(pks):
+    rows = Comment.objects.filter(pk__in=pks).values(
+        'id', 'article_id', 'user__username', 'body', 'created_at', 'updated_at', 'version')
+    return {row['id']: {**row, 'article': row.pop('article_id'), 'user': row.pop('user__username')} for row in rows}
+
+
+def _tags(pks):
+    return {row['id']: row for row in Tag.objects.filter(pk__in=pks).values('id', 'name', 'slug')}
+
+
+def _article_tags(pks):
+    # 削除された記事は記事の tombstone で表すので、存在する記事だけを返す
+    result = {pk: {'article': pk, 'tags': []} for pk in Article.objects.filter(pk__in=pks).values_list('pk', flat=True)}
+    links = Article.tags.through.objects.filter(article__in=list(result)).order_by('tag_id')
+    for article_id, tag_id in links.values_list('article_id', 'tag_id'):
+        result[article_id]['tags'].append(tag_id)
+    return result
+
+
+LOADERS = {ARTICLE: _articles, COMMENT: _comments, TAG: _tags, ARTICLE_TAGS: _article_tags}
+
+
+def read(since=0, limit=None):
+    """
+    カーソル since より後の変更を最大 limit 件返す。戻り値は (変更のリスト, 次のカーソル, 続きがあるか)
+
+    同じ対象の変更が複数あれば最後の 1 件だけを返す。その後に削除された対象の変更は返さない (後の tombstone で分かる)。
+    """
+    limit = limit or settings.LOG_CHANGES_PAGE_SIZE
+    settled = timezone.now() - timedelta(seconds=settings.LOG_CHANGES_SETTLE_SECONDS)
+    # まだ落ち着いていない最初の記録の手前までを返す (それより後の記録を先に返すと、カーソルが追い越してしまう)
+    unsettled = Change.objects.filter(pk__gt=since, created_at__gt=settled).order_by('pk').values('pk')[:1]
+    bound = Coalesce(Subquery(unsettled), Value(MAX_ID), output_field=BigIntegerField())
+    rows = list(Change.objects.filter(pk__gt=since, pk__lt=bound).order_by('pk').values_list(
+        'pk', 'kind', 'object_id', 'deleted')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], since, False
+
+    latest = {}
+    for row in rows:
+        latest[row[1], row[2]] = row
+    wanted = {}
+    for pk, kind, object_id, deleted in latest.values():
+        if not deleted:
+            wanted.setdefault(kind, set()).add(object_id)
+    loaded = {kind: LOADERS[kind](object_ids) for kind, object_ids in wanted.items()}
+
+    changes = []
+    for pk, kind, object_id, deleted in sorted(latest.values()):
+        data = None if deleted else loaded[kind].get(object_id)
+        if data is None and not deleted:
+            continue
+        changes.append({'cursor': pk, 'type': kind, 'id': object_id, 'deleted': deleted, 'data': data})
+    return changes, rows[-1][0], has_more
+
+
+def compact(before=None, batch_size=10000):
+    """
+    同じ対象のより新しい記録がある記録を削除し、削除した件数を返す。before を指定すると、それより前の記録だけを対象にする
+    """
+    queryset = Change.objects.all() if before is None else Change.objects.filter(created_at__lt=before)
+    bounds = queryset.order_by('pk').values_list('pk', flat=True)
+    first, last = bounds.first(), bounds.last()
+    if first is None:
+        return 0
+    newer = Change.objects.filter(kind=OuterRef('kind'), object_id=OuterRef('object_id'), pk__gt=OuterRef('pk'))
+    deleted = 0
+    # 1 回の DELETE が長くならないように、pk の範囲ごとに削除する
+    for start in range(first, last + 1, batch_size):
+        count, _ = queryset.filter(pk__gte=start, pk__lt=start + batch_size).filter(Exists(newer)).delete()
+        deleted += count
+    return deleted
@@ -0,0 +1,93 @@
+"""
+Article に非正規化して持たせている集計値 (comment_count / last_commented_at / tag_count) の更新処理
+
+通常はシグナル(log/signals.py)から呼ばれる。ずれてしまった場合は repair_article_counters コマンドで修復する。
+"""
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from log.cache import invalidate_articles
+from log.models import Article, Comment
+
+
+def _comment_count_subquery():
+    return Coalesce(Subquery(
+        Comment.objects.filter(article=OuterRef('pk')).order_by().values('article').annotate(
+            count=Count('*')).values('count'),
+        output_field=IntegerField()), 0)
+
+
+def _last_commented_at_subquery():
+    return Subquery(
+        Comment.objects.filter(article=OuterRef('pk')).order_by().values('article').annotate(
+            last=Max('created_at')).values('last'))
+
+
+def _tag_count_subquery():
+    through = Article.tags.through
+    return Coalesce(Subquery(
+        through.objects.filter(article=OuterRef('pk')).order_by().values('article').annotate(
+            count=Count('*')).values('count'),
+        output_field=IntegerField()), 0)
+
+
+def increment_comment_count(comment):
+    """
+    コメントが 1 件追加されたときの更新。F 式で 1 文の UPDATE にする
+    """
+    created_at = Value(comment.created_at)
+    Article.objects.filter(pk=comment.article_id).update(
+        comment_count=F('comment_count') + 1,
+        last_commented_at=Greatest(Coalesce('last_commented_at', created_at), created_at),
+    )
+
+
+def refresh_comment_counters(article_ids):
+    """
+    コメントの削除・付け替えがあった記事の comment_count / last_commented_at を数え直す
+    """
+    Article.objects.filter(pk__in=article_ids).update(
+        comment_count=_comment_count_subquery(),
+        last_commented_at=_last_commented_at_subquery(),
+    )
+
+
+def refresh_tag_counters(article_ids):
+    """
+    タグの付け外しがあった記事の tag_count を数え直す。タグの付け外しは記事の変更なので updated_at と version も更新する
+    """
+    Article.objects.filter(pk__in=article_ids).touch(tag_count=_tag_count_subquery())
+
+
+def repair_counters(queryset=None, batch_size=1000):
+    """
+    実際の値とずれている記事だけを数え直し、修復した件数を返す
+    """
+    queryset = Article.objects.all() if queryset is None else queryset
+    drifted = queryset.annotate(
+        real_comment_count=_comment_count_subquery(),
+        real_last_commented_at=_last_commented_at_subquery(),
+        real_tag_count=_tag_count_subquery(),
+    ).filter(
+        ~Q(comment_count=F('real_comment_count'))
+        | ~Q(tag_count=F('real_tag_count'))
+        | (Q(last_commented_at__isnull=False, real_last_commented_at__isnull=False)
+           & ~Q(last_commented_at=F('real_last_commented_at')))
+        | Q(last_commented_at__isnull=True, real_last_commented_at__isnull=False)
+        | Q(last_commented_at__isnull=False, real_last_commented_at__isnull=True)
+    ).order_by('pk').values_list('pk', flat=True)
+
+    repaired = 0
+    last_pk = 0
+    while True:
+        pks = list(drifted.filter(pk__gt=last_pk)[:batch_size])
+        if not pks:
+            return repaired
+        Article.objects.filter(pk__in=pks).update(
+            comment_count=_comment_count_subquery(),
+            last_commented_at=_last_commented_at_subquery(),
+            tag_count=_tag_count_subquery(),
+        )
+        invalidate_articles(pks)
+        repaired += len(pks)
+        last_pk = pks[-1]
@@ -0,0 +1,41 @@
+"""
+新着記事の Atom / RSS フィード (/log/feed/atom/, /log/tag/<slug>/feed/atom/ など)
+
+フィードのビュー (log/views.py の ArticleFeedView) は AnonymousPageCacheMixin で XML をまるごとキャッシュし、
+フィードのバージョン (log/cache.py の feed / feed:<slug>) から作った ETag を付ける。
+フィードのバージョンは記事・記事のタグの付け外し・タグの変更で更新され、コメントでは更新されないので、
+ポーリングするリーダーには、フィードの記事が変わるまで DB にアクセスせずに 304 かキャッシュの内容を返す。
+"""
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+
+from log.models import Article
+
+FORMATS = {'atom': Atom1Feed, 'rss': Rss201rev2Feed}
+
+
+def _tag_names(article_ids):
+    result = {pk: [] for pk in article_ids}
+    links = Article.tags.through.objects.filter(article__in=article_ids).order_by('tag__name', 'tag_id')
+    for article_id, name in links.values_list('article_id', 'tag__name'):
+        result[article_id].append(name)
+    return result
+
+
+def build_feed(feed_type, request, queryset, title, link, description, limit):
+    """
+    queryset の新しい記事 limit 件のフィード (feed_type は FORMATS の値)。記事とタグを 1 回ずつ取得する
+    """
+    rows = list(queryset.order_by('-created_at', '-id').values(
+        'id', 'user__username', 'title', 'body', 'created_at', 'updated_at')[:limit])
+    tags = _tag_names([row['id'] for row in rows]) if rows else {}
+    feed = feed_type(title=title, link=request.build_absolute_uri(link), description=description,
+                     language='ja', feed_url=request.build_absolute_uri())
+    for row in rows:
+        url = request.build_absolute_uri(reverse('log:article_detail', args=[row['id']]))
+        feed.add_item(
+            title=row['title'], link=url, description=row['body'], unique_id=url, unique_id_is_permalink=True,
+            author_name=row['user__username'], pubdate=row['created_at'], updateddate=row['updated_at'],
+            categories=tags[row['id']],
+        )
+    return feed
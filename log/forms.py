@@ -1,12 +1,35 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 
+from log.imaging import normalize_photo
 from log.models import Article, Comment
+from log.widgets import TagAutocompleteWidget
 
 
 class ArticleForm(forms.ModelForm):
     class Meta:
         model = Article
         fields = ['title', 'body', 'photo', 'tags']
+        widgets = {
+            'tags': TagAutocompleteWidget(),
+        }
+
+    def clean_photo(self):
+        """
+        新しくアップロードされた写真は、保存する前に縮小・メタデータの除去・再エンコードを行う
+
+        ImageField の検証はヘッダしか見ないので、途中で切れた画像などはデコードするここで初めてエラーになる。
+        """
+        photo = self.cleaned_data.get('photo')
+        if isinstance(photo, UploadedFile) and settings.LOG_PHOTO_NORMALIZE:
+            try:
+                photo = normalize_photo(photo, settings.LOG_PHOTO_MAX_DIMENSION, settings.LOG_PHOTO_QUALITY)
+            except (OSError, Image.DecompressionBombError, ValueError):
+                raise forms.ValidationError('画像を読み込めませんでした。壊れていない画像ファイルを選んでください。',
+                                            code='invalid_image')
+        return photo
 
 
 class CommentForm(forms.ModelForm):
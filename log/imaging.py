@@ -0,0 +1,265 @@
+"""
+写真の派生画像の生成
+
+サムネイルは imagekit の ImageSpecField だが、既定の JustInTime だと最初に表示したリクエストの中で
+画像の縮小処理が走ってしまう。ここでは生成を ImageJob テーブルを使ったキューに回し、
+process_image_jobs コマンド(ワーカー)で生成する。
+
+詳細ページ用には、幅ごとの縮小版 (WebP と JPEG) も同じジョブで生成する。
+元画像のデコードは 1 回だけにして、大きい幅から順に縮小しながら書き出す。
+"""
+import logging
+import posixpath
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from config.metrics import timed
+from log import changes
+from log.cache import invalidate_articles
+from log.models import Article, ImageJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# 処理中とみなす時間。これを過ぎたジョブはワーカーが落ちたとみなして再度処理される
+LEASE_SECONDS = 300
+
+# srcset 用の縮小版の幅。元画像より大きい幅は作らず、代わりに元画像の幅(上限は最大幅)のものを作る
+VARIANT_WIDTHS = (320, 640, 1280, 2048)
+# (拡張子, Pillow のフォーマット, MIME type)。先頭ほど優先される。最後のものを <img> のフォールバックにする
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+VARIANT_QUALITY = 80
+# EXIF の Orientation のうち、縦横が入れ替わるもの
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class QueuedStrategy:
+    """
+    imagekit のキャッシュファイル戦略
+
+    url を参照しても生成しない(存在するものとして扱う)。ファイルの中身が必要になったときだけ生成する。
+    テンプレートでは Article.thumbnail_ready を見て、生成前はプレースホルダを表示する。
+    """
+
+    def on_content_required(self, file):
+        file.generate()
+
+    def should_verify_existence(self, file):
+        return False
+
+
+def enqueue_image_job(article):
+    """
+    写真が登録・変更された記事のジョブを登録する。写真がない場合は何もしない
+    """
+    Article.objects.filter(pk=article.pk).update(thumbnail_ready=False, variants_ready=False)
+    invalidate_articles([article.pk])
+    article.thumbnail_ready = article.variants_ready = False
+    if not article.photo:
+        ImageJob.objects.filter(article=article).delete()
+        return None
+    job, _ = ImageJob.objects.update_or_create(
+        article=article,
+        defaults={'photo': article.photo.name, 'attempts': 0, 'last_error': '', 'available_at': timezone.now()},
+    )
+    return job
+
+
+@timed('image_processing_duration_seconds', operation='normalize')
+def normalize_photo(photo, max_dimension, quality):
+    """
+    アップロードされた写真を保存前に正規化する
+
+    - 長辺を max_dimension までに縮小する (JPEG は縮小しながらデコードする)
+    - EXIF の向きを画素に反映し、EXIF / XMP などのメタデータを取り除く (ICC プロファイルは色空間が変わらないときだけ残す)
+    - JPEG は quality で再エンコードする。PNG などの可逆形式は変換が必要なときだけ再エンコードする
+
+    変換の必要がなく、再エンコードしても小さくならない場合は元のファイルをそのまま返す。
+    アップロードの一時ファイルから直接読み、結果は一時ファイル(小さければメモリ)に書き出す。
+    """
+    started = time.perf_counter()
+    photo.seek(0)
+    image = Image.open(photo)
+    source_format = image.format
+    source_size = image.size
+    source_mode = image.mode
+    exif = image.getexif()
+    needs_resize = max(source_size) > max_dimension
+    needs_transpose = exif.get(0x0112, 1) != 1
+    has_metadata = bool(exif) or 'xmp' in image.info or 'XML:com.adobe.xmp' in image.info
+
+    if source_format != 'JPEG' and not (needs_resize or needs_transpose or has_metadata):
+        return photo
+
+    if needs_resize:
+        image.draft('RGB', (max_dimension, max_dimension))
+    icc_profile = image.info.get('icc_profile')
+    image = ImageOps.exif_transpose(image)
+    if needs_resize:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if source_format == 'PNG' or has_alpha:
+        output_format, extension, content_type = 'PNG', 'png', 'image/png'
+        options = {'optimize': True}
+    else:
+        output_format, extension, content_type = 'JPEG', 'jpg', 'image/jpeg'
+        image = image.convert('RGB')
+        options = {'quality': quality, 'optimize': True, 'progressive': True}
+    # CMYK やグレースケールから RGB に変換した画像に元のプロファイルを付けると色が壊れるので、モードが変わったら付けない
+    if icc_profile and image.mode == source_mode:
+        options['icc_profile'] = icc_profile
+
+    output = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    image.save(output, output_format, **options)
+    output_size = output.tell()
+
+    if not (needs_resize or needs_transpose or has_metadata) and output_size >= photo.size:
+        output.close()
+        photo.seek(0)
+        return photo
+
+    output.seek(0)
+    name = f'{posixpath.splitext(photo.name)[0]}.{extension}'
+    logger.info('photo normalized: name=%s %sx%s -> %sx%s bytes %s -> %s (%.1f%% saved) %.1fms',
+                photo.name, *source_size, *image.size, photo.size, output_size,
+                100 * (1 - output_size / photo.size) if photo.size else 0, (time.perf_counter() - started) * 1000)
+    return UploadedFile(output, name=name, content_type=content_type, size=output_size)
+
+
+def claim_jobs(limit):
+    """
+    処理可能なジョブを最大 limit 件取り出し、リース期限を設定して返す
+
+    PostgreSQL では SKIP LOCKED で、複数のワーカーが同じジョブを取り合わないようにする。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(ImageJob.objects.select_for_update(skip_locked=True).filter(
+            available_at__lte=now, attempts__lt=MAX_ATTEMPTS).order_by('available_at', 'pk')[:limit])
+        ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            available_at=now + timedelta(seconds=LEASE_SECONDS))
+    return jobs
+
+
+def variant_widths(photo_width):
+    """
+    幅 photo_width の写真に対して作る縮小版の幅
+    """
+    if not photo_width:
+        return []
+    largest = min(photo_width, VARIANT_WIDTHS[-1])
+    return [width for width in VARIANT_WIDTHS if width < largest] + [largest]
+
+
+def variant_name(photo_name, width, extension):
+    stem = posixpath.splitext(photo_name)[0]
+    return f'CACHE/variants/{stem}/{width}w.{extension}'
+
+
+def _to_rgb(image):
+    """
+    JPEG で保存できるように RGB にする。透過部分は白で塗る
+    """
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(photo_name, storage=None):
+    """
+    写真の縮小版をすべて生成し、(幅, 高さ) を返す。幅・高さは EXIF の向きを反映したもの
+
+    別プロセスからも呼べるように、モデルのインスタンスではなくファイル名を受け取る。
+    """
+    storage = storage or Article.photo.field.storage
+    with storage.open(photo_name, 'rb') as f:
+        image = Image.open(f)
+        width, height = image.size
+        if image.getexif().get(0x0112) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+        # JPEG は最大幅に必要な大きさまで縮小しながらデコードする
+        image.draft('RGB', (VARIANT_WIDTHS[-1], VARIANT_WIDTHS[-1]))
+        image = _to_rgb(ImageOps.exif_transpose(image))
+
+    for target in sorted(variant_widths(width), reverse=True):
+        if image.width != target:
+            image = image.resize((target, max(1, round(height * target / width))), Image.Resampling.LANCZOS)
+        for extension, image_format, _ in VARIANT_FORMATS:
+            buffer = BytesIO()
+            image.save(buffer, image_format, quality=VARIANT_QUALITY)
+            name = variant_name(photo_name, target, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    return width, height
+
+
+def photo_variants(article):
+    """
+    テンプレート用に、フォーマットごとの (MIME type, [(URL, 幅), ...]) のリストを返す
+    """
+    if not article.photo or not article.variants_ready:
+        return []
+    storage = article.photo.storage
+    widths = variant_widths(article.photo_width)
+    return [
+        (mime_type, [(storage.url(variant_name(article.photo.name, width, extension)), width) for width in widths])
+        for extension, _, mime_type in VARIANT_FORMATS
+    ]
+
+
+@timed('image_processing_duration_seconds', operation='generate')
+def generate_images(article):
+    """
+    サムネイルと縮小版を生成し、記事に保存する値を返す
+    """
+    article.thumbnail.generate()
+    width, height = generate_variants(article.photo.name, article.photo.storage)
+    return {'thumbnail_ready': True, 'variants_ready': True, 'photo_width': width, 'photo_height': height}
+
+
+def process_image_job(job):
+    """
+    ジョブを 1 件処理する。成功したら True
+    """
+    started = time.perf_counter()
+    article = Article.objects.filter(pk=job.article_id, photo=job.photo).first()
+    if article is None:
+        # 処理待ちの間に写真が差し替えられた(新しいジョブが登録されている)か、記事が削除された
+        ImageJob.objects.filter(pk=job.pk, photo=job.photo).delete()
+        return False
+
+    try:
+        fields = generate_images(article)
+    except Exception as e:
+        attempts = job.attempts + 1
+        logger.exception('image job failed: article=%s attempts=%s', job.article_id, attempts)
+        ImageJob.objects.filter(pk=job.pk, photo=job.photo).update(
+            attempts=attempts, last_error=str(e),
+            available_at=timezone.now() + timedelta(seconds=10 * 2 ** attempts))
+        return False
+
+    with transaction.atomic():
+        # 写真の大きさは API (log/api.py) でも返すので、記事の変更として版を上げ、変更フィードにも記録する
+        if Article.objects.filter(pk=article.pk, photo=job.photo).touch(**fields):
+            changes.record(changes.ARTICLE, [article.pk])
+        ImageJob.objects.filter(pk=job.pk, photo=job.photo).delete()
+        invalidate_articles([article.pk])
+    logger.info('image job done: article=%s %.1fms', article.pk, (time.perf_counter() - started) * 1000)
+    return True
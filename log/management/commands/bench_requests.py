@@ -0,0 +1,55 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test import Client, override_settings
+
+from config.metrics import percentile
+
+
+class Command(BaseCommand):
+    help = ('ビューに並行してリクエストを送り、レイテンシを表示します。'
+            'DB の接続設定 (DB_CONN_MAX_AGE / DB_POOL) を変えて実行すると、接続の使い回し・プールの効果を比べられます。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/log/'], help='リクエストする URL のパス')
+        parser.add_argument('--requests', type=int, default=200, help='リクエストの総数')
+        parser.add_argument('--concurrency', type=int, default=8, help='並行して送るリクエストの数 (スレッド数)')
+        parser.add_argument('--host', default=None, help='Host ヘッダ (省略時は ALLOWED_HOSTS の先頭)')
+        parser.add_argument('--page-cache', action='store_true', help='ページのキャッシュを有効なままにする')
+
+    def handle(self, *args, **options):
+        host = options['host'] or next((h for h in settings.ALLOWED_HOSTS if h and h != '*'), 'localhost')
+        paths = options['paths']
+        total = options['requests']
+
+        def request(i):
+            client = Client(HTTP_HOST=host)
+            start = time.perf_counter()
+            response = client.get(paths[i % len(paths)])
+            elapsed = (time.perf_counter() - start) * 1000
+            # 実際のリクエストと同じように、リクエストの終わりで CONN_MAX_AGE に従って接続を閉じる(プールに返す)
+            close_old_connections()
+            return elapsed, response.status_code
+
+        page_cache = settings.LOG_PAGE_CACHE_TIMEOUT if options['page_cache'] else 0
+        with override_settings(LOG_PAGE_CACHE_TIMEOUT=page_cache):
+            started = time.perf_counter()
+            if options['concurrency'] <= 1:
+                results = [request(i) for i in range(total)]
+            else:
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                    results = list(executor.map(request, range(total)))
+            wall = time.perf_counter() - started
+
+        timings = [elapsed for elapsed, _ in results]
+        errors = sum(1 for _, status in results if status >= 400)
+        db = settings.DATABASES['default']
+        self.stdout.write(f'engine={db["ENGINE"]} vendor={connection.vendor} CONN_MAX_AGE={db.get("CONN_MAX_AGE", 0)} '
+                          f'pool={"pool" in db.get("OPTIONS", {})} concurrency={options["concurrency"]}')
+        self.stdout.write(f'requests={total} errors={errors} {total / wall:.1f} req/s')
+        self.stdout.write(f'latency ms: mean={statistics.mean(timings):.2f} p50={percentile(timings, 50):.2f} '
+                          f'p90={percentile(timings, 90):.2f} p99={percentile(timings, 99):.2f} max={max(timings):.2f}')
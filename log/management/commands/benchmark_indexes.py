@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from log.models import Article, Comment, Tag
+from log.seed import seed
+
+# 比較のために一時的に削除するインデックス (log/migrations/0003, 0005 で追加したもの)
+INDEX_NAMES = [
+    'log_article_created_id_idx',
+    'log_article_user_idx',
+    'log_article_discussed_idx',
+    'log_comment_article_idx',
+    'log_article_tags_tag_article_idx',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('一覧・絞り込みの主要なクエリについて、インデックスあり/なしの EXPLAIN と実行時間を表示します。'
+            'データの投入とインデックスの削除はトランザクション内で行い、最後にロールバックします。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='事前に投入する記事数 (0 なら既存データのみ)')
+        parser.add_argument('--repeat', type=int, default=5, help='各クエリの実行回数')
+        parser.add_argument('--no-explain', action='store_true', help='EXPLAIN を表示しない')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    counts = seed(users=max(1, options['seed'] // 100), tags=50, articles=options['seed'],
+                                  comments=options['seed'] * 5)
+                    self.stdout.write(f'seeded: {counts}')
+
+                after = self.run_queries('after (インデックスあり)', options)
+                for name in INDEX_NAMES:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+                before = self.run_queries('before (インデックスなし)', options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write('')
+        self.stdout.write(f'{"query":<24}{"before ms":>12}{"after ms":>12}')
+        for label in after:
+            self.stdout.write(f'{label:<24}{before[label]:>12.2f}{after[label]:>12.2f}')
+
+    def get_queries(self):
+        """
+        ビューが発行しているものと同じ形のクエリ
+        """
+        newest = Article.objects.order_by('-created_at', '-id')
+        queries = {
+            'list_first_page': newest[:6],
+            'list_deep_offset': newest[5000:5006],
+            'list_discussed': Article.objects.filter(comment_count__gt=0).order_by(
+                '-comment_count', '-created_at', '-id')[:6],
+        }
+        tag = Tag.objects.annotate(n=Count('article')).order_by('-n').first()
+        if tag:
+            queries['tag_list'] = newest.filter(tags=tag)[:6]
+        article = Article.objects.order_by('-comment_count').first()
+        if article:
+            queries['user_list'] = newest.filter(user_id=article.user_id)[:6]
+            queries['detail_comments'] = Comment.objects.filter(article=article).order_by('-created_at', '-id')
+        return queries
+
+    def explain(self, queryset, title):
+        """
+        QuerySet.explain() と同じだが、SQL 末尾にコメントを付けて実行する
+
+        SQLite ではインデックスを削除した後も、同じ SQL 文の EXPLAIN はキャッシュされた古い実行計画を返すため。
+        """
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql} /* {title} */', params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def run_queries(self, title, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {title} =='))
+        results = {}
+        for label, queryset in self.get_queries().items():
+            if not options['no_explain']:
+                self.stdout.write(self.style.MIGRATE_LABEL(label))
+                self.stdout.write(self.explain(queryset, title))
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = statistics.median(timings)
+        return results
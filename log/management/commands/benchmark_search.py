@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from log import search
+from log.seed import seed
+
+# 検索語 (log/seed.py の WORDS から、ヒット件数の多いもの・少ないもの・複数語・1 文字を選ぶ)
+QUERIES = ['写真', '北海道 ラーメン', '夕焼けがきれい', '桜', 'カメラ レンズ 京都']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('全文検索 (log/search.py) の 1 ページ目と深いページの取得時間を表示します。'
+            'データの投入はトランザクション内で行い、最後にロールバックします。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='事前に投入する記事数 (0 なら既存データのみ)')
+        parser.add_argument('--repeat', type=int, default=5, help='各検索の実行回数')
+        parser.add_argument('--queries', nargs='+', default=QUERIES, help='計測する検索語')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    counts = seed(users=max(1, options['seed'] // 100), tags=50, articles=options['seed'],
+                                  comments=options['seed'] * 5)
+                    search.optimize()
+                    self.stdout.write(f'seeded: {counts}')
+                results = self.run_queries(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'vendor: {connection.vendor}')
+        self.stdout.write(f'{"query":<24}{"rows":>6}{"page 1 ms":>12}{"page 50 ms":>12}')
+        for query, (rows, first, deep) in results.items():
+            self.stdout.write(f'{query:<24}{rows:>6}{first:>12.2f}{deep:>12.2f}')
+
+    def measure(self, query, offset, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pks = search.search(query, offset=offset, limit=21)
+            timings.append((time.perf_counter() - start) * 1000)
+        return len(pks), statistics.median(timings)
+
+    def run_queries(self, options):
+        results = {}
+        for query in options['queries']:
+            hits, first = self.measure(query, 0, options['repeat'])
+            _, deep = self.measure(query, 49 * 20, options['repeat'])
+            results[query] = (hits, first, deep)
+        return results
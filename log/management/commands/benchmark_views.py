@@ -0,0 +1,89 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from log import benchmark
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('記事一覧・詳細・コメントの投稿などのビューについて、クエリ数・DB の時間・描画時間・req/s を測ります。'
+            '--output で結果を JSON に保存し、--compare で以前の結果と比べます。'
+            'リクエストはトランザクション内で行い、最後にロールバックします (投稿したコメントは残りません)。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='シナリオごとのリクエスト数')
+        parser.add_argument('--warmup', type=int, default=2, help='計測前に送るリクエスト数')
+        parser.add_argument('--user', help='ログインするユーザの username (省略時は最初のユーザ。コメントの投稿に必要)')
+        parser.add_argument('--anonymous', action='store_true', help='ログインせずに計測する (コメントの投稿は省く)')
+        parser.add_argument('--only', nargs='+', help='計測するシナリオの名前')
+        parser.add_argument('--page-cache', action='store_true', help='ページのキャッシュを有効なままにする')
+        parser.add_argument('--output', help='結果を保存する JSON ファイル')
+        parser.add_argument('--compare', help='比べる以前の結果の JSON ファイル')
+        parser.add_argument('--threshold', type=float, default=10.0, help='悪化とみなす変化率 (%%)')
+        parser.add_argument('--fail-on-regression', action='store_true', help='悪化した指標があればエラーで終了する')
+
+    def get_user(self, options):
+        if options['anonymous']:
+            return None
+        User = get_user_model()
+        users = User.objects.order_by('pk')
+        user = users.filter(username=options['user']).first() if options['user'] else users.first()
+        if options['user'] and user is None:
+            raise CommandError(f'ユーザが見つかりません: {options["user"]}')
+        return user
+
+    def handle(self, *args, **options):
+        host = next((h for h in settings.ALLOWED_HOSTS if h and h != '*' and not h.startswith('.')), 'localhost')
+        page_cache = settings.LOG_PAGE_CACHE_TIMEOUT if options['page_cache'] else 0
+        try:
+            with transaction.atomic(), override_settings(LOG_PAGE_CACHE_TIMEOUT=page_cache):
+                report = benchmark.run(requests=options['requests'], warmup=options['warmup'],
+                                       user=self.get_user(options), only=options['only'], host=host)
+                raise Rollback
+        except Rollback:
+            pass
+
+        meta = report['meta']
+        if meta['debug']:
+            self.stdout.write(self.style.WARNING('DEBUG が有効です。本番に近い値を測るには DEBUG=False の設定で実行してください。'))
+        self.stdout.write(f'revision={meta["revision"]} vendor={meta["vendor"]} articles={meta["articles"]} '
+                          f'comments={meta["comments"]} logged_in={meta["logged_in"]}')
+        self.stdout.write(f'{"scenario":<20}{"status":>8}{"queries":>9}{"db ms":>9}{"render ms":>11}'
+                          f'{"mean ms":>9}{"p90 ms":>9}{"req/s":>9}')
+        for name, result in report['results'].items():
+            status = ','.join(str(code) for code in result['status'])
+            self.stdout.write(f'{name:<20}{status:>8}{result["queries"]:>9g}{result["db_ms"]:>9.2f}'
+                              f'{result["render_ms"]:>11.2f}{result["mean_ms"]:>9.2f}{result["p90_ms"]:>9.2f}'
+                              f'{result["rps"]:>9.1f}')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'結果を {options["output"]} に保存しました。')
+
+        if options['compare']:
+            self.compare(report, options)
+
+    def compare(self, report, options):
+        with open(options['compare'], encoding='utf-8') as f:
+            base = json.load(f)
+        self.stdout.write('')
+        self.stdout.write(f'compare with revision={base["meta"].get("revision")} (threshold {options["threshold"]}%)')
+        self.stdout.write(f'{"scenario":<20}{"metric":<11}{"before":>10}{"after":>10}{"change":>10}')
+        regressions = []
+        for name, metric, before, after, change, worse in benchmark.compare(base, report, options['threshold']):
+            line = f'{name:<20}{metric:<11}{before:>10.2f}{after:>10.2f}{change:>9.1f}%'
+            if worse:
+                regressions.append(f'{name}.{metric}')
+                line = self.style.ERROR(f'{line}  悪化')
+            self.stdout.write(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'悪化した指標があります: {", ".join(regressions)}')
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from log.changes import compact
+
+
+class Command(BaseCommand):
+    help = '変更フィード (log/changes.py) の記録のうち、同じ対象のより新しい記録があるものを削除します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='この日数より前の記録だけを削除する (0 ならすべて)')
+        parser.add_argument('--batch-size', type=int, default=10000, help='1 回の DELETE で対象にする pk の範囲')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days']) if options['days'] else None
+        deleted = compact(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} 件の古い記録を削除しました。'))
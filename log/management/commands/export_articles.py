@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from log import transfer
+
+
+class Command(BaseCommand):
+    help = ('記事を JSON Lines か CSV で書き出します。--photos を指定すると写真を zip アーカイブに入れます。'
+            '記事は --batch-size 件ずつ読み込むので、件数が多くてもメモリの使用量は増えません。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-', help='出力先のファイル (省略時や - は標準出力)')
+        parser.add_argument('--format', choices=transfer.FORMATS, help='形式 (省略時はファイルの拡張子から決める)')
+        parser.add_argument('--photos', help='写真を入れる zip ファイル')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1 回に読み込む記事数')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        format = options['format'] or transfer.guess_format(output)
+        # 標準出力に書き出すときは、進捗は標準エラー出力に出す
+        log = self.stderr if output == '-' else self.stdout
+
+        def report(count, rate):
+            log.write(f'{count} 件 ({rate:.0f} 件/秒)')
+
+        if output == '-':
+            count = transfer.export_articles(sys.stdout, format, photos=options['photos'],
+                                             batch_size=options['batch_size'], report=report)
+        else:
+            with open(output, 'w', encoding='utf-8', newline='') as stream:
+                count = transfer.export_articles(stream, format, photos=options['photos'],
+                                                 batch_size=options['batch_size'], report=report)
+        log.write(self.style.SUCCESS(f'{count} 件の記事を書き出しました。'))
@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from log import changes
+from log.cache import invalidate_articles
+from log.imaging import generate_variants
+from log.models import Article
+
+
+def _generate(pk, photo_name):
+    return pk, photo_name, generate_variants(photo_name)
+
+
+class Command(BaseCommand):
+    help = '縮小版 (srcset 用) が未生成の写真について、複数プロセスで並列に縮小版を生成します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='並列に処理するプロセス数')
+        parser.add_argument('--all', action='store_true', help='生成済みのものも作り直す')
+
+    def handle(self, *args, **options):
+        articles = Article.objects.exclude(photo='').exclude(photo__isnull=True)
+        if not options['all']:
+            articles = articles.filter(variants_ready=False)
+        targets = list(articles.order_by('pk').values_list('pk', 'photo'))
+
+        started = time.perf_counter()
+        done = failed = 0
+        for result in self.run(targets, options['workers']):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'失敗しました: {result}')
+                continue
+            pk, photo_name, (width, height) = result
+            # 処理中に写真が差し替えられた記事は更新しない
+            with transaction.atomic():
+                if Article.objects.filter(pk=pk, photo=photo_name).touch(
+                        variants_ready=True, photo_width=width, photo_height=height):
+                    changes.record(changes.ARTICLE, [pk])
+                invalidate_articles([pk])
+            done += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{done} 件の写真の縮小版を生成しました。(失敗 {failed} 件, {elapsed:.1f} 秒)'))
+
+    def run(self, targets, workers):
+        if workers <= 1:
+            for pk, photo_name in targets:
+                try:
+                    yield _generate(pk, photo_name)
+                except Exception as e:
+                    yield e
+            return
+
+        # 子プロセスに DB の接続を引き継がないように閉じておく
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+            futures = [executor.submit(_generate, pk, photo_name) for pk, photo_name in targets]
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield e
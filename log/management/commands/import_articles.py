@@ -0,0 +1,50 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from log import transfer
+
+
+class Command(BaseCommand):
+    help = ('export_articles で書き出した JSON Lines か CSV の記事を登録します。'
+            '記事とタグの付与は --batch-size 件ずつ bulk_create し、写真は --workers 並列でストレージに保存します。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='読み込むファイル (- は標準入力)')
+        parser.add_argument('--format', choices=transfer.FORMATS, help='形式 (省略時はファイルの拡張子から決める)')
+        parser.add_argument('--photos', help='export_articles --photos で書き出した写真の zip ファイルか、ダウンロードした zip ファイル')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1 回に登録する記事数')
+        parser.add_argument('--workers', type=int, default=4, help='写真を並列に保存するスレッド数')
+        parser.add_argument('--default-user', help='username が見つからない記事の作成者にするユーザ')
+
+    def handle(self, *args, **options):
+        default_user = None
+        if options['default_user']:
+            User = get_user_model()
+            try:
+                default_user = User.objects.get(username=options['default_user'])
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザが見つかりません: {options["default_user"]}')
+
+        def report(count, rate):
+            self.stdout.write(f'{count} 件 ({rate:.0f} 件/秒)')
+
+        path = options['input']
+        kwargs = {
+            'format': options['format'] or transfer.guess_format(path),
+            'batch_size': options['batch_size'],
+            'default_user': default_user,
+            'photos': transfer.PhotoArchive(options['photos']) if options['photos'] else None,
+            'workers': options['workers'],
+            'report': report,
+        }
+        try:
+            if path == '-':
+                count = transfer.import_articles(sys.stdin, **kwargs)
+            else:
+                with open(path, encoding='utf-8', newline='') as stream:
+                    count = transfer.import_articles(stream, **kwargs)
+        except transfer.TransferError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の記事を登録しました。'))
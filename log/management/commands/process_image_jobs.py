@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from log.imaging import claim_jobs, process_image_job
+
+
+class Command(BaseCommand):
+    help = '写真のサムネイル生成ジョブ(ImageJob)を処理するワーカーです。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='処理可能なジョブがなくなったら終了する')
+        parser.add_argument('--batch-size', type=int, default=10, help='一度に取り出すジョブ数')
+        parser.add_argument('--sleep', type=float, default=2.0, help='ジョブがないときに待つ秒数')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            jobs = claim_jobs(options['batch_size'])
+            for job in jobs:
+                if process_image_job(job):
+                    processed += 1
+            if jobs:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'{processed} 件のジョブを処理しました。'))
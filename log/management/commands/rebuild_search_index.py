@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from log import search
+
+
+class Command(BaseCommand):
+    help = ('すべての記事の全文検索の文書 (SearchDocument) を作り直します。'
+            'bulk_create やデータの移行など、シグナルを送らない方法で記事を作成した後に実行します。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1 回にまとめて更新する記事数')
+        parser.add_argument('--no-optimize', action='store_true', help='作り直した後にインデックスを最適化しない')
+
+    def handle(self, *args, **options):
+        done = search.rebuild(batch_size=options['batch_size'])
+        if not options['no_optimize']:
+            search.optimize()
+        self.stdout.write(self.style.SUCCESS(f'{done} 件の記事の検索用の文書を作り直しました。'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from log.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Article の comment_count / last_commented_at / tag_count を実際の値に合わせて修復します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1 回の UPDATE で修復する記事数')
+
+    def handle(self, *args, **options):
+        repaired = repair_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{repaired} 件の記事の集計値を修復しました。'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from log.seed import seed
+
+
+class Command(BaseCommand):
+    help = ('ベンチマーク用に、ユーザ・タグ・写真つきの記事・コメントを偏りのある分布で大量に作成します '
+            '(作成したデータはそのまま残ります)。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--articles', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=500000)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='偏りの強さ (Zipf 分布の指数)。0 なら一様、1 なら上位 1 割に 7 割ほどが集まる (1000 件のとき)')
+        parser.add_argument('--photo-ratio', type=float, default=0.3, help='写真を付ける記事の割合')
+        parser.add_argument('--photo-pool', type=int, default=20, help='作成して使い回す写真の枚数')
+        parser.add_argument('--generate-images', action='store_true',
+                            help='サムネイルと縮小版を生成しておく (省略時は ImageJob を登録する)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            counts = seed(users=options['users'], tags=options['tags'], articles=options['articles'],
+                          comments=options['comments'], batch_size=options['batch_size'],
+                          random_seed=options['random_seed'], skew=options['skew'],
+                          photo_ratio=options['photo_ratio'], photo_pool=options['photo_pool'],
+                          generate_images=options['generate_images'])
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f'{counts} を {elapsed:.1f} 秒で作成しました ({rows / elapsed:.0f} 行/秒)。'))
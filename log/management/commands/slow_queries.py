@@ -0,0 +1,56 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from log import slowlog
+
+
+class Command(BaseCommand):
+    help = ('記録された遅いクエリ (log/slowlog.py) を SQL の指紋ごとに集計し、合計時間の長い順に表示します。'
+            '--requests を指定すると遅いリクエストをビューごとに集計します。')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='記録のディレクトリ (省略時は LOG_SLOW_QUERY_DIR)')
+        parser.add_argument('--hours', type=float, default=24, help='集計する期間 (直近の時間数。0 ならすべて)')
+        parser.add_argument('--limit', type=int, default=20, help='表示する件数')
+        parser.add_argument('--view', default=None, help='このビューの名前 (log:article_detail など) の記録だけを集計する')
+        parser.add_argument('--requests', action='store_true', help='遅いリクエストをビューごとに集計する')
+        parser.add_argument('--json', action='store_true', help='JSON で出力する')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.LOG_SLOW_QUERY_DIR
+        if not directory:
+            raise CommandError('LOG_SLOW_QUERY_DIR が設定されていません (--dir で指定できます)。')
+        since = timezone.now() - timedelta(hours=options['hours']) if options['hours'] else None
+        entries = slowlog.read_entries(directory, since)
+        if options['view']:
+            entries = (entry for entry in entries if entry.get('view') == options['view'])
+        groups = slowlog.aggregate(entries, 'request' if options['requests'] else 'query')[:options['limit']]
+
+        if options['json']:
+            for group in groups:
+                group['key'] = group['key'] if isinstance(group['key'], str) else list(group['key'])
+            self.stdout.write(json.dumps(groups, ensure_ascii=False, indent=2))
+            return
+        if not groups:
+            self.stdout.write('記録がありません。')
+            return
+
+        self.stdout.write(f'{"#":>3}{"count":>8}{"total ms":>12}{"mean ms":>10}{"max ms":>10}  views')
+        for rank, group in enumerate(groups, 1):
+            views = ', '.join(f'{view} ({count})' for view, count in
+                              sorted(group['views'].items(), key=lambda item: item[1], reverse=True)[:3])
+            self.stdout.write(f'{rank:>3}{group["count"]:>8}{group["total_ms"]:>12.1f}{group["mean_ms"]:>10.1f}'
+                              f'{group["max_ms"]:>10.1f}  {views}')
+            example = group['example']
+            if options['requests']:
+                self.stdout.write(f'      {example["method"]} {example["path"]} status={example["status"]} '
+                                  f'queries={example["queries"]} db_ms={example["db_ms"]}')
+            else:
+                self.stdout.write(f'      {group["key"][:300]}')
+                for frame in example.get('stack', [])[-3:]:
+                    self.stdout.write(f'        at {frame}')
+        self.stdout.write(self.style.SUCCESS(f'{len(groups)} 件を表示しました。'))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.15 on 2026-10-18 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0002_alter_article_title'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-created_at', '-id'], name='log_article_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.15 on 2026-10-18 00:35
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Article = apps.get_model('log', 'Article')
+    Comment = apps.get_model('log', 'Comment')
+    through = Article.tags.through
+    comments = Comment.objects.filter(article=OuterRef('pk')).order_by().values('article')
+    tags = through.objects.filter(article=OuterRef('pk')).order_by().values('article')
+    Article.objects.update(
+        comment_count=Coalesce(Subquery(comments.annotate(c=Count('*')).values('c'), output_field=IntegerField()), 0),
+        last_commented_at=Subquery(comments.annotate(last=Max('created_at')).values('last')),
+        tag_count=Coalesce(Subquery(tags.annotate(c=Count('*')).values('c'), output_field=IntegerField()), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0003_article_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='コメント数'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最終コメント日時'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='tag_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='タグ数'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.15 on 2026-10-18 00:37
+
+from django.db import migrations, models
+
+# タグで絞り込んだ一覧用の中間テーブルのインデックス。
+# PostgreSQL では INCLUDE で article_id を持たせ index-only scan にする。
+# それ以外では (tag_id, article_id) の複合インデックスで同じ効果を得る。
+TAG_INDEX_NAME = 'log_article_tags_tag_article_idx'
+
+
+def create_tag_index(apps, schema_editor):
+    table = schema_editor.quote_name(apps.get_model('log', 'Article').tags.through._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        columns = '(tag_id) INCLUDE (article_id)'
+    else:
+        columns = '(tag_id, article_id)'
+    schema_editor.execute(f'CREATE INDEX {TAG_INDEX_NAME} ON {table} {columns}')
+
+
+def drop_tag_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX {TAG_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0004_article_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='log_article_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('comment_count__gt', 0)), fields=['-comment_count', '-created_at', '-id'], name='log_article_discussed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['article', '-created_at', '-id'], name='log_comment_article_idx'),
+        ),
+        migrations.RunPython(create_tag_index, drop_tag_index),
+    ]
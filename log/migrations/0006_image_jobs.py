@@ -0,0 +1,44 @@
+# Generated by Django 4.2.15 on 2026-10-18 00:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def enqueue_existing_photos(apps, schema_editor):
+    """
+    既存の写真のサムネイルもワーカーで生成し直す
+    """
+    Article = apps.get_model('log', 'Article')
+    ImageJob = apps.get_model('log', 'ImageJob')
+    articles = Article.objects.exclude(photo='').exclude(photo__isnull=True).values_list('pk', 'photo')
+    ImageJob.objects.bulk_create(
+        (ImageJob(article_id=pk, photo=photo) for pk, photo in articles.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0005_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='thumbnail_ready',
+            field=models.BooleanField(default=False, verbose_name='サムネイル生成済み'),
+        ),
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('photo', models.CharField(max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='image_job', to='log.article')),
+            ],
+        ),
+        migrations.RunPython(enqueue_existing_photos, migrations.RunPython.noop),
+    ]
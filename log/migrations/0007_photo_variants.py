@@ -0,0 +1,28 @@
+# Generated by Django 4.2.15 on 2026-10-18 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0006_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='photo_height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='写真の高さ'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='photo_width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='写真の幅'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='variants_ready',
+            field=models.BooleanField(default=False, verbose_name='縮小版生成済み'),
+        ),
+    ]
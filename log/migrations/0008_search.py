@@ -0,0 +1,137 @@
+# Generated by Django 4.2.15 on 2026-10-18 01:01
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 検索のインデックスはデータベースごとに作成する (log/search.py)
+# SQLite で log_searchdocument を作り直すマイグレーション (列の変更など) を追加した場合は、トリガーも作り直すこと
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE log_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple'::regconfig, coalesce(title, '')), 'A')
+        || setweight(to_tsvector('simple'::regconfig, coalesce(body, '')), 'B')
+        || setweight(to_tsvector('simple'::regconfig, coalesce(comments, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX log_searchdocument_vector_idx ON log_searchdocument USING gin (search_vector)',
+]
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS log_searchdocument_vector_idx',
+    'ALTER TABLE log_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+# log_searchdocument を外部コンテンツとする FTS5 のテーブル。rowid は記事の pk
+# 日本語 1 文字の検索は前方一致になるので、1 文字の接頭辞のインデックスも作る
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE log_search_fts USING fts5(
+        title, body, comments, content='log_searchdocument', content_rowid='article_id', prefix='1'
+    )
+    """,
+    """
+    CREATE TRIGGER log_search_fts_insert AFTER INSERT ON log_searchdocument BEGIN
+        INSERT INTO log_search_fts (rowid, title, body, comments)
+        VALUES (new.article_id, new.title, new.body, new.comments);
+    END
+    """,
+    """
+    CREATE TRIGGER log_search_fts_delete AFTER DELETE ON log_searchdocument BEGIN
+        INSERT INTO log_search_fts (log_search_fts, rowid, title, body, comments)
+        VALUES ('delete', old.article_id, old.title, old.body, old.comments);
+    END
+    """,
+    """
+    CREATE TRIGGER log_search_fts_update AFTER UPDATE ON log_searchdocument BEGIN
+        INSERT INTO log_search_fts (log_search_fts, rowid, title, body, comments)
+        VALUES ('delete', old.article_id, old.title, old.body, old.comments);
+        INSERT INTO log_search_fts (rowid, title, body, comments)
+        VALUES (new.article_id, new.title, new.body, new.comments);
+    END
+    """,
+]
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS log_search_fts_insert',
+    'DROP TRIGGER IF EXISTS log_search_fts_delete',
+    'DROP TRIGGER IF EXISTS log_search_fts_update',
+    'DROP TABLE IF EXISTS log_search_fts',
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRESQL_FORWARD, POSTGRESQL_REVERSE),
+    'sqlite': (SQLITE_FORWARD, SQLITE_REVERSE),
+}
+
+
+def create_index(apps, schema_editor):
+    forward, _ = STATEMENTS.get(schema_editor.connection.vendor, ([], []))
+    for sql in forward:
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    _, reverse = STATEMENTS.get(schema_editor.connection.vendor, ([], []))
+    for sql in reverse:
+        schema_editor.execute(sql)
+
+
+# このマイグレーションを作った時点の log.search.index_text の写し。
+# 後で log/search.py の分け方を変えても、このマイグレーションの結果は変わらない (変えたら rebuild_search_index で作り直す)
+_CJK = '\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_SEGMENT = re.compile(f'[{_CJK}]+|[^\\W{_CJK}]+')
+
+
+def index_text(text):
+    tokens = []
+    for word in re.findall(r'\w+', unicodedata.normalize('NFKC', text or '').lower()):
+        for segment in _SEGMENT.findall(word):
+            if re.match(f'[{_CJK}]', segment) and len(segment) > 1:
+                tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+            else:
+                tokens.append(segment)
+    return ' '.join(tokens)
+
+
+def create_documents(apps, schema_editor):
+    Article = apps.get_model('log', 'Article')
+    Comment = apps.get_model('log', 'Comment')
+    SearchDocument = apps.get_model('log', 'SearchDocument')
+    last_pk = 0
+    while True:
+        articles = list(Article.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'title', 'body')[:1000])
+        if not articles:
+            return
+        comments = {}
+        for article_id, body in Comment.objects.filter(article_id__in=[pk for pk, _, _ in articles]).order_by(
+                'pk').values_list('article_id', 'body'):
+            comments.setdefault(article_id, []).append(body)
+        SearchDocument.objects.bulk_create([
+            SearchDocument(article_id=pk, title=index_text(title), body=index_text(body),
+                           comments=index_text('\n'.join(comments.get(pk, []))))
+            for pk, title, body in articles
+        ])
+        last_pk = articles[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0007_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='log.article')),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('comments', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(create_documents, migrations.RunPython.noop),
+    ]
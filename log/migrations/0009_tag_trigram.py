@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# タグの入力補完 (log/tag_autocomplete.py) の前方一致・類似検索用の pg_trgm のインデックス。PostgreSQL のみ
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX log_tag_name_trgm_idx ON log_tag USING gin (lower(name) gin_trgm_ops)',
+    'CREATE INDEX log_tag_slug_trgm_idx ON log_tag USING gin (lower(slug) gin_trgm_ops)',
+]
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS log_tag_name_trgm_idx',
+    'DROP INDEX IF EXISTS log_tag_slug_trgm_idx',
+]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_FORWARD:
+            schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_REVERSE:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0008_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
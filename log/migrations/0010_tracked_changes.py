@@ -0,0 +1,33 @@
+# Generated by Django 4.2.15 on 2026-10-18 01:45
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    # これまでは編集しても updated_at が変わらなかったので、元の値は作成日時のまま (管理画面で作成日時を
+    # 変更した行やインポートした行では作成日時より前のこともある)。分かる範囲で作成日時より前にならないようにする
+    for name in ('Article', 'Comment'):
+        model = apps.get_model('log', name)
+        model.objects.filter(updated_at__lt=F('created_at')).update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0009_tag_trigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, verbose_name='版'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, verbose_name='版'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
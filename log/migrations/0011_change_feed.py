@@ -0,0 +1,53 @@
+# Generated by Django 4.2.15 on 2026-10-18 01:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+BATCH_SIZE = 1000
+
+
+def record_existing(apps, schema_editor):
+    """
+    既存の行を 1 件ずつ変更として記録しておき、変更フィードを最初 (since=0) から読めば全件がそろうようにする
+    """
+    Change = apps.get_model('log', 'Change')
+    Article = apps.get_model('log', 'Article')
+    sources = [
+        ('tag', apps.get_model('log', 'Tag').objects.all()),
+        ('article', Article.objects.all()),
+        ('article_tags', Article.objects.filter(tag_count__gt=0)),
+        ('comment', apps.get_model('log', 'Comment').objects.all()),
+    ]
+    for kind, queryset in sources:
+        pks = queryset.order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        while True:
+            batch = list(pks.filter(pk__gt=last_pk)[:BATCH_SIZE])
+            if not batch:
+                break
+            Change.objects.bulk_create([Change(kind=kind, object_id=pk) for pk in batch])
+            last_pk = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log', '0010_tracked_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('article', '記事'), ('comment', 'コメント'), ('tag', 'タグ'), ('article_tags', '記事のタグ')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', '-id'], name='log_change_object_idx')],
+            },
+        ),
+        migrations.RunPython(record_existing, migrations.RunPython.noop),
+    ]
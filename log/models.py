@@ -1,9 +1,13 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 from imagekit.models import ImageSpecField
 from pilkit.processors import ResizeToFill
 
+# id (BigAutoField) の上限。これより大きい値で検索するとデータベースのドライバが OverflowError を送出する
+MAX_ID = models.BigIntegerField.MAX_BIGINT
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name='タグ名', )
@@ -13,32 +17,161 @@ class Tag(models.Model):
         return self.name
 
 
-class Article(models.Model):
+class TrackedQuerySet(models.QuerySet):
+    def touch(self, **fields):
+        """
+        update() と同じだが、updated_at と version も更新する (update() では save() が呼ばれないため)
+        """
+        return self.update(updated_at=timezone.now(), version=F('version') + 1, **fields)
+
+
+class TrackedModel(models.Model):
+    """
+    変更されるたびに updated_at を現在時刻にし、version を 1 増やすモデル
+
+    version は UPDATE 文の中で増やすので、同時に保存されても同じ値にはならない。
+    保存後の version はまだ読み込んでいないので、次に参照したときに読み込まれる。
+    作成時は指定された updated_at をそのまま使う (インポートで元の日時を残すため)。
+    """
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name='更新日時', )
+    version = models.PositiveBigIntegerField(default=1, verbose_name='版', )
+
+    objects = TrackedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if self._state.adding:
+            return super().save(*args, update_fields=update_fields, **kwargs)
+        self.updated_at = timezone.now()
+        self.version = F('version') + 1
+        if update_fields is not None:
+            update_fields = {*update_fields, 'updated_at', 'version'}
+        super().save(*args, update_fields=update_fields, **kwargs)
+        # F 式のままにせず、未読み込みのフィールドに戻す
+        del self.version
+
+
+class Article(TrackedModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, )
 
     title = models.CharField(max_length=255, verbose_name='タイトル', )
     body = models.TextField(verbose_name='本文', )
     photo = models.ImageField(upload_to='log/photos/', blank=True, null=True, verbose_name='写真', )
+    # Web リクエスト中には生成せず、ImageJob を処理するワーカーが生成する (log/imaging.py)
     thumbnail = ImageSpecField(source='photo', processors=[ResizeToFill(100, 100)], format='JPEG',
-                               options={'quality': 60}, )
+                               options={'quality': 60}, cachefile_strategy='log.imaging.QueuedStrategy', )
+    thumbnail_ready = models.BooleanField(default=False, verbose_name='サムネイル生成済み', )
+    # 詳細ページの srcset 用の縮小版 (log/imaging.py の generate_variants)
+    variants_ready = models.BooleanField(default=False, verbose_name='縮小版生成済み', )
+    photo_width = models.PositiveIntegerField(blank=True, null=True, verbose_name='写真の幅', )
+    photo_height = models.PositiveIntegerField(blank=True, null=True, verbose_name='写真の高さ', )
 
     tags = models.ManyToManyField(Tag, blank=True, verbose_name='タグ', )
 
+    # 一覧で集計せずに済むように非正規化して持つ値。更新は log/counters.py を参照
+    comment_count = models.PositiveIntegerField(default=0, verbose_name='コメント数', )
+    last_commented_at = models.DateTimeField(blank=True, null=True, verbose_name='最終コメント日時', )
+    tag_count = models.PositiveIntegerField(default=0, verbose_name='タグ数', )
+
     created_at = models.DateTimeField(default=timezone.now, verbose_name='作成日時', )
-    updated_at = models.DateTimeField(default=timezone.now, verbose_name='更新日時', )
+
+    class Meta:
+        indexes = [
+            # 一覧のカーソルページネーション (created_at, id) 用
+            models.Index(fields=['-created_at', '-id'], name='log_article_created_id_idx'),
+            # ユーザごとの一覧用
+            models.Index(fields=['user', '-created_at', '-id'], name='log_article_user_idx'),
+            # コメントの多い順(comment_count > 0 の記事のみ)の一覧用の部分インデックス
+            models.Index(fields=['-comment_count', '-created_at', '-id'], name='log_article_discussed_idx',
+                         condition=models.Q(comment_count__gt=0)),
+        ]
 
     def __str__(self):
         return self.title
 
 
-class Comment(models.Model):
+class Comment(TrackedModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, )
 
     article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='comments')
     body = models.TextField(verbose_name='本文', )
 
     created_at = models.DateTimeField(default=timezone.now, verbose_name='作成日時', )
-    updated_at = models.DateTimeField(default=timezone.now, verbose_name='更新日時', )
+
+    class Meta:
+        indexes = [
+            # 記事ごとのコメントを作成日時順に取得する用 (article_id だけの FK インデックスでは並べ替えが必要になる)
+            models.Index(fields=['article', '-created_at', '-id'], name='log_comment_article_idx'),
+        ]
 
     def __str__(self):
         return f'Comment to {self.article.title} : {self.body[:20]}'
+
+
+class Change(models.Model):
+    """
+    変更フィード (log/changes.py) の記録
+
+    記事・コメント・タグ・記事のタグの付け外しが変更されるたびにシグナルから追記する。内容は持たず、
+    読み出すときに最新の値を取得する。同じ対象の古い記録は compact_changes コマンドで削除する。
+    """
+    KIND_CHOICES = [
+        ('article', '記事'),
+        ('comment', 'コメント'),
+        ('tag', 'タグ'),
+        ('article_tags', '記事のタグ'),
+    ]
+    # 変更フィードのカーソルとして使うので、増え続ける値にする
+    id = models.BigAutoField(primary_key=True, )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, )
+    # 記事のタグ (article_tags) は記事の pk
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False, )
+    created_at = models.DateTimeField(default=timezone.now, )
+
+    class Meta:
+        indexes = [
+            # 同じ対象のより新しい記録があるかどうか (compact_changes) 用
+            models.Index(fields=['kind', 'object_id', '-id'], name='log_change_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.object_id}{" (deleted)" if self.deleted else ""}'
+
+
+class ImageJob(models.Model):
+    """
+    写真の派生画像(サムネイル・縮小版)を生成するジョブのキュー
+
+    記事ごとに 1 件だけ持ち、処理が終わったら削除する。process_image_jobs コマンドが処理する。
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, related_name='image_job')
+    # ジョブを登録したときの写真のファイル名。処理中に写真が差し替えられたかどうかの判定に使う
+    photo = models.CharField(max_length=255, )
+    attempts = models.PositiveIntegerField(default=0, )
+    last_error = models.TextField(blank=True, )
+    # この日時以降に処理できる。処理中のジョブはリース期限、失敗したジョブは再試行する日時を入れる
+    available_at = models.DateTimeField(default=timezone.now, db_index=True, )
+    created_at = models.DateTimeField(default=timezone.now, )
+
+    def __str__(self):
+        return f'ImageJob for {self.article_id} : {self.photo}'
+
+
+class SearchDocument(models.Model):
+    """
+    記事の全文検索用の文書 (log/search.py)
+
+    日本語を bi-gram に分けた文字列を持つ。検索のインデックスは列としては定義せず、マイグレーションで作成する
+    (PostgreSQL は tsvector の生成列 search_vector と GIN インデックス、SQLite は FTS5 の仮想テーブル)。
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='search_document', )
+    title = models.TextField(blank=True, )
+    body = models.TextField(blank=True, )
+    comments = models.TextField(blank=True, )
+
+    def __str__(self):
+        return f'SearchDocument for {self.article_id}'
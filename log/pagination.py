@@ -0,0 +1,133 @@
+"""
+(created_at, id) をキーにしたカーソル(keyset)ページネーション
+
+OFFSET を使わず、直前のページの末尾(先頭)の行より後(前)の行だけを取得する。
+全件の COUNT も行わないため、深いページでも 1 ページ目と同じコストで表示できる。
+"""
+import base64
+import json
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from log.models import MAX_ID
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(obj, direction):
+    """
+    obj の (created_at, id) と方向を不透明なトークンにする。obj はモデルのインスタンスか .values() の dict
+    """
+    created_at, pk = (obj['created_at'], obj['id']) if isinstance(obj, dict) else (obj.created_at, obj.pk)
+    payload = json.dumps([created_at.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    トークンを (created_at, id, direction) に戻す。不正なトークンは InvalidCursor
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(created_at)
+    except (ValueError, TypeError):
+        raise InvalidCursor('カーソルが不正です。')
+    # 作ったトークンには必ずタイムゾーンが付く。範囲外の id はデータベースのドライバが OverflowError を送出する
+    if created_at is None or timezone.is_naive(created_at) or direction not in (NEXT, PREVIOUS):
+        raise InvalidCursor('カーソルが不正です。')
+    if isinstance(pk, bool) or not isinstance(pk, int) or not 1 <= pk <= MAX_ID:
+        raise InvalidCursor('カーソルが不正です。')
+    return created_at, pk, direction
+
+
+class CursorPage:
+    """
+    django.core.paginator.Page の代わりにテンプレートへ渡すページ
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # カーソルモードではページ番号は存在しない
+        self.number = None
+
+    def __repr__(self):
+        return f'<CursorPage next={self.next_cursor} previous={self.previous_cursor}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    created_at 降順、id 降順に並ぶ queryset をカーソルで区切る
+
+    queryset の並び順はこのクラスで上書きする。
+    """
+    ordering = ('-created_at', '-id')
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    def page(self, cursor=None):
+        queryset, direction = self._page_queryset(cursor)
+        return self._page_from_rows(list(queryset), direction)
+
+    async def apage(self, cursor=None):
+        """
+        page() の非同期版。queryset に prefetch_related() は指定できない
+        """
+        queryset, direction = self._page_queryset(cursor)
+        return self._page_from_rows([obj async for obj in queryset.aiterator()], direction)
+
+    def _page_queryset(self, cursor):
+        """
+        1 件多く取得する queryset と、カーソルの方向 (最初のページは None) を返す
+        """
+        if not cursor:
+            return self.queryset.order_by(*self.ordering)[:self.per_page + 1], None
+
+        created_at, pk, direction = decode_cursor(cursor)
+        if direction == NEXT:
+            older = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            return self.queryset.filter(older).order_by(*self.ordering)[:self.per_page + 1], direction
+
+        newer = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        return self.queryset.filter(newer).order_by('created_at', 'id')[:self.per_page + 1], direction
+
+    def _page_from_rows(self, rows, direction):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == PREVIOUS:
+            rows.reverse()
+            return self._build_page(rows, has_next=True, has_previous=has_more)
+        return self._build_page(rows, has_next=has_more, has_previous=direction == NEXT)
+
+    def _build_page(self, rows, has_next, has_previous):
+        next_cursor = encode_cursor(rows[-1], NEXT) if rows and has_next else None
+        previous_cursor = encode_cursor(rows[0], PREVIOUS) if rows and has_previous else None
+        return CursorPage(rows, self, next_cursor, previous_cursor)
@@ -0,0 +1,207 @@
+"""
+記事の全文検索 (タイトル・本文・コメント)
+
+日本語は単語の区切りがないので、文字の bi-gram に分けた文字列を SearchDocument に保存し、
+それをデータベースの全文検索のインデックスで検索する。
+
+- PostgreSQL: SearchDocument の tsvector の生成列 (search_vector) と GIN インデックス
+- SQLite: FTS5 の仮想テーブル (log_search_fts)。SearchDocument への書き込みはトリガーで反映される
+- それ以外: インデックスを使わない部分一致 (順位付けなし)
+
+インデックスとトリガーは log/migrations/0008_search.py で作成する。
+SearchDocument はシグナル (log/signals.py) で記事・コメントの保存時に更新され、
+bulk_create などシグナルの送られない方法で作った記事は rebuild_search_index コマンドで作成する。
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Q, TextField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Concat
+
+from log.models import Article, Comment, SearchDocument
+
+FTS_TABLE = 'log_search_fts'
+# 検索結果の順位付けでの列の重み。SQLite の bm25() は (タイトル, 本文, コメント) の順、
+# PostgreSQL の ts_rank_cd() は {D, C(コメント), B(本文), A(タイトル)} の順
+FTS5_WEIGHTS = '10.0, 2.0, 1.0'
+TSVECTOR_WEIGHTS = '{0.1, 0.1, 0.2, 1.0}'
+
+# NFKC で正規化した後の、ひらがな・カタカナ・漢字
+_CJK = '\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_SEGMENT = re.compile(f'[{_CJK}]+|[^\\W{_CJK}]+')
+
+
+def _segments(text):
+    """
+    正規化した文字列から、日本語の連続と、それ以外の単語を順に返す
+    """
+    for word in re.findall(r'\w+', unicodedata.normalize('NFKC', text or '').lower()):
+        yield from _SEGMENT.findall(word)
+
+
+def _is_cjk(segment):
+    return re.match(f'[{_CJK}]', segment) is not None
+
+
+def index_text(text):
+    """
+    インデックスに登録する文字列。日本語は bi-gram、それ以外は単語のまま空白で区切る
+    """
+    tokens = []
+    for segment in _segments(text):
+        if _is_cjk(segment) and len(segment) > 1:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment)
+    return ' '.join(tokens)
+
+
+def query_terms(query):
+    """
+    検索語を (トークン, 前方一致か) のリストにする。すべてを含む文書がヒットする
+
+    日本語 1 文字の検索語は、その文字で始まる bi-gram に前方一致させる。
+    """
+    terms = []
+    for segment in _segments(query):
+        if _is_cjk(segment) and len(segment) == 1:
+            terms.append((segment, True))
+        else:
+            terms.extend((token, False) for token in index_text(segment).split())
+    return list(dict.fromkeys(terms))
+
+
+def _fts5_query(terms):
+    return ' AND '.join(f'"{token}"' + ('*' if prefix else '') for token, prefix in terms)
+
+
+def _tsquery(terms):
+    return ' & '.join(f"'{token}'" + (':*' if prefix else '') for token, prefix in terms)
+
+
+def search(query, offset=0, limit=20):
+    """
+    検索語に一致する記事の pk を、関連度の高い順に offset から limit 件返す
+
+    件数を数えると一致する件数に比例して遅くなるので、総数は返さない (limit + 1 件取得して次のページの有無を判断する)。
+    関連度の計算も一致する件数に比例するので、一致した記事のうち新しい LOG_SEARCH_RANK_WINDOW 件だけを
+    関連度順に並べて返す (それより古い記事は結果に含まれない)。
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    window = settings.LOG_SEARCH_RANK_WINDOW
+    window_limit = 'LIMIT %s' if window else ''
+
+    if connection.vendor == 'postgresql':
+        sql = (f'SELECT article_id FROM ('
+               f'SELECT article_id, ts_rank_cd(\'{TSVECTOR_WEIGHTS}\', search_vector, query) AS score '
+               f'FROM {SearchDocument._meta.db_table}, to_tsquery(\'simple\', %s) query '
+               f'WHERE search_vector @@ query ORDER BY article_id DESC {window_limit}'
+               f') matched ORDER BY score DESC, article_id DESC LIMIT %s OFFSET %s')
+        params = [_tsquery(terms), *([window] if window else []), limit, offset]
+    elif connection.vendor == 'sqlite':
+        sql = (f'SELECT article_id FROM ('
+               f'SELECT rowid AS article_id, bm25({FTS_TABLE}, {FTS5_WEIGHTS}) AS score '
+               f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC {window_limit}'
+               f') matched ORDER BY score, article_id DESC LIMIT %s OFFSET %s')
+        params = [_fts5_query(terms), *([window] if window else []), limit, offset]
+    else:
+        return list(filter_articles(Article.objects.all(), query).order_by('-created_at', '-id')
+                    .values_list('pk', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_articles(queryset, query):
+    """
+    queryset を検索語に一致する記事に絞り込む (管理画面の検索用。順位付けはしない)
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'postgresql':
+        sql = (f'SELECT article_id FROM {SearchDocument._meta.db_table} '
+               f'WHERE search_vector @@ to_tsquery(\'simple\', %s)')
+        return queryset.filter(pk__in=RawSQL(sql, [_tsquery(terms)]))
+    if connection.vendor == 'sqlite':
+        sql = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        return queryset.filter(pk__in=RawSQL(sql, [_fts5_query(terms)]))
+
+    for token, _ in terms:
+        queryset = queryset.filter(Q(search_document__title__contains=token) | Q(search_document__body__contains=token)
+                                   | Q(search_document__comments__contains=token))
+    return queryset
+
+
+def update_documents(article_ids):
+    """
+    記事の SearchDocument を作成・更新する
+    """
+    article_ids = list(article_ids)
+    if not article_ids:
+        return
+    comments = defaultdict(list)
+    for article_id, body in Comment.objects.filter(article_id__in=article_ids).order_by('pk').values_list(
+            'article_id', 'body'):
+        comments[article_id].append(body)
+
+    documents = [
+        SearchDocument(article_id=pk, title=index_text(title), body=index_text(body),
+                       comments=index_text('\n'.join(comments[pk])))
+        for pk, title, body in Article.objects.filter(pk__in=article_ids).values_list('pk', 'title', 'body')
+    ]
+    SearchDocument.objects.bulk_create(documents, update_conflicts=True, unique_fields=['article'],
+                                       update_fields=['title', 'body', 'comments'])
+
+
+def append_comment(article_id, body):
+    """
+    コメントの追加で、記事の SearchDocument の comments の末尾にコメントのトークンを足す
+
+    記事のコメントをすべて読み直さないので、コメントの件数によらず 1 回の UPDATE で済む。
+    コメントは pk 順に並ぶので、update_documents() で作り直したものと同じになる。
+    """
+    text = index_text(body)
+    if not text:
+        return
+    comments = Case(When(comments='', then=Value(text)),
+                    default=Concat('comments', Value(f' {text}')), output_field=TextField())
+    if not SearchDocument.objects.filter(article_id=article_id).update(comments=comments):
+        # 文書がまだない (シグナルの送られない方法で作った記事など)
+        update_documents([article_id])
+
+
+def rebuild(queryset=None, batch_size=1000):
+    """
+    queryset の記事 (省略時はすべて) の SearchDocument を作り直し、処理した件数を返す
+    """
+    queryset = Article.objects.all() if queryset is None else queryset
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    done = 0
+    last_pk = 0
+    while True:
+        batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return done
+        update_documents(batch)
+        done += len(batch)
+        last_pk = batch[-1]
+
+
+def optimize():
+    """
+    インデックスを最適化する (SQLite の FTS5 のセグメントを 1 つにまとめる。大量に更新した後に実行する)
+
+    PostgreSQL の GIN インデックスは autovacuum で整理されるので何もしない。
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
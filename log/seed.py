@@ -0,0 +1,146 @@
+"""
+ベンチマーク用のダミーデータを bulk_create でまとめて作る
+"""
+import random
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from log import cache, changes, imaging, tag_registry
+from log.counters import repair_counters
+from log.models import Article, Comment, ImageJob, Tag
+from log.search import rebuild as rebuild_search_documents
+
+User = get_user_model()
+
+# 本文とコメントを組み立てる語 (全文検索のベンチマークで、語ごとにヒット件数がばらつくようにする)
+WORDS = [
+    '写真', '散歩', '公園', '桜', '紅葉', '海', '山', '川', '夕焼け', '朝日', '猫', '犬', '花', '雨', '雪',
+    'カメラ', 'レンズ', '旅行', '京都', '東京', '大阪', '北海道', '沖縄', 'カフェ', 'ラーメン', '電車', '駅',
+    '今日は', '昨日は', 'とても', '少し', 'きれいでした', '楽しかった', '撮りました', '歩きました', '見つけました',
+]
+
+
+def _sentence(rng, words):
+    return ''.join(rng.choices(WORDS, k=words)) + '。'
+
+
+def zipf_weights(n, skew):
+    """
+    順位 i (0 始まり) のものが選ばれる重み 1 / (i + 1) ** skew の累積。skew が 0 なら一様
+    """
+    return list(accumulate(1 / (i + 1) ** skew for i in range(n)))
+
+
+def _photo_pool(rng, prefix, size):
+    """
+    写真として使う JPEG を size 枚作ってストレージに保存し、名前のリストを返す (記事の間で使い回す)
+    """
+    names = []
+    for i in range(size):
+        width, height = rng.choice([(1600, 1200), (1200, 1600), (1920, 1080)])
+        image = Image.new('RGB', (width, height), tuple(rng.randint(0, 255) for _ in range(3)))
+        ImageDraw.Draw(image).ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4),
+                                      fill=tuple(rng.randint(0, 255) for _ in range(3)))
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=80)
+        names.append(default_storage.save(f'log/photos/seed/{prefix}_{i}.jpg', ContentFile(buffer.getvalue())))
+    return names
+
+
+def seed(users=10, tags=20, articles=1000, comments=5000, batch_size=1000, random_seed=0, skew=0.0, photo_ratio=0.0,
+         photo_pool=10, generate_images=False):
+    """
+    ユーザ・タグ・記事・コメントを作り、作成した件数を dict で返す
+
+    記事は過去 1 年に散らばるように created_at を決める。skew を指定すると、記事を書くユーザ・付けられるタグ・
+    コメントの付く記事・コメントするユーザの偏りを Zipf 分布 (順位の skew 乗に反比例) にする。
+    photo_ratio の割合の記事には、photo_pool 枚の写真のどれかを付ける。generate_images なら写真ごとに
+    サムネイルと縮小版を生成して生成済みにし、そうでなければ ImageJob を登録する。
+
+    記事とコメントは batch_size 件ずつ作るので、保持するのは記事の pk と作成日時だけになる。
+    bulk_create はシグナルを送らないので、作ったものは変更フィード (log/changes.py) にバッチごとに記録し、
+    最後に Article の集計値と全文検索の文書をまとめて更新して、コミット後に一覧・フィード・タグのレジストリの
+    キャッシュ (log/cache.py) を無効にする。
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    prefix = f'seed{now.strftime("%Y%m%d%H%M%S%f")}'
+
+    user_ids = [user.pk for user in User.objects.bulk_create(
+        [User(username=f'{prefix}_user{i}', email=f'{prefix}_user{i}@example.com') for i in range(users)],
+        batch_size=batch_size)]
+    tag_slugs = [f'{prefix}-tag{i}' for i in range(tags)]
+    tag_ids = [tag.pk for tag in Tag.objects.bulk_create(
+        [Tag(name=f'{prefix}_tag{i}', slug=slug) for i, slug in enumerate(tag_slugs)], batch_size=batch_size)]
+    changes.record(changes.TAG, tag_ids)
+    user_weights = zipf_weights(len(user_ids), skew)
+    tag_weights = zipf_weights(len(tag_ids), skew)
+    photos = _photo_pool(rng, prefix, photo_pool) if photo_ratio and articles else []
+
+    through = Article.tags.through
+    # 記事の pk と作成日時 (コメントの記事と日時を決めるのに使う)
+    article_ids = []
+    article_times = []
+    links = 0
+    for start in range(0, articles, batch_size):
+        objs = []
+        for i in range(start, min(start + batch_size, articles)):
+            photo = rng.choice(photos) if photos and rng.random() < photo_ratio else None
+            objs.append(Article(user_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                                title=f'記事{i} {_sentence(rng, 3)}',
+                                body=''.join(_sentence(rng, 8) for _ in range(rng.randint(2, 20))),
+                                photo=photo,
+                                created_at=now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))))
+        objs = Article.objects.bulk_create(objs)
+        batch_links = []
+        for article in objs:
+            article_ids.append(article.pk)
+            article_times.append(article.created_at)
+            picked = set(rng.choices(tag_ids, cum_weights=tag_weights, k=rng.randint(0, 3))) if tag_ids else ()
+            batch_links.extend(through(article_id=article.pk, tag_id=tag_id) for tag_id in picked)
+        through.objects.bulk_create(batch_links, batch_size=batch_size)
+        links += len(batch_links)
+        changes.record(changes.ARTICLE, [article.pk for article in objs])
+        changes.record(changes.ARTICLE_TAGS, sorted({link.article_id for link in batch_links}))
+        if not generate_images:
+            ImageJob.objects.bulk_create([ImageJob(article_id=article.pk, photo=article.photo.name)
+                                          for article in objs if article.photo])
+
+    # コメントの付きやすさは、記事の順番をシャッフルしたうえでの順位で決める
+    popularity = list(range(len(article_ids)))
+    rng.shuffle(popularity)
+    article_weights = zipf_weights(len(popularity), skew)
+    created = 0
+    while created < (comments if article_ids else 0):
+        objs = []
+        for index in rng.choices(popularity, cum_weights=article_weights, k=min(batch_size, comments - created)):
+            objs.append(Comment(
+                article_id=article_ids[index], user_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                body=f'コメント{created + len(objs)} {_sentence(rng, 5)}',
+                created_at=article_times[index] + timedelta(seconds=rng.randint(1, 7 * 24 * 3600))))
+        objs = Comment.objects.bulk_create(objs)
+        changes.record(changes.COMMENT, [comment.pk for comment in objs])
+        created += len(objs)
+
+    if article_ids:
+        seeded = Article.objects.filter(pk__gte=min(article_ids))
+        if photos and generate_images:
+            for name in photos:
+                article = seeded.filter(photo=name).first()
+                if article is not None:
+                    seeded.filter(photo=name).update(**imaging.generate_images(article))
+        repair_counters(seeded, batch_size=batch_size)
+        rebuild_search_documents(seeded, batch_size=batch_size)
+    # 作った記事とタグの詳細ページはまだキャッシュされていないので、一覧とフィードだけでよい
+    if article_ids or tag_ids:
+        cache.bump_on_commit(*cache.version_names(tag_slugs=tag_slugs))
+        tag_registry.invalidate()
+    return {'users': len(user_ids), 'tags': len(tag_ids), 'articles': len(article_ids), 'tag_links': links,
+            'comments': created}
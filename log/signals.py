@@ -0,0 +1,240 @@
+"""
+log アプリのシグナルハンドラ
+
+LogConfig.ready() で読み込まれる。
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from log import cache, changes, counters, search, tag_registry
+from log.models import Article, Comment, Tag
+
+
+def _deleted_with_article(origin):
+    """
+    記事ごと削除されたコメントなら集計値を更新する必要はない
+    """
+    if isinstance(origin, Article):
+        return True
+    return isinstance(origin, QuerySet) and origin.model is Article
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, **kwargs):
+    # 管理画面でコメントの記事が変更された場合に備えて、変更前の記事と本文を控えておく
+    previous = (None, None)
+    if not instance._state.adding:
+        previous = Comment.objects.filter(pk=instance.pk).values_list('article_id', 'body').first() or previous
+    instance._previous_article_id, instance._previous_body = previous
+
+
+def _comment_article_ids(instance):
+    """
+    コメントの保存で影響を受ける記事の pk (記事が変更されていれば変更前の記事も)
+    """
+    return sorted({instance.article_id, instance.__dict__.get('_previous_article_id') or instance.article_id})
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.increment_comment_count(instance)
+    else:
+        # 管理画面で記事や作成日時が変更された場合に備えて数え直す
+        counters.refresh_comment_counters(_comment_article_ids(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_article(origin):
+        counters.refresh_comment_counters([instance.article_id])
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # tag.article_set.clear() は post_clear で pk_set が渡されないので、ここで対象を控えておく
+        instance._cleared_article_ids = list(instance.article_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        article_ids = [instance.pk]
+    elif action == 'post_clear':
+        article_ids = instance.__dict__.pop('_cleared_article_ids', [])
+    else:
+        article_ids = pk_set
+    counters.refresh_tag_counters(article_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    # 削除後は中間テーブルの行が消えているので、対象の記事を先に控えておく
+    instance._deleted_article_ids = list(instance.article_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    counters.refresh_tag_counters(instance.__dict__.pop('_deleted_article_ids', []))
+
+
+# キャッシュ (log/cache.py) とタグのレジストリ (log/tag_registry.py) のバージョンの更新
+# 削除や clear() では、変更後には関係していたタグが分からなくなるので、変更前に名前にしておく。
+# それ以外は invalidate_on_commit() でトランザクションごとにまとめて、コミット後に 1 回だけ記事のタグを読む
+
+@receiver(post_save, sender=Article)
+def article_saved_cache(sender, instance, **kwargs):
+    cache.invalidate_on_commit(article_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Article)
+def article_deleting_cache(sender, instance, **kwargs):
+    instance._cache_version_names = cache.version_names(article_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted_cache(sender, instance, **kwargs):
+    cache.bump_on_commit(*instance.__dict__.pop('_cache_version_names', ()))
+    # タグごとの記事数が変わる
+    tag_registry.invalidate()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved_cache(sender, instance, **kwargs):
+    cache.invalidate_on_commit(article_ids=_comment_article_ids(instance), feeds=False)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted_cache(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_article(origin):
+        cache.invalidate_on_commit(article_ids=[instance.article_id], feeds=False)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() は pk_set が渡されないので、外すタグ (記事) を先に名前にしておく
+        if not reverse:
+            names = cache.version_names(article_ids=[instance.pk])
+        else:
+            names = cache.version_names(article_ids=list(instance.article_set.values_list('pk', flat=True)),
+                                        tag_ids=[instance.pk])
+        instance._cache_version_names = names
+    elif action == 'post_clear':
+        cache.bump_on_commit(*instance.__dict__.pop('_cache_version_names', ()))
+        tag_registry.invalidate()
+    elif action in ('post_add', 'post_remove'):
+        # 外したタグはコミット後には記事から辿れないので、タグとして渡す
+        if not reverse:
+            cache.invalidate_on_commit(article_ids=[instance.pk], tag_ids=pk_set)
+        else:
+            cache.invalidate_on_commit(article_ids=pk_set, tag_ids=[instance.pk])
+        tag_registry.invalidate()
+
+
+@receiver(pre_save, sender=Tag)
+def tag_saving_cache(sender, instance, **kwargs):
+    # スラッグが変更された場合は、変更前のタグ別一覧も無効にする
+    old_slugs = Tag.objects.filter(pk=instance.pk).values_list('slug', flat=True) if instance.pk else []
+    instance._cache_version_names = {'tags', *[f'{prefix}:{slug}' for slug in old_slugs for prefix in ('tag', 'feed')]}
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved_cache(sender, instance, **kwargs):
+    names = instance.__dict__.pop('_cache_version_names', set())
+    cache.bump_on_commit(*names, 'list', f'tag:{instance.slug}', 'feed', f'feed:{instance.slug}')
+    tag_registry.invalidate()
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting_cache(sender, instance, **kwargs):
+    article_ids = list(instance.article_set.values_list('pk', flat=True))
+    instance._cache_version_names = {'tags', *cache.version_names(article_ids=article_ids, tag_slugs=[instance.slug])}
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted_cache(sender, instance, **kwargs):
+    cache.bump_on_commit(*instance.__dict__.pop('_cache_version_names', ()))
+    tag_registry.invalidate()
+
+
+# 全文検索の文書 (log/search.py) の更新
+
+@receiver(post_save, sender=Article)
+def article_saved_search(sender, instance, update_fields=None, **kwargs):
+    # 集計値やサムネイルの状態だけを保存した場合は、検索の対象は変わらない
+    if update_fields is not None and not {'title', 'body'} & set(update_fields):
+        return
+    search.update_documents([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved_search(sender, instance, created, **kwargs):
+    # 追加は末尾に足すだけにする。まれな編集・記事の変更・削除では、記事のコメントをすべて読んで作り直す
+    if created:
+        search.append_comment(instance.article_id, instance.body)
+    elif (instance.__dict__.get('_previous_body') != instance.body
+          or instance.__dict__.get('_previous_article_id') not in (None, instance.article_id)):
+        search.update_documents(_comment_article_ids(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted_search(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_article(origin):
+        search.update_documents([instance.article_id])
+
+
+# 変更フィード (log/changes.py) の記録
+
+@receiver(post_save, sender=Article)
+def article_saved_changes(sender, instance, **kwargs):
+    changes.record(changes.ARTICLE, [instance.pk])
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted_changes(sender, instance, **kwargs):
+    # コメントとタグの付け外しの削除も、この tombstone で表す
+    changes.record(changes.ARTICLE, [instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved_changes(sender, instance, **kwargs):
+    changes.record(changes.COMMENT, [instance.pk])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted_changes(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_article(origin):
+        changes.record(changes.COMMENT, [instance.pk], deleted=True)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._changes_article_ids = list(instance.article_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            article_ids = [instance.pk]
+        elif action == 'post_clear':
+            article_ids = instance.__dict__.pop('_changes_article_ids', [])
+        else:
+            article_ids = pk_set
+        changes.record(changes.ARTICLE_TAGS, article_ids)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved_changes(sender, instance, **kwargs):
+    changes.record(changes.TAG, [instance.pk])
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting_changes(sender, instance, **kwargs):
+    # タグの削除で中間テーブルの行も消えるので、付いていた記事のタグの付け外しとして記録する
+    changes.record(changes.ARTICLE_TAGS, instance.article_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted_changes(sender, instance, **kwargs):
+    changes.record(changes.TAG, [instance.pk], deleted=True)
@@ -0,0 +1,258 @@
+"""
+遅いクエリ・遅いリクエストの記録 (slow_queries コマンドで集計する)
+
+クエリの時間は log/budgets.py の execute_wrapper が測ったものを受け取り (add_listener)、LOG_SLOW_QUERY_MS 以上
+かかったクエリを、SQL の指紋 (fingerprint)・呼び出し元のスタック・ビューの名前 (log:article_detail など) とともに記録する。
+LOG_SLOW_REQUEST_MS 以上かかったリクエストは SlowRequestMiddleware が、リクエストの QueryRecorder
+(QueryBudgetMiddleware の request.query_recorder) のクエリ数・DB の時間とともに記録する。
+
+本番で有効にしたままにできるように、次のようにしている。
+
+- LOG_SLOW_QUERY_DIR が空なら何も記録しない
+- しきい値未満のクエリは時間を比べるだけで、スタックの取得や書き込みはしない
+- パラメータ (個人情報を含みうる) は記録せず、SQL も長さを制限する
+- 記録は LOG_SLOW_QUERY_SAMPLE_RATE の割合だけ、1 秒あたり LOG_SLOW_QUERY_MAX_PER_SECOND 件まで
+- 書き込み先はプロセスごとのファイル (<ホスト名>-<pid>.jsonl) で、一定の大きさでローテートする
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from contextlib import nullcontext
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from log import budgets
+from log.budgets import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 1 ファイルの大きさの上限と、残す古いファイルの数
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+# 記録する SQL の長さ・スタックの深さ
+SQL_MAX_LENGTH = 2000
+STACK_DEPTH = 8
+
+
+class Writer:
+    """
+    プロセスごとのファイルに 1 行 1 件の JSON で書き出す。記録する件数は 1 秒ごとに制限する
+    """
+
+    def __init__(self):
+        self._handler = None
+        self._path = None
+        self._lock = threading.Lock()
+        self._second = 0
+        self._count = 0
+        self.dropped = 0
+
+    def _get_handler(self):
+        # fork した後は、自分のプロセスのファイルを開き直す
+        path = Path(settings.LOG_SLOW_QUERY_DIR) / f'{socket.gethostname()}-{os.getpid()}.jsonl'
+        if self._path != path:
+            with self._lock:
+                if self._path != path:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    if self._handler is not None:
+                        self._handler.close()
+                    self._handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                                                        encoding='utf-8', delay=True)
+                    self._path = path
+        return self._handler
+
+    def close(self):
+        with self._lock:
+            if self._handler is not None:
+                self._handler.close()
+            self._handler = None
+            self._path = None
+
+    def allow(self):
+        if random.random() >= settings.LOG_SLOW_QUERY_SAMPLE_RATE:
+            return False
+        # スレッド間で厳密でなくてよいので、ロックは取らない
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second, self._count = second, 0
+        self._count += 1
+        if self._count > settings.LOG_SLOW_QUERY_MAX_PER_SECOND:
+            self.dropped += 1
+            return False
+        return True
+
+    def write(self, entry):
+        entry = {'at': timezone.now().isoformat(), 'pid': os.getpid(), **entry}
+        try:
+            handler = self._get_handler()
+            handler.emit(logging.makeLogRecord({'msg': json.dumps(entry, ensure_ascii=False)}))
+        except Exception:
+            # 記録に失敗してもリクエストは止めない
+            logger.exception('failed to write slow query log')
+
+
+writer = Writer()
+
+
+def enabled():
+    return bool(settings.LOG_SLOW_QUERY_DIR)
+
+
+def call_site(depth=STACK_DEPTH):
+    """
+    このプロジェクトのコードの呼び出し元 (内側が最後)。Django やライブラリ、このモジュールと execute_wrapper のフレームは除く
+    """
+    base = str(settings.BASE_DIR)
+    frames = []
+    # 内側から順にたどる。ソースの行は読まない
+    for frame in traceback.StackSummary.extract(traceback.walk_stack(None), lookup_lines=False):
+        filename = frame.filename
+        if (not filename.startswith(base) or 'site-packages' in filename or filename == __file__
+                or frame.name == '_execute_wrapper'):
+            continue
+        frames.append(f'{os.path.relpath(filename, base)}:{frame.lineno} in {frame.name}')
+        if len(frames) == depth:
+            break
+    return frames[::-1]
+
+
+def _query_executed(sql, seconds, many, context):
+    if not enabled() or seconds * 1000 < settings.LOG_SLOW_QUERY_MS or not writer.allow():
+        return
+    recorder = budgets.current_recorder()
+    writer.write({
+        'type': 'query',
+        'ms': round(seconds * 1000, 2),
+        'fingerprint': fingerprint(sql)[:SQL_MAX_LENGTH],
+        'sql': sql[:SQL_MAX_LENGTH],
+        'many': many,
+        'view': recorder.view_name if recorder is not None else None,
+        'database': context['connection'].alias,
+        'stack': call_site(),
+    })
+
+
+def install():
+    """
+    log/budgets.py の execute_wrapper からクエリを受け取るようにする (LogConfig.ready から呼ぶ)
+    """
+    budgets.add_listener(_query_executed)
+    # 新しい接続には log/budgets.py が connection_created で付ける
+    for connection in connections.all(initialized_only=True):
+        budgets.install(connection)
+
+
+def _request_recording(request):
+    """
+    QueryBudgetMiddleware が記録していればその QueryRecorder を使い、なければ (LOG_QUERY_BUDGET が off) 同じように記録する
+    """
+    recorder = getattr(request, 'query_recorder', None)
+    if recorder is not None:
+        return nullcontext(recorder)
+    request.query_recorder = budgets.QueryRecorder()
+    return budgets.recording(request.query_recorder)
+
+
+class SlowRequestMiddleware:
+    """
+    遅いクエリにビューの名前を付け、LOG_SLOW_REQUEST_MS 以上かかったリクエストを記録する
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        with _request_recording(request) as recorder:
+            response = self.get_response(request)
+        self.record(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with _request_recording(request) as recorder:
+            response = await self.get_response(request)
+        self.record(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None and request.resolver_match is not None:
+            recorder.view_name = request.resolver_match.view_name
+
+    def record(self, request, response, recorder, elapsed):
+        if elapsed * 1000 < settings.LOG_SLOW_REQUEST_MS or not writer.allow():
+            return
+        writer.write({
+            'type': 'request',
+            'ms': round(elapsed * 1000, 2),
+            'view': recorder.view_name,
+            'method': request.method,
+            # クエリ文字列は個人情報を含みうるので記録しない
+            'path': request.path,
+            'status': response.status_code,
+            'queries': len(recorder.queries),
+            'db_ms': round(sum(seconds for _, seconds in recorder.queries) * 1000, 2),
+        })
+
+
+def read_entries(directory, since=None):
+    """
+    directory のすべてのファイル (ローテートしたものを含む) の記録を返す。since より前のものは除く
+    """
+    for path in sorted(Path(directory).glob('*.jsonl*')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み中の行など
+                    continue
+                if since is None or datetime.fromisoformat(entry['at']) >= since:
+                    yield entry
+
+
+def aggregate(entries, type='query'):
+    """
+    指紋 (リクエストはビュー) ごとに集計し、合計時間の長い順のリストで返す
+    """
+    groups = {}
+    for entry in entries:
+        if entry.get('type') != type:
+            continue
+        key = entry['fingerprint'] if type == 'query' else (entry.get('view'), entry.get('method'))
+        group = groups.setdefault(key, {'key': key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'views': {},
+                                        'example': entry})
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        if entry['ms'] > group['max_ms']:
+            group['max_ms'] = entry['ms']
+            group['example'] = entry
+        view = entry.get('view') or '-'
+        group['views'][view] = group['views'].get(view, 0) + 1
+    result = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+    for group in result:
+        group['mean_ms'] = group['total_ms'] / group['count']
+    return result
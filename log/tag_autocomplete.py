@@ -0,0 +1,147 @@
+"""
+タグの入力補完 (名前・スラッグの前方一致と、trigram による曖昧一致)
+
+- PostgreSQL: pg_trgm の GIN インデックス (log/migrations/0009_tag_trigram.py) を使って検索する
+- それ以外: タグのレジストリ (log/tag_registry.py) の一覧から作ったプロセス内のインデックス
+  (前方一致用の trie と、trigram の転置インデックス) で検索する
+
+どちらも前方一致したタグを先に、次に似ているタグを類似度の高い順に返す。
+"""
+import unicodedata
+
+from django.db import connection
+
+from log.models import Tag
+from log.tag_registry import TagEntry, get_tags
+
+# これ以上似ているタグを曖昧一致とする (pg_trgm の pg_trgm.similarity_threshold の既定値と同じ)
+SIMILARITY_THRESHOLD = 0.3
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text).lower().strip()
+
+
+def trigrams(text):
+    """
+    pg_trgm と同じように、単語の前に空白 2 つ・後ろに空白 1 つを付けて 3 文字ずつに分ける
+    """
+    result = set()
+    for word in text.split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a, b):
+    """
+    trigram の集合どうしの類似度 (共通する数 / 合わせた数)
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TagIndex:
+    """
+    タグの一覧から作る、前方一致 (trie) と曖昧一致 (trigram の転置インデックス) のインデックス
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        # trie の各ノードは {文字: 子ノード} と、そのノードを通るタグの番号の集合 ('' キー) を持つ
+        self._trie = {'': set()}
+        # trigram -> タグの番号の集合
+        self._trigrams = {}
+        # タグごとの、名前とスラッグの trigram の集合のリスト
+        self._tag_trigrams = []
+        for i, tag in enumerate(tags):
+            keys = {normalize(tag.name), normalize(tag.slug)}
+            for key in keys:
+                node = self._trie
+                for char in key:
+                    node = node.setdefault(char, {'': set()})
+                    node[''].add(i)
+            grams = [trigrams(key) for key in keys]
+            self._tag_trigrams.append(grams)
+            for gram in set().union(*grams):
+                self._trigrams.setdefault(gram, set()).add(i)
+
+    def prefix(self, query):
+        node = self._trie
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node['']
+
+    def fuzzy(self, query, threshold=SIMILARITY_THRESHOLD):
+        """
+        query と似ているタグの (類似度, 番号) のリスト。trigram を 1 つも共有しないタグは調べない
+        """
+        grams = trigrams(query)
+        candidates = set().union(*(self._trigrams.get(gram, ()) for gram in grams)) if grams else set()
+        # 名前とスラッグのうち、似ている方の類似度を使う
+        scored = [(max(similarity(grams, tag_grams) for tag_grams in self._tag_trigrams[i]), i) for i in candidates]
+        return [(score, i) for score, i in scored if score >= threshold]
+
+    def suggest(self, query, limit=10):
+        query = normalize(query)
+        if not query:
+            return []
+        matched = sorted(self.prefix(query), key=lambda i: (-self.tags[i].article_count, self.tags[i].name))
+        if len(matched) < limit:
+            seen = set(matched)
+            fuzzy = sorted((-score, self.tags[i].name, i) for score, i in self.fuzzy(query) if i not in seen)
+            matched.extend(i for _, _, i in fuzzy)
+        return [self.tags[i] for i in matched[:limit]]
+
+
+# (インデックスを作ったタグの一覧, インデックス) のタプル。レジストリの一覧が入れ替わったら作り直す
+_index = ((), TagIndex(()))
+
+
+def get_index():
+    global _index
+    tags = get_tags()
+    if _index[0] is not tags:
+        _index = (tags, TagIndex(tags))
+    return _index[1]
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _suggest_postgresql(query, limit):
+    table = Tag._meta.db_table
+    through = Tag.article_set.through._meta.db_table
+    # %% は pg_trgm の類似演算子 (パラメータを渡すときは % をエスケープする)
+    sql = f'''
+        SELECT id, name, slug, article_count FROM (
+            SELECT t.id, t.name, t.slug,
+                   (SELECT count(*) FROM {through} a WHERE a.tag_id = t.id) AS article_count,
+                   (lower(t.name) LIKE %(prefix)s OR lower(t.slug) LIKE %(prefix)s) AS is_prefix,
+                   greatest(similarity(lower(t.name), %(query)s), similarity(lower(t.slug), %(query)s)) AS score
+            FROM {table} t
+            WHERE lower(t.name) LIKE %(prefix)s OR lower(t.slug) LIKE %(prefix)s
+               OR lower(t.name) %% %(query)s OR lower(t.slug) %% %(query)s
+        ) matched
+        ORDER BY is_prefix DESC, CASE WHEN is_prefix THEN article_count ELSE 0 END DESC, score DESC, name
+        LIMIT %(limit)s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'prefix': f'{_escape_like(query)}%', 'query': query, 'limit': limit})
+        return [TagEntry(*row) for row in cursor.fetchall()]
+
+
+def suggest(query, limit=10):
+    """
+    query に一致・類似するタグを最大 limit 件、TagEntry のリストで返す
+    """
+    query = normalize(query)
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        return _suggest_postgresql(query, limit)
+    return get_index().suggest(query, limit)
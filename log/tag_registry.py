@@ -0,0 +1,107 @@
+"""
+タグの一覧(記事数つき)のレジストリ
+
+タグはほとんど変更されないので、プロセス内と共有のキャッシュの 2 段に置いておき、一覧や
+タグ別一覧のビュー・テンプレートはデータベースではなくここから読む。
+変更されたかどうかは log/cache.py のバージョン (tag_registry) で判断し、バージョンは
+タグの作成・更新・削除、記事へのタグの付け外し、記事の削除のシグナル (log/signals.py) で更新される。
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from log.cache import KEY_PREFIX, aget_versions, bump_on_commit, get_versions
+from log.models import Tag
+
+VERSION_NAME = 'tag_registry'
+
+TagEntry = namedtuple('TagEntry', ['pk', 'name', 'slug', 'article_count'])
+
+# (バージョン, タグの一覧) のタプル。入れ替えは 1 回の代入で行う
+_registry = (None, ())
+
+
+def _queryset():
+    return Tag.objects.annotate(article_count=Count('article')).order_by('name', 'pk')
+
+
+def _load():
+    return tuple(TagEntry(tag.pk, tag.name, tag.slug, tag.article_count) for tag in _queryset())
+
+
+def get_tags():
+    """
+    タグの一覧を名前順の TagEntry のタプルで返す
+
+    バージョンが変わっていなければプロセス内のものを、なければ共有のキャッシュのものを使う。
+    """
+    global _registry
+    version = get_versions(VERSION_NAME)[VERSION_NAME]
+    if _registry[0] == version:
+        return _registry[1]
+
+    key = f'{KEY_PREFIX}:tag_registry:{version}'
+    tags = cache.get(key)
+    if tags is None:
+        tags = _load()
+        cache.set(key, tags)
+    _registry = (version, tags)
+    return tags
+
+
+async def aget_tags():
+    """
+    get_tags() の非同期版
+    """
+    global _registry
+    version = (await aget_versions(VERSION_NAME))[VERSION_NAME]
+    if _registry[0] == version:
+        return _registry[1]
+
+    key = f'{KEY_PREFIX}:tag_registry:{version}'
+    tags = await cache.aget(key)
+    if tags is None:
+        tags = tuple([TagEntry(tag.pk, tag.name, tag.slug, tag.article_count)
+                      async for tag in _queryset().aiterator()])
+        await cache.aset(key, tags)
+    _registry = (version, tags)
+    return tags
+
+
+def _find(tags, slug):
+    for tag in tags:
+        if tag.slug == slug:
+            return tag
+    return None
+
+
+def get_tag(slug, tags=None):
+    """
+    スラッグが一致する TagEntry を返す。なければ None
+
+    tags に読み込み済みの一覧を渡すと、レジストリを読まずにその中から探す。
+    """
+    return _find(get_tags() if tags is None else tags, slug)
+
+
+async def aget_tag(slug):
+    return _find(await aget_tags(), slug)
+
+
+def popular(tags, limit, current=None):
+    """
+    記事数の多い順 (同数なら名前順) に limit 件の TagEntry を、名前順のタプルで返す
+
+    current (TagEntry) を渡すと、上位に入っていなくても含める。limit が 0 ならすべて返す。
+    """
+    if not limit or len(tags) <= limit:
+        return tuple(tags)
+    top = set(sorted(tags, key=lambda tag: -tag.article_count)[:limit])
+    if current is not None:
+        top.add(current)
+    return tuple(tag for tag in tags if tag in top)
+
+
+def invalidate():
+    bump_on_commit(VERSION_NAME)
@@ -0,0 +1,34 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from log.imaging import photo_variants
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ', '.join(f'{url} {width}w' for url, width in variants)
+
+
+@register.simple_tag
+def responsive_photo(article, sizes='100vw', css_class=''):
+    """
+    記事の写真を <picture> で出力する
+
+    縮小版がまだ生成されていない場合は元の写真をそのまま出力する。
+    {% responsive_photo article sizes="(min-width: 1024px) 1024px, 100vw" css_class="card-img-top" %}
+    """
+    if not article.photo:
+        return ''
+    variants = photo_variants(article)
+    if not variants:
+        return format_html('<img src="{}" class="{}" alt="{}">', article.photo.url, css_class, article.title)
+
+    *sources, (_, fallback) = variants
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}"></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                         ((mime_type, _srcset(variant), sizes) for mime_type, variant in sources)),
+        fallback[-1][0], _srcset(fallback), sizes, article.photo_width, article.photo_height, css_class,
+        article.title,
+    )
@@ -0,0 +1,162 @@
+"""
+api.py (読み取り専用の JSON API) と /log/api/articles などのビューのテスト
+
+ビューの予算 (query_budget) を超えるとテストは失敗する (LOG_QUERY_BUDGET = 'raise')。
+"""
+import gzip
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from log.models import Article, Comment, Tag
+from log.pagination import NEXT, encode_cursor
+
+User = get_user_model()
+
+
+class ApiTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@bar.com', password='test')
+        cls.tags = [Tag.objects.create(name=f'タグ{i}', slug=f'tag{i}') for i in range(2)]
+        cls.articles = []
+        for i in range(3):
+            article = Article.objects.create(title=f'タイトル{i}', body=f'本文{i}', user=cls.user)
+            article.tags.set(cls.tags[:i])
+            for j in range(i):
+                Comment.objects.create(article=article, user=cls.user, body=f'コメント{i}-{j}')
+            cls.articles.append(article)
+
+    def get(self, name, params=None, status=200, **kwargs):
+        response = self.client.get(reverse(f'log:{name}', kwargs=kwargs), params or {})
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response.json()
+
+
+class TestArticleList(ApiTestCase):
+    def test_list(self):
+        body = self.get('api_article_list')
+        self.assertEqual([item['id'] for item in body['data']], [article.pk for article in reversed(self.articles)])
+        item = body['data'][0]
+        self.assertEqual(item['user'], 'alice')
+        self.assertEqual(item['tag_count'], 2)
+        self.assertIsNone(item['photo'])
+        self.assertNotIn('tags', item)
+        self.assertNotIn('alice@bar.com', str(body))
+        self.assertEqual((body['next'], body['previous']), (None, None))
+
+    def test_fields(self):
+        body = self.get('api_article_list', {'fields': 'created_at,title'})
+        # id は常に返し、項目は指定の順ではなく決まった順に並べる
+        self.assertEqual(list(body['data'][0]), ['id', 'title', 'created_at'])
+
+    def test_include(self):
+        body = self.get('api_article_list', {'fields': 'title', 'include': 'tags,comments'})
+        item = body['data'][0]
+        self.assertEqual([tag['slug'] for tag in item['tags']], ['tag0', 'tag1'])
+        self.assertEqual([comment['body'] for comment in item['comments']], ['コメント2-1', 'コメント2-0'])
+        self.assertEqual(list(item['comments'][0]), ['id', 'user', 'body', 'created_at', 'updated_at', 'version'])
+        self.assertEqual((body['data'][-1]['tags'], body['data'][-1]['comments']), ([], []))
+
+    def test_include_queries(self):
+        # include は記事の件数によらず関係ごとに 1 回のクエリ
+        for i in range(5):
+            article = Article.objects.create(title=f'追加{i}', body='本文', user=self.user)
+            article.tags.set(self.tags)
+            Comment.objects.create(article=article, user=self.user, body='コメント')
+        with self.assertNumQueries(3):
+            body = self.get('api_article_list', {'include': 'tags,comments'})
+        self.assertEqual(len(body['data']), 8)
+        with self.assertNumQueries(1):
+            self.get('api_article_list', {'fields': 'title'})
+
+    @override_settings(LOG_API_INCLUDED_COMMENTS=1)
+    def test_included_comments(self):
+        body = self.get('api_article_list', {'include': 'comments'})
+        self.assertEqual([len(item['comments']) for item in body['data']], [1, 1, 0])
+        self.assertEqual(body['data'][0]['comments'][0]['body'], 'コメント2-1')
+
+    def test_pagination(self):
+        seen = []
+        params = {'limit': 2, 'fields': 'title'}
+        body = self.get('api_article_list', params)
+        seen += body['data']
+        self.assertIsNone(body['previous'])
+        body = self.get('api_article_list', {**params, 'cursor': body['next']})
+        seen += body['data']
+        self.assertIsNone(body['next'])
+        self.assertEqual([item['id'] for item in seen], [article.pk for article in reversed(self.articles)])
+
+        previous = self.get('api_article_list', {**params, 'cursor': body['previous']})
+        self.assertEqual(previous['data'], seen[:2])
+
+    def test_tag(self):
+        body = self.get('api_article_list', {'tag': 'tag1', 'fields': 'title'})
+        self.assertEqual([item['id'] for item in body['data']], [self.articles[2].pk])
+        self.get('api_article_list', {'tag': 'missing'}, status=404)
+
+    def test_invalid(self):
+        for params in ({'fields': 'title,password'}, {'include': 'user'}, {'limit': 0}, {'limit': 'x'},
+                       {'cursor': 'invalid'}):
+            with self.subTest(params=params):
+                self.assertIn('error', self.get('api_article_list', params, status=400))
+
+    def test_oversized_cursor(self):
+        # bigint に収まらない id のカーソルは 400 (データベースに渡すと OverflowError で 500 になる)
+        cursor = encode_cursor({'created_at': timezone.now(), 'id': 10 ** 20}, NEXT)
+        self.assertIn('error', self.get('api_article_list', {'cursor': cursor}, status=400))
+
+    def test_read_only(self):
+        response = self.client.post(reverse('log:api_article_list'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_gzip(self):
+        response = self.client.get(reverse('log:api_article_list'), {'include': 'tags,comments'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        content = gzip.decompress(response.content).decode()
+        # 日本語はエスケープせず、区切りの空白も入れない
+        self.assertIn('タイトル2', content)
+        self.assertNotIn(', "', content)
+        self.assertEqual(len(json.loads(content)['data']), 3)
+
+
+class TestArticleDetail(ApiTestCase):
+    def test_detail(self):
+        article = self.articles[1]
+        body = self.get('api_article_detail', {'fields': 'title', 'include': 'tags'}, pk=article.pk)
+        self.assertEqual(body, {'data': {'id': article.pk, 'title': 'タイトル1',
+                                         'tags': [{'id': self.tags[0].pk, 'name': 'タグ0', 'slug': 'tag0'}]}})
+
+    def test_not_found(self):
+        self.get('api_article_detail', pk=0, status=404)
+        # bigint の範囲を超える id でも 500 にしない
+        self.get('api_article_detail', pk=10 ** 20, status=404)
+
+
+class TestCommentList(ApiTestCase):
+    def test_list(self):
+        article = self.articles[2]
+        body = self.get('api_comment_list', {'article': article.pk, 'fields': 'body,article'})
+        self.assertEqual([(item['article'], item['body']) for item in body['data']],
+                         [(article.pk, 'コメント2-1'), (article.pk, 'コメント2-0')])
+        self.assertEqual(len(self.get('api_comment_list')['data']), 3)
+
+    def test_invalid(self):
+        for params in ({'article': 'x'}, {'article': '9' * 20}, {'article': '-1'}, {'include': 'article'},
+                       {'fields': 'email'}):
+            with self.subTest(params=params):
+                self.get('api_comment_list', params, status=400)
+
+
+class TestTagList(ApiTestCase):
+    def test_list(self):
+        body = self.get('api_tag_list')
+        self.assertEqual(body['data'][1], {'id': self.tags[1].pk, 'name': 'タグ1', 'slug': 'tag1', 'article_count': 1})
+        self.assertEqual(self.get('api_tag_list', {'fields': 'slug'})['data'][0], {'id': self.tags[0].pk,
+                                                                                  'slug': 'tag0'})
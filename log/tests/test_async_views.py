@@ -0,0 +1,130 @@
+"""
+async_views.py のテスト
+
+同期版 (test_views.py) と同じ HTML になることと、テンプレートの描画中に DB へアクセスしないことを確認する。
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+
+from log import async_views
+from log.counters import repair_counters
+from log.models import Article, Comment, Tag
+
+User = get_user_model()
+
+
+@override_settings(ROOT_URLCONF='log.tests.urls_async')
+class TestAsyncViews(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='test_name', slug='test_slug')
+        cls.articles = []
+        for i in range(7):
+            article = Article.objects.create(title=f'test_title{i}', body='test_body', user=cls.user)
+            if i % 2 == 0:
+                article.tags.add(cls.tag)
+            Comment.objects.bulk_create(
+                [Comment(article=article, user=cls.user, body=f'comment{i}-{j}') for j in range(i)])
+            cls.articles.append(article)
+        repair_counters()
+
+    def test_urls(self):
+        self.assertIs(resolve(reverse('log:article_list')).func.view_class, async_views.ArticleListView)
+        self.assertIs(resolve(reverse('log:article_detail', args=[1])).func.view_class, async_views.ArticleDetailView)
+
+    def test_atomic_requests(self):
+        # 本番 (config/docker.py, config/production.py) と同じく ATOMIC_REQUESTS が有効でも表示できる
+        self.client.login(username='test', password='test')
+        article = self.articles[0]
+        with mock.patch.dict(connection.settings_dict, {'ATOMIC_REQUESTS': True}):
+            for path in (reverse('log:article_list'), reverse('log:article_tag_list', args=[self.tag.slug]),
+                         reverse('log:article_detail', args=[article.pk])):
+                with self.subTest(path=path):
+                    self.assertEqual(self.client.get(path).status_code, 200)
+            response = self.client.post(reverse('log:article_detail', args=[article.pk]), {'body': 'atomic'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Comment.objects.filter(article=article, body='atomic').exists())
+
+    def test_list(self):
+        response = self.client.get(reverse('log:article_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'log/article_list.html')
+        articles = response.context['articles']
+        self.assertEqual([article.title for article in articles], [f'test_title{i}' for i in range(6, 1, -1)])
+        self.assertEqual([comment.body for comment in articles[0].latest_comments], ['comment6-5'])
+        self.assertContains(response, 'コメント: 6件')
+        self.assertContains(response, 'test_name (4)')
+        self.assertContains(response, '?page=2&order=newest')
+
+    def test_list_page_2_and_404(self):
+        response = self.client.get(reverse('log:article_list'), {'page': 2})
+        self.assertEqual([article.title for article in response.context['articles']], ['test_title1', 'test_title0'])
+        self.assertEqual(response.context['articles'][1].latest_comments, [])
+        self.assertEqual(self.client.get(reverse('log:article_list'), {'page': 3}).status_code, 404)
+
+    def test_list_discussed(self):
+        response = self.client.get(reverse('log:article_list'), {'order': 'discussed'})
+        self.assertEqual(response.context['articles'][0].title, 'test_title6')
+        self.assertNotIn('test_title0', [article.title for article in response.context['articles']])
+
+    @override_settings(LOG_CURSOR_PAGINATION=True)
+    def test_list_cursor(self):
+        response = self.client.get(reverse('log:article_list'))
+        page_obj = response.context['page_obj']
+        self.assertTrue(response.context['cursor_pagination'])
+        response = self.client.get(reverse('log:article_list'), {'cursor': page_obj.next_cursor})
+        self.assertEqual([article.title for article in response.context['articles']], ['test_title1', 'test_title0'])
+        self.assertEqual(self.client.get(reverse('log:article_list'), {'cursor': 'broken'}).status_code, 400)
+
+    def test_tag_list(self):
+        response = self.client.get(reverse('log:article_tag_list', args=[self.tag.slug]))
+        self.assertEqual([article.title for article in response.context['articles']],
+                         ['test_title6', 'test_title4', 'test_title2', 'test_title0'])
+        self.assertEqual(response.context['current_tag'].pk, self.tag.pk)
+        self.assertEqual(self.client.get(reverse('log:article_tag_list', args=['no_such_slug'])).status_code, 404)
+
+    def test_detail(self):
+        article = self.articles[2]
+        response = self.client.get(reverse('log:article_detail', args=[article.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'log/article_detail.html')
+        self.assertContains(response, '<li class="list-group-item">test_name</li>', html=True)
+        self.assertContains(response, 'comment2-1')
+        self.assertEqual(self.client.get(reverse('log:article_detail', args=[9999])).status_code, 404)
+
+    def test_detail_logged_in_and_comment(self):
+        article = self.articles[0]
+        self.client.login(username='test', password='test')
+        response = self.client.get(reverse('log:article_detail', args=[article.pk]))
+        self.assertContains(response, 'コメントを追加する')
+        self.assertContains(response, reverse('log:article_update', args=[article.pk]))
+
+        path = reverse('log:article_detail', args=[article.pk])
+        response = self.client.post(path, {'body': 'async_comment'}, follow=True)
+        self.assertRedirects(response, path)
+        self.assertContains(response, 'コメントを投稿しました。')
+        self.assertContains(response, 'async_comment')
+
+    async def test_async_client(self):
+        response = await self.async_client.get(reverse('log:article_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'test_title6')
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-async'}},
+        LOG_PAGE_CACHE_TIMEOUT=300,
+    )
+    def test_page_cache(self):
+        cache.clear()
+        path = reverse('log:article_detail', args=[self.articles[0].pk])
+        self.assertEqual(self.client.get(path)['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(path)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
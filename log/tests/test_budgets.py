@@ -0,0 +1,182 @@
+"""
+budgets.py (ビューのクエリ数・処理時間の予算) のテスト
+"""
+import inspect
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from django.views import View
+
+from log import views
+from log.budgets import QueryBudget, QueryBudgetExceeded, assert_query_budget, fingerprint, get_budget
+from log.counters import repair_counters
+from log.models import Article, Comment
+
+User = get_user_model()
+
+
+def _without_user_prefetch(self):
+    # コメントのユーザを prefetch しない (N+1 になる) 詳細ページの queryset
+    return Article.objects.select_related('user').prefetch_related(
+        'tags', Prefetch('comments', queryset=Comment.objects.order_by('pk')))
+
+
+class TestFingerprint(TestCase):
+    def test_literals(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b = 12 AND c = %s LIMIT 21"),
+                         'SELECT * FROM t WHERE a = ? AND b = ? AND c = ? LIMIT ?')
+
+    def test_in_list(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         fingerprint('SELECT * FROM t WHERE id IN (%s)'))
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s)'), 'SELECT * FROM t WHERE id IN (...)')
+
+    def test_identifiers(self):
+        self.assertEqual(fingerprint('SELECT "t1"."id"\n  FROM "log_article" "t1"'),
+                         'SELECT "t1"."id" FROM "log_article" "t1"')
+
+
+class TestDeclaredBudgets(TestCase):
+    def test_every_view(self):
+        """
+        log/views.py のすべてのビューが GET の予算を宣言している
+        """
+        for name, view in inspect.getmembers(views, inspect.isclass):
+            if issubclass(view, View) and view.__module__ == views.__name__:
+                with self.subTest(view=name):
+                    self.assertIsInstance(get_budget(view.as_view(), 'GET'), QueryBudget)
+
+    def test_method(self):
+        detail = views.ArticleDetailView.as_view()
+        self.assertEqual(get_budget(detail, 'POST'), views.ArticleDetailView.query_budget['post'])
+        self.assertIsNone(get_budget(detail, 'DELETE'))
+
+
+class TestAssertQueryBudget(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+
+    def test_within(self):
+        with assert_query_budget(QueryBudget(queries=1)) as recorder:
+            list(Article.objects.all())
+        self.assertEqual(len(recorder.queries), 1)
+
+    def test_queries(self):
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with assert_query_budget(QueryBudget(queries=1, duplicates=None), label='two'):
+                list(Article.objects.all())
+                list(Comment.objects.all())
+        self.assertEqual(cm.exception.report['violations'], ['queries'])
+        self.assertEqual(cm.exception.report['view'], 'two')
+
+    def test_duplicates(self):
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with assert_query_budget(QueryBudget()):
+                for pk in range(3):
+                    Article.objects.filter(pk=pk).first()
+        self.assertEqual(cm.exception.report['duplicates'], 2)
+        self.assertEqual(cm.exception.report['fingerprints'][0]['count'], 3)
+
+    def test_transaction_statements(self):
+        # テストの中の atomic() はセーブポイントになるが、それは数えない
+        with assert_query_budget(QueryBudget(queries=1)) as recorder:
+            with transaction.atomic():
+                list(Article.objects.all())
+        self.assertEqual(len(recorder.queries), 1)
+
+    def test_wall_time(self):
+        # 処理時間はマシンの負荷で変わるので、'raise' でも送出せずにログに出すだけ
+        with self.assertLogs('log.budgets', 'WARNING') as logs:
+            with assert_query_budget(QueryBudget(wall_ms=0)):
+                list(Article.objects.all())
+        self.assertEqual(logs.records[0].query_budget['violations'], ['wall_ms'])
+
+    def test_wall_time_with_queries(self):
+        # クエリ数も超えていれば送出する
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with assert_query_budget(QueryBudget(queries=0, wall_ms=0)):
+                list(Article.objects.all())
+        self.assertEqual(cm.exception.report['violations'], ['queries', 'wall_ms'])
+
+
+class TestQueryBudgetMiddleware(TestCase):
+    """
+    詳細ページはコメントの件数によらず予算内で表示し、N+1 になると予算を超える
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(username=f'test{i}', email=f'foo{i}@bar.com', password='test')
+                 for i in range(5)]
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=users[0])
+        Comment.objects.bulk_create(
+            [Comment(article=cls.article, user=users[i % 5], body=f'comment{i}') for i in range(20)])
+        repair_counters()
+        cls.path = reverse('log:article_detail', args=[cls.article.pk])
+
+    def test_within_budget(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'comment19')
+        self.assertEqual(response.wsgi_request.query_recorder.duplicates, 0)
+
+    def test_n_plus_one_raises(self):
+        with mock.patch.object(views.ArticleDetailView, 'get_queryset', _without_user_prefetch):
+            with self.assertRaises(QueryBudgetExceeded) as cm:
+                self.client.get(self.path)
+        report = cm.exception.report
+        self.assertEqual(report['view'], 'log.views.ArticleDetailView')
+        self.assertIn('duplicates', report['violations'])
+        self.assertEqual(report['path'], self.path)
+        self.assertIn('accounts_customuser', report['fingerprints'][0]['sql'])
+
+    @override_settings(LOG_QUERY_BUDGET='log')
+    def test_n_plus_one_logs(self):
+        with mock.patch.object(views.ArticleDetailView, 'get_queryset', _without_user_prefetch):
+            with self.assertLogs('log.budgets', 'WARNING') as logs:
+                response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(logs.records[0].getMessage().split(': ', 1)[1])
+        self.assertEqual(report, logs.records[0].query_budget)
+        self.assertEqual(report['event'], 'query_budget_exceeded')
+        self.assertEqual(report['method'], 'GET')
+        self.assertGreaterEqual(report['fingerprints'][0]['count'], 4)
+
+    @override_settings(LOG_QUERY_BUDGET='off')
+    def test_off(self):
+        with mock.patch.object(views.ArticleDetailView, 'get_queryset', _without_user_prefetch):
+            response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ROOT_URLCONF='log.tests.urls_async')
+    async def test_async(self):
+        """
+        非同期のビューで sync_to_async から実行されたクエリも数える
+        """
+        response = await AsyncClient().get(self.path)
+        self.assertEqual(response.status_code, 200)
+        recorder = response.asgi_request.query_recorder
+        self.assertEqual(recorder.label, 'log.async_views.ArticleDetailView')
+        self.assertEqual(recorder.budget, views.ArticleDetailView.query_budget['get'])
+        self.assertGreaterEqual(len(recorder.queries), 3)
+
+
+class TestCommentAdmin(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@bar.com', password='test')
+        article = Article.objects.create(title='test_title', body='test_body', user=cls.admin)
+        Comment.objects.bulk_create([Comment(article=article, user=cls.admin, body=f'comment{i}') for i in range(10)])
+
+    def test_changelist(self):
+        self.client.force_login(self.admin)
+        # 管理画面は件数を絞り込み後と全体で 2 回数える。コメントごとのユーザ・記事のクエリはない
+        with assert_query_budget(QueryBudget(queries=5, duplicates=1)):
+            response = self.client.get(reverse('admin:log_comment_changelist'))
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,292 @@
+"""
+cache.py とキャッシュのバージョンを更新するシグナルのテスト
+
+テストの既定ではキャッシュを使わない設定なので、ここでは locmem のキャッシュに差し替える。
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log import cache as log_cache
+from log.cache import _version_key, get_versions
+from log.counters import repair_counters
+from log.models import Article, Comment, Tag
+
+User = get_user_model()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-cache'}},
+    LOG_PAGE_CACHE_TIMEOUT=300,
+)
+class TestPageCache(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='test_name', slug='test_slug')
+        cls.other_tag = Tag.objects.create(name='other_name', slug='other_slug')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+        cls.article.tags.add(cls.tag)
+        cls.other = Article.objects.create(title='other_title', body='other_body', user=cls.user)
+        repair_counters()
+
+    def setUp(self):
+        cache.clear()
+        self.list_path = reverse('log:article_list')
+        self.tag_path = reverse('log:article_tag_list', args=[self.tag.slug])
+        self.detail_path = reverse('log:article_detail', args=[self.article.pk])
+        self.other_detail_path = reverse('log:article_detail', args=[self.other.pk])
+
+    def assertCached(self, path, expected=True):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Page-Cache'), 'hit' if expected else 'miss')
+        return response
+
+    def warm(self, *paths):
+        for path in paths:
+            self.client.get(path)
+            self.assertCached(path)
+
+    def test_anonymous_hit(self):
+        self.assertCached(self.list_path, expected=False)
+        with self.assertNumQueries(0):
+            response = self.assertCached(self.list_path)
+        self.assertContains(response, 'test_title')
+
+    def test_query_string_is_part_of_key(self):
+        self.client.get(self.list_path)
+        self.assertCached(f'{self.list_path}?order=discussed', expected=False)
+
+    def test_authenticated_not_cached(self):
+        self.client.get(self.list_path)
+        self.client.login(username='test', password='test')
+        response = self.client.get(self.list_path)
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, '新規作成')
+
+    def test_not_found_not_cached(self):
+        path = reverse('log:article_tag_list', args=['no_such_slug'])
+        self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+    @override_settings(LOG_PAGE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.client.get(self.list_path)
+        self.assertNotIn('X-Page-Cache', self.client.get(self.list_path))
+
+    def test_comment_invalidates_only_affected_pages(self):
+        self.warm(self.list_path, self.tag_path, self.detail_path, self.other_detail_path)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=self.article, user=self.user, body='new_comment')
+        self.assertContains(self.assertCached(self.detail_path, expected=False), 'new_comment')
+        self.assertCached(self.list_path, expected=False)
+        self.assertCached(self.tag_path, expected=False)
+        self.assertCached(self.other_detail_path)
+
+    def test_comment_moved(self):
+        # 管理画面でコメントの記事を変更すると、変更前の記事のページも無効になる
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.create(article=self.article, user=self.user, body='moved_comment')
+        self.warm(self.detail_path, self.other_detail_path)
+        comment.article = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.save()
+        self.assertNotContains(self.assertCached(self.detail_path, expected=False), 'moved_comment')
+        self.assertContains(self.assertCached(self.other_detail_path, expected=False), 'moved_comment')
+
+    def test_article_update(self):
+        self.warm(self.detail_path, self.other_detail_path)
+        self.article.title = 'updated_title'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.save()
+        self.assertContains(self.assertCached(self.detail_path, expected=False), 'updated_title')
+        self.assertCached(self.other_detail_path)
+
+    def test_invalidations_merged(self):
+        # 同じトランザクションの記事の保存・タグの付け替え・コメントは、コミット後にまとめて 1 回で記事のタグを読む
+        self.warm(self.tag_path, self.other_detail_path)
+        other_tag_path = reverse('log:article_tag_list', args=[self.other_tag.slug])
+        self.warm(other_tag_path)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(0):
+                log_cache.invalidate_on_commit(article_ids=[self.other.pk], feeds=False)
+            self.article.title = 'updated_title'
+            self.article.save()
+            self.article.tags.set([self.other_tag])
+        pending = [callback for callback in callbacks if isinstance(callback, log_cache._PendingInvalidation)]
+        self.assertEqual(len(pending), 1)
+        with self.assertNumQueries(3):
+            for callback in callbacks:
+                callback()
+        for path in (self.tag_path, other_tag_path, self.detail_path, self.other_detail_path):
+            with self.subTest(path=path):
+                self.assertCached(path, expected=False)
+
+    def test_rolled_back_invalidation(self):
+        # ロールバックされたセーブポイントの分は、on_commit から取り除かれると登録からも消える
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                log_cache.invalidate_on_commit(article_ids=[self.article.pk])
+                rolled_back = transaction.get_connection().savepoint_ids[-1]
+                raise ValueError
+            self.assertFalse([key for key in log_cache._pending_invalidations() if rolled_back in key])
+            log_cache.invalidate_on_commit(article_ids=[self.other.pk], feeds=False)
+        pending = [callback for callback in callbacks if isinstance(callback, log_cache._PendingInvalidation)]
+        self.assertEqual([(callback.article_ids, callback.article_ids_without_feeds) for callback in pending],
+                         [(set(), {self.other.pk})])
+        # 呼んだ後に invalidate_on_commit() を呼ぶと、新しく登録する
+        pending[0]()
+        self.assertNotIn(pending[0], log_cache._pending_invalidations().values())
+
+    def test_article_delete(self):
+        self.warm(self.list_path, self.tag_path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.delete()
+        self.assertNotContains(self.assertCached(self.tag_path, expected=False), 'test_title')
+        self.assertNotContains(self.assertCached(self.list_path, expected=False), 'test_title')
+
+    def test_tags_changed(self):
+        # タグ別一覧にはタグごとの記事数も表示するので、タグの付け外しではすべての一覧が無効になる
+        other_tag_path = reverse('log:article_tag_list', args=[self.other_tag.slug])
+        self.warm(self.tag_path, other_tag_path, self.detail_path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_tag.article_set.add(self.other)
+        self.assertContains(self.assertCached(other_tag_path, expected=False), 'other_title')
+        self.assertCached(self.tag_path, expected=False)
+        self.assertCached(self.detail_path)
+
+        self.warm(self.tag_path, self.other_detail_path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.tags.clear()
+        self.assertNotContains(self.assertCached(self.tag_path, expected=False), 'test_title')
+        self.assertCached(self.other_detail_path)
+
+    def test_tag_renamed(self):
+        self.warm(self.detail_path, self.tag_path)
+        self.tag.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        self.assertContains(self.assertCached(self.detail_path, expected=False), 'renamed')
+        self.assertCached(self.tag_path, expected=False)
+
+    def test_not_invalidated_before_commit(self):
+        self.warm(self.detail_path)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Comment.objects.create(article=self.article, user=self.user, body='new_comment')
+            self.assertCached(self.detail_path)
+        self.assertEqual(len(callbacks), 1)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-fragment'}},
+    LOG_PAGE_CACHE_TIMEOUT=0,
+)
+class TestCardFragmentCache(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_card_cached_until_article_changes(self):
+        path = reverse('log:article_list')
+        self.client.get(path)
+        # シグナルを送らずに更新した場合は、キャッシュされたカードがそのまま表示される
+        Article.objects.filter(pk=self.article.pk).update(body='silently_changed')
+        self.assertNotContains(self.client.get(path), 'silently_changed')
+
+        version = get_versions(f'article:{self.article.pk}')
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=self.article, user=self.user, body='new_comment')
+        self.assertNotEqual(get_versions(f'article:{self.article.pk}'), version)
+        self.assertContains(self.client.get(path), 'silently_changed')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-etag'}},
+    LOG_PAGE_CACHE_TIMEOUT=0,
+)
+class TestConditionalGet(TestCase):
+    """
+    ETag による条件付き GET (ページキャッシュを使わない設定でも 304 を返す)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='test_name', slug='test_slug')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+        cls.article.tags.add(cls.tag)
+        cls.other = Article.objects.create(title='other_title', body='other_body', user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.detail_path = reverse('log:article_detail', args=[self.article.pk])
+        self.paths = [reverse('log:article_list'), reverse('log:article_tag_list', args=[self.tag.slug]),
+                      self.detail_path, reverse('log:tag_list')]
+
+    def assertNotModified(self, path, etag, expected=True):
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304 if expected else 200)
+        return response
+
+    def test_not_modified(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                etag = self.client.get(path)['ETag']
+                # テンプレートの描画も DB へのアクセスもしない
+                with self.assertNumQueries(0):
+                    response = self.assertNotModified(path, etag)
+                self.assertEqual(response.templates, [])
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response.content, b'')
+
+    def test_modified(self):
+        etag = self.client.get(self.detail_path)['ETag']
+        other_etag = self.client.get(reverse('log:article_detail', args=[self.other.pk]))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=self.article, user=self.user, body='new_comment')
+        response = self.assertNotModified(self.detail_path, etag, expected=False)
+        self.assertContains(response, 'new_comment')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotModified(reverse('log:article_detail', args=[self.other.pk]), other_etag)
+
+    def test_release(self):
+        etag = self.client.get(self.detail_path)['ETag']
+        with override_settings(LOG_RELEASE='next'):
+            self.assertNotModified(self.detail_path, etag, expected=False)
+
+    def test_authenticated(self):
+        etag = self.client.get(self.detail_path)['ETag']
+        self.client.login(username='test', password='test')
+        response = self.assertNotModified(self.detail_path, etag, expected=False)
+        self.assertNotIn('ETag', response)
+
+    def test_not_found(self):
+        response = self.client.get(reverse('log:article_tag_list', args=['no_such_slug']))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_not_found_writes_no_versions(self):
+        # 存在しない記事やタグの URL では、キャッシュにバージョンを残さない
+        for path in (reverse('log:article_detail', args=[0]), reverse('log:article_tag_list', args=['no_such_slug'])):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertEqual(get_versions('article:0', 'tag:no_such_slug', create=False), {})
+
+    def test_version_timeout(self):
+        # 参照されなくなったバージョンもいずれ期限切れで消える
+        get_versions('article:0')
+        self.assertIsNotNone(cache._expire_info[cache.make_key(_version_key('article:0'))])
+
+    @override_settings(LOG_PAGE_CACHE_TIMEOUT=300)
+    def test_page_cache_hit(self):
+        etag = self.client.get(self.detail_path)['ETag']
+        response = self.client.get(self.detail_path)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertEqual(response['ETag'], etag)
@@ -0,0 +1,188 @@
+"""
+changes.py (変更フィード) と /log/api/changes のテスト
+"""
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from log import changes, transfer
+from log.models import Article, Change, Comment, Tag
+from log.seed import seed
+
+User = get_user_model()
+
+
+@override_settings(LOG_CHANGES_SETTLE_SECONDS=0)
+class ChangesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='タグ1', slug='tag1')
+
+    def feed(self, since=0, **params):
+        response = self.client.get(reverse('log:api_changes'), {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def keys(self, body):
+        return [(change['type'], change['id'], change['deleted']) for change in body['changes']]
+
+
+class TestChangeFeed(ChangesTestCase):
+    def test_create(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        article.tags.add(self.tag)
+        body = self.feed()
+        self.assertEqual(self.keys(body), [('tag', self.tag.pk, False), ('article', article.pk, False),
+                                           ('article_tags', article.pk, False)])
+        data = body['changes'][1]['data']
+        self.assertEqual(data['title'], 'タイトル1')
+        self.assertEqual(data['user'], 'alice')
+        self.assertNotIn('alice@bar.com', str(body))
+        self.assertEqual(body['changes'][2]['data'], {'article': article.pk, 'tags': [self.tag.pk]})
+        self.assertEqual(body['next'], body['changes'][-1]['cursor'])
+        self.assertFalse(body['has_more'])
+
+    def test_since(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        cursor = self.feed()['next']
+        self.assertEqual(self.feed(cursor), {'changes': [], 'next': cursor, 'has_more': False})
+
+        # 同じ対象の変更は最後の 1 件だけを返す
+        article.title = 'タイトル2'
+        article.save()
+        article.save()
+        body = self.feed(cursor)
+        self.assertEqual(self.keys(body), [('article', article.pk, False)])
+        self.assertEqual(body['changes'][0]['data']['title'], 'タイトル2')
+        self.assertEqual(body['changes'][0]['data']['version'], 3)
+
+    def test_delete(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        comment = Comment.objects.create(article=article, user=self.user, body='1')
+        other = Comment.objects.create(article=article, user=self.user, body='2')
+        article_pk, comment_pk, other_pk = article.pk, comment.pk, other.pk
+        cursor = self.feed()['next']
+        comment.delete()
+        self.assertEqual(self.keys(self.feed(cursor)), [('comment', comment_pk, True)])
+
+        # 記事ごと削除されたコメントは、記事の tombstone で表す
+        article.delete()
+        body = self.feed(cursor)
+        self.assertEqual(self.keys(body), [('comment', comment_pk, True), ('article', article_pk, True)])
+        self.assertIsNone(body['changes'][1]['data'])
+        self.assertNotIn(('comment', other_pk, False), self.keys(self.feed()))
+
+    def test_tag_links(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        article.tags.add(self.tag)
+        cursor = self.feed()['next']
+        self.tag.article_set.clear()
+        body = self.feed(cursor)
+        self.assertEqual(body['changes'][0]['data'], {'article': article.pk, 'tags': []})
+
+        article.tags.add(self.tag)
+        cursor = self.feed()['next']
+        tag_pk = self.tag.pk
+        self.tag.delete()
+        self.assertEqual(self.keys(self.feed(cursor)), [('article_tags', article.pk, False), ('tag', tag_pk, True)])
+
+    def test_import(self):
+        # bulk_create で登録するのでシグナルは送られないが、インポートでも記録する
+        records = ['{"user": "alice", "title": "t", "body": "b", "photo": null, "tags": ["new-tag"], '
+                   '"created_at": "2024-01-01T00:00:00+00:00"}']
+        cursor = self.feed()['next']
+        transfer.import_articles(records, 'jsonl')
+        article = Article.objects.get(title='t')
+        tag = Tag.objects.get(slug='new-tag')
+        self.assertEqual(self.keys(self.feed(cursor)), [('tag', tag.pk, False), ('article', article.pk, False),
+                                                        ('article_tags', article.pk, False)])
+
+    def test_seed(self):
+        # ベンチマーク用のダミーデータ (log/seed.py) も bulk_create で作るので、そこで記録する
+        cursor = self.feed()['next']
+        seed(users=2, tags=3, articles=4, comments=5, batch_size=2)
+        article_ids = set(Article.objects.values_list('pk', flat=True))
+        tagged_ids = set(Article.objects.filter(tags__isnull=False).values_list('pk', flat=True))
+        keys = self.keys(self.feed(cursor, limit=100))
+        self.assertEqual({pk for kind, pk, deleted in keys if kind == 'tag'},
+                         set(Tag.objects.exclude(pk=self.tag.pk).values_list('pk', flat=True)))
+        self.assertEqual({pk for kind, pk, deleted in keys if kind == 'article'}, article_ids)
+        self.assertEqual({pk for kind, pk, deleted in keys if kind == 'article_tags'}, tagged_ids)
+        self.assertEqual({pk for kind, pk, deleted in keys if kind == 'comment'},
+                         set(Comment.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(keys), 3 + 4 + len(tagged_ids) + 5)
+
+    def test_batches(self):
+        articles = [Article.objects.create(title=f'タイトル{i}', body='本文', user=self.user) for i in range(5)]
+        seen = []
+        cursor = 0
+        while True:
+            body = self.feed(cursor, limit=2)
+            seen += [change['id'] for change in body['changes'] if change['type'] == 'article']
+            cursor = body['next']
+            if not body['has_more']:
+                break
+        self.assertEqual(seen, [article.pk for article in articles])
+
+    def test_invalid(self):
+        # bigint に収まらない since はデータベースに渡さない (渡すと OverflowError で 500 になる)
+        for params in ({'since': 'x'}, {'since': -1}, {'limit': 0}, {'since': changes.MAX_ID + 1}, {'since': 10 ** 20}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('log:api_changes'), params)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.feed(changes.MAX_ID)['changes'], [])
+
+    @override_settings(LOG_CHANGES_SETTLE_SECONDS=60)
+    def test_settle(self):
+        # コミットされたばかりの記録は、前に振られた pk の記録がまだコミットされていないかもしれないので返さない
+        Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        self.assertEqual(self.feed(), {'changes': [], 'next': 0, 'has_more': False})
+        Change.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(len(self.feed()['changes']), 2)
+
+    @override_settings(LOG_CHANGES_SETTLE_SECONDS=60)
+    def test_late_commit(self):
+        # 先に pk を振られた記録 (まだコミットされていないかもしれない) が落ち着くまでは、後の記録も返さない
+        early = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        late = Article.objects.create(title='タイトル2', body='本文2', user=self.user)
+        Change.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        Change.objects.filter(kind=changes.ARTICLE, object_id=early.pk).update(created_at=timezone.now())
+        self.assertEqual(self.keys(self.feed()), [('tag', self.tag.pk, False)])
+
+        Change.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual([change['id'] for change in self.feed()['changes'] if change['type'] == 'article'],
+                         [early.pk, late.pk])
+
+
+class TestCompact(ChangesTestCase):
+    def test_compact(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        for _ in range(3):
+            article.save()
+        comment = Comment.objects.create(article=article, user=self.user, body='1')
+        comment.delete()
+        before = self.feed()
+
+        self.assertEqual(changes.compact(), 4)
+        self.assertEqual(Change.objects.count(), 3)
+        self.assertEqual(self.keys(self.feed()), self.keys(before))
+        self.assertEqual(changes.compact(), 0)
+
+    def test_before(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        article.save()
+        self.assertEqual(changes.compact(before=timezone.now() - timedelta(days=1)), 0)
+
+    def test_command(self):
+        article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+        article.save()
+        out = StringIO()
+        call_command('compact_changes', '--days', '0', '--batch-size', '1', stdout=out)
+        self.assertIn('1 件', out.getvalue())
+        self.assertEqual(Change.objects.filter(kind=changes.ARTICLE).count(), 1)
@@ -0,0 +1,102 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from log import tag_registry
+from log.cache import get_versions
+from log.models import Article, Comment
+
+
+class TestBenchmarkIndexes(TestCase):
+    def test_seed_and_rollback(self):
+        out = StringIO()
+        call_command('benchmark_indexes', seed=50, repeat=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('list_first_page', output)
+        self.assertIn('before ms', output)
+
+        # 投入したデータも削除したインデックスも元に戻っている
+        self.assertEqual(Article.objects.count(), 0)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Article._meta.db_table)
+        self.assertIn('log_article_created_id_idx', constraints)
+
+
+class TestBenchRequests(TestCase):
+    def test_latency_report(self):
+        out = StringIO()
+        call_command('bench_requests', '/log/', '/log/no/such/path/', requests=4, concurrency=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('vendor=sqlite', output)
+        self.assertIn('requests=4 errors=2', output)
+        self.assertIn('p99=', output)
+
+
+class TestSearchCommands(TestCase):
+    def test_benchmark_search_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_search', seed=30, repeat=1, queries=['写真'], stdout=out)
+        self.assertIn('page 50 ms', out.getvalue())
+        self.assertEqual(Article.objects.count(), 0)
+
+    def test_rebuild_search_index(self):
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('0 件', out.getvalue())
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-seed'}},
+)
+class TestSeedBenchmark(TestCase):
+    def test_invalidates_cache(self):
+        # bulk_create でシグナルが送られなくても、コミット後に一覧とタグのレジストリを無効にする
+        cache.clear()
+        names = ['list', 'feed', 'tag_registry']
+        before = get_versions(*names)
+        self.assertEqual(tag_registry.get_tags(), ())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('seed_benchmark', users=2, tags=3, articles=5, comments=5, photo_ratio=0, stdout=StringIO())
+        after = get_versions(*names)
+        for name in names:
+            with self.subTest(name=name):
+                self.assertNotEqual(after[name], before[name])
+        self.assertEqual(len(tag_registry.get_tags()), 3)
+
+
+class TestBenchmarkViews(TestCase):
+    def test_seed_and_report(self):
+        out = StringIO()
+        call_command('seed_benchmark', users=5, tags=5, articles=30, comments=60, photo_ratio=0, stdout=out)
+        self.assertIn("'articles': 30", out.getvalue())
+        self.assertEqual(Comment.objects.count(), 60)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            first = f'{workdir}/first.json'
+            out = StringIO()
+            call_command('benchmark_views', requests=2, warmup=0, output=first, stdout=out)
+            self.assertIn('comment_post', out.getvalue())
+            # 投稿したコメントはロールバックされる
+            self.assertEqual(Comment.objects.count(), 60)
+
+            with open(first, encoding='utf-8') as f:
+                report = json.load(f)
+            self.assertEqual(set(report['results']), {'article_list', 'article_tag_list', 'article_detail',
+                                                      'comment_post', 'article_search'})
+            self.assertGreater(report['results']['article_detail']['queries'], 0)
+
+            # 以前の結果よりクエリが大幅に少なかったことにして比べる
+            for result in report['results'].values():
+                result['queries'] = 1
+            with open(first, 'w', encoding='utf-8') as f:
+                json.dump(report, f)
+            out = StringIO()
+            with self.assertRaisesMessage(CommandError, 'article_detail.queries'):
+                call_command('benchmark_views', requests=1, warmup=0, anonymous=True, compare=first,
+                             fail_on_regression=True, stdout=out)
+            self.assertNotIn('comment_post', out.getvalue().split('compare with')[0])
@@ -0,0 +1,114 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from log.models import Article, Comment, SearchDocument, Tag
+
+User = get_user_model()
+
+
+class TestCommentCounters(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testuser', email='foo@bar.com', )
+
+    def setUp(self):
+        self.article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+
+    def test_create(self):
+        first = self.article.comments.create(user=self.user, body='1')
+        second = self.article.comments.create(user=self.user, body='2')
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 2)
+        self.assertEqual(self.article.last_commented_at, max(first.created_at, second.created_at))
+
+    def test_delete(self):
+        first = self.article.comments.create(user=self.user, body='1')
+        second = self.article.comments.create(user=self.user, body='2')
+        second.delete()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 1)
+        self.assertEqual(self.article.last_commented_at, first.created_at)
+
+        Comment.objects.filter(article=self.article).delete()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 0)
+        self.assertIsNone(self.article.last_commented_at)
+
+    def test_move(self):
+        # 管理画面でコメントの記事を変更すると、変更前と変更後の記事の両方を数え直す
+        other = Article.objects.create(title='タイトル2', body='本文2', user=self.user)
+        first = self.article.comments.create(user=self.user, body='紅葉')
+        second = self.article.comments.create(user=self.user, body='桜')
+        second.article = other
+        second.save()
+
+        self.article.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.article.comment_count, self.article.last_commented_at), (1, first.created_at))
+        self.assertEqual((other.comment_count, other.last_commented_at), (1, second.created_at))
+        # 全文検索の文書も両方の記事で作り直す
+        self.assertEqual(SearchDocument.objects.get(article=self.article).comments, '紅葉')
+        self.assertEqual(SearchDocument.objects.get(article=other).comments, '桜')
+
+    def test_delete_article(self):
+        self.article.comments.create(user=self.user, body='1')
+        self.article.delete()
+        self.assertEqual(Comment.objects.count(), 0)
+
+
+class TestTagCounters(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testuser', email='foo@bar.com', )
+        cls.tag1 = Tag.objects.create(name='タグ1', slug='tag1')
+        cls.tag2 = Tag.objects.create(name='タグ2', slug='tag2')
+
+    def setUp(self):
+        self.article = Article.objects.create(title='タイトル1', body='本文1', user=self.user)
+
+    def assertTagCount(self, count):
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.tag_count, count)
+
+    def test_forward(self):
+        self.article.tags.add(self.tag1, self.tag2)
+        self.assertTagCount(2)
+        self.article.tags.remove(self.tag1)
+        self.assertTagCount(1)
+        self.article.tags.clear()
+        self.assertTagCount(0)
+
+    def test_reverse(self):
+        self.tag1.article_set.add(self.article)
+        self.assertTagCount(1)
+        self.tag1.article_set.clear()
+        self.assertTagCount(0)
+
+    def test_delete_tag(self):
+        self.article.tags.add(self.tag1, self.tag2)
+        self.tag1.delete()
+        self.assertTagCount(1)
+
+
+class TestRepairArticleCounters(TestCase):
+    def test_repair(self):
+        user = User.objects.create(username='testuser', email='foo@bar.com', )
+        article = Article.objects.create(title='タイトル1', body='本文1', user=user)
+        untouched = Article.objects.create(title='タイトル2', body='本文2', user=user)
+        comment = article.comments.create(user=user, body='1')
+        article.tags.add(Tag.objects.create(name='タグ1', slug='tag1'))
+        Article.objects.filter(pk=article.pk).update(comment_count=10, tag_count=0, last_commented_at=None)
+
+        out = StringIO()
+        call_command('repair_article_counters', stdout=out)
+        self.assertIn('1 件の記事', out.getvalue())
+
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 1)
+        self.assertEqual(article.tag_count, 1)
+        self.assertEqual(article.last_commented_at, comment.created_at)
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.comment_count, 0)
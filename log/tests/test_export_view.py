@@ -0,0 +1,94 @@
+"""
+ArticleExportView (日記のダウンロード) のテスト
+"""
+import csv
+import json
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log.models import Article, Comment, Tag
+from log.views import ArticleExportView
+
+User = get_user_model()
+
+
+class TestArticleExportView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='foo@bar.com', password='test')
+        cls.other = User.objects.create_user(username='bob', email='bob@bar.com', password='test')
+        tag = Tag.objects.create(name='京都', slug='kyoto')
+        for i in range(5):
+            article = Article.objects.create(title=f'記事{i}', body=f'本文{i}', user=cls.user)
+            article.tags.add(tag)
+        Comment.objects.create(article=article, body='コメント', user=cls.other)
+        Article.objects.create(title='他人の記事', body='本文', user=cls.other)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('log:article_export')
+
+    def test_jsonl(self):
+        # 記事 2 件ずつ: (記事・タグ・コメント) x 3 回 + 空のバッチ 1 回 + セッション・ユーザ
+        with mock.patch.object(ArticleExportView, 'batch_size', 2), self.assertNumQueries(12):
+            response = self.client.get(self.url)
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertIn('attachment; filename="diary.jsonl"', response['Content-Disposition'])
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([record['title'] for record in records], [f'記事{i}' for i in range(5)])
+        self.assertEqual(records[4]['tags'], ['kyoto'])
+        self.assertEqual(records[4]['comments'][0]['user'], 'bob')
+        self.assertEqual(records[0]['comments'], [])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(json.loads(rows[4]['comments'])[0]['body'], 'コメント')
+
+    def test_zip(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            article = Article.objects.filter(user=self.user).first()
+            article.photo.save('photo.jpg', ContentFile(b'jpeg' * 100000))
+            response = self.client.get(self.url, {'format': 'zip'})
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['articles.jsonl', f'photos/{article.photo.name}'])
+            self.assertEqual(archive.read(f'photos/{article.photo.name}'), b'jpeg' * 100000)
+            self.assertEqual(len(archive.read('articles.jsonl').splitlines()), 5)
+
+    def test_zip_round_trip(self):
+        # ダウンロードの zip は、取り出した articles.jsonl と zip そのものを import_articles に渡して登録できる
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            article = Article.objects.filter(user=self.user).first()
+            article.photo.save('photo.jpg', ContentFile(b'jpeg'))
+            response = self.client.get(self.url, {'format': 'zip'})
+            path = Path(media) / 'diary.zip'
+            path.write_bytes(b''.join(response.streaming_content))
+            with zipfile.ZipFile(path) as archive:
+                archive.extract('articles.jsonl', media)
+
+            call_command('import_articles', str(Path(media) / 'articles.jsonl'), photos=str(path), stdout=StringIO())
+            imported = Article.objects.filter(title=article.title).latest('pk')
+            self.assertNotEqual(imported.pk, article.pk)
+            self.assertNotEqual(imported.photo.name, article.photo.name)
+            self.assertEqual(imported.photo.read(), b'jpeg')
+            imported.photo.close()
+        self.assertEqual(list(imported.tags.values_list('slug', flat=True)), ['kyoto'])
+        self.assertEqual(Article.objects.filter(user=self.user).count(), 10)
+
+    def test_login_required_and_format(self):
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 404)
+        self.client.logout()
+        self.assertRedirects(self.client.get(self.url), reverse('account_login'), fetch_redirect_response=False)
@@ -0,0 +1,132 @@
+"""
+feeds.py (Atom / RSS フィード) とフィードのビューのテスト
+
+キャッシュと ETag を確かめるため、locmem のキャッシュに差し替える。
+"""
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log.models import Article, Comment, Tag
+
+User = get_user_model()
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-feed'}},
+    LOG_PAGE_CACHE_TIMEOUT=300,
+)
+class TestFeed(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='タグ1', slug='tag1')
+        cls.other_tag = Tag.objects.create(name='タグ2', slug='tag2')
+        cls.article = Article.objects.create(title='タイトル1', body='本文1', user=cls.user)
+        cls.article.tags.add(cls.tag)
+        cls.other = Article.objects.create(title='タイトル2', body='本文2', user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.path = reverse('log:article_feed', args=['atom'])
+        self.tag_path = reverse('log:article_tag_feed', args=[self.tag.slug, 'atom'])
+
+    def entries(self, response):
+        root = ElementTree.fromstring(response.content)
+        return [(entry.findtext(f'{ATOM}title'), [category.get('term') for category in entry.findall(f'{ATOM}category')])
+                for entry in root.findall(f'{ATOM}entry')]
+
+    def assertNotModified(self, path, etag, expected=True):
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304 if expected else 200)
+        return response
+
+    def test_atom(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertEqual(self.entries(response), [('タイトル2', []), ('タイトル1', ['タグ1'])])
+        self.assertContains(response, f'http://testserver/log/{self.article.pk}/')
+        self.assertNotContains(response, 'alice@bar.com')
+
+    def test_rss(self):
+        response = self.client.get(reverse('log:article_feed', args=['rss']))
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        root = ElementTree.fromstring(response.content)
+        self.assertEqual([item.findtext('title') for item in root.iter('item')], ['タイトル2', 'タイトル1'])
+
+    def test_tag(self):
+        response = self.client.get(self.tag_path)
+        self.assertEqual(self.entries(response), [('タイトル1', ['タグ1'])])
+        self.assertContains(response, '日記リスト - タグ1')
+        for path in (reverse('log:article_tag_feed', args=['missing', 'atom']),
+                     reverse('log:article_feed', args=['json'])):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_not_modified(self):
+        for path in (self.path, self.tag_path):
+            with self.subTest(path=path):
+                etag = self.client.get(path)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.assertNotModified(path, etag)
+                self.assertEqual(response['ETag'], etag)
+                with self.assertNumQueries(0):
+                    response = self.client.get(path)
+                self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_authenticated(self):
+        # フィードはユーザによらず同じなので、ログインしていても同じ ETag とキャッシュを使う
+        etag = self.client.get(self.path)['ETag']
+        self.client.login(username='alice', password='test')
+        self.assertNotModified(self.path, etag)
+
+    def test_comment_keeps_feed(self):
+        etags = {path: self.client.get(path)['ETag'] for path in (self.path, self.tag_path)}
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=self.article, user=self.user, body='コメント')
+        for path, etag in etags.items():
+            with self.subTest(path=path):
+                self.assertNotModified(path, etag)
+
+    def test_article_changed(self):
+        etags = {path: self.client.get(path)['ETag'] for path in (self.path, self.tag_path)}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.title = 'タイトル1 (更新)'
+            self.article.save()
+        for path, etag in etags.items():
+            with self.subTest(path=path):
+                response = self.assertNotModified(path, etag, expected=False)
+                self.assertEqual(response['X-Page-Cache'], 'miss')
+                self.assertContains(response, 'タイトル1 (更新)')
+
+    def test_other_tag_unchanged(self):
+        # 他のタグの記事の変更では、タグ別のフィードは変わらない
+        etag = self.client.get(self.tag_path)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.tags.add(self.other_tag)
+            Article.objects.create(title='タイトル3', body='本文3', user=self.user)
+        self.assertNotModified(self.tag_path, etag)
+        self.assertNotModified(self.path, self.client.get(self.path)['ETag'])
+
+    def test_tags_changed(self):
+        etag = self.client.get(self.tag_path)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.tags.add(self.tag)
+        response = self.assertNotModified(self.tag_path, etag, expected=False)
+        self.assertEqual(len(self.entries(response)), 2)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'タグ1 (改名)'
+            self.tag.save()
+        self.assertContains(self.assertNotModified(self.tag_path, etag, expected=False), 'タグ1 (改名)')
+
+    def test_autodiscovery(self):
+        self.assertContains(self.client.get(reverse('log:article_list')), f'href="{self.path}"')
+        self.assertContains(self.client.get(reverse('log:article_tag_list', args=[self.tag.slug])),
+                            f'href="{self.tag_path}"')
@@ -1,5 +1,95 @@
 """
-forms.py にあるフォームは Django 標準のモデルフォームをそのまま使っていてカスタマイズが一切ない。
-あまりにも自明なのでテストは省略する。
-(メソッド等を実装している場合はテストを書いたほうが良い)
+forms.py のテスト
+
+ArticleForm は写真の正規化(clean_photo)だけをカスタマイズしているので、そこをテストする。
+それ以外は Django 標準のモデルフォームをそのまま使っていて自明なのでテストは省略する。
 """
+from io import BytesIO
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image, ImageCms
+
+from log.forms import ArticleForm
+
+
+def make_jpeg(size, orientation=None, quality=95):
+    image = Image.new('RGB', size, (200, 100, 50))
+    # 左上だけ色を変えて、向きの補正を確認できるようにする
+    image.paste((0, 0, 255), (0, 0, size[0] // 4, size[1] // 4))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif, quality=quality)
+    return SimpleUploadedFile('photo.jpeg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(LOG_PHOTO_NORMALIZE=True, LOG_PHOTO_MAX_DIMENSION=400, LOG_PHOTO_QUALITY=80)
+class TestArticleFormPhoto(TestCase):
+    def clean_photo(self, photo):
+        form = ArticleForm(data={'title': 'test_title', 'body': 'test_body'}, files={'photo': photo})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.cleaned_data['photo']
+
+    def test_resize_and_orientation(self):
+        # Orientation=6 は 90 度回転。縦横を入れ替えたうえで長辺 400px に縮小される
+        with self.assertLogs('log.imaging', 'INFO') as logs:
+            photo = self.clean_photo(make_jpeg((1000, 600), orientation=6))
+        self.assertIn('1000x600 -> 240x400', logs.output[0])
+        self.assertEqual(photo.name, 'photo.jpg')
+        self.assertEqual(photo.content_type, 'image/jpeg')
+        image = Image.open(photo)
+        self.assertEqual(image.size, (240, 400))
+        self.assertEqual(dict(image.getexif()), {})
+        # 元画像の左上(青)は、右に 90 度回転すると右上にくる
+        r, g, b = image.getpixel((image.width - 5, 5))
+        self.assertGreater(b, r)
+
+    def test_small_photo_reencoded(self):
+        original = make_jpeg((300, 200), quality=100)
+        size = original.size
+        photo = self.clean_photo(original)
+        self.assertLess(photo.size, size)
+        self.assertEqual(Image.open(photo).size, (300, 200))
+
+    def test_png_kept(self):
+        """
+        変換の必要がない可逆形式の画像はそのまま保存する
+        """
+        path = Path(__file__).resolve().parent / 'test_img.png'
+        with open(path, 'rb') as f:
+            original = SimpleUploadedFile('test_img.png', f.read(), content_type='image/png')
+        photo = self.clean_photo(original)
+        self.assertIs(photo, original)
+
+    @override_settings(LOG_PHOTO_NORMALIZE=False)
+    def test_disabled(self):
+        original = make_jpeg((1000, 600), orientation=6)
+        form = ArticleForm(data={'title': 'test_title', 'body': 'test_body'}, files={'photo': original})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIs(form.cleaned_data['photo'], original)
+
+    def test_truncated(self):
+        # ヘッダだけの検証は通るが、デコードすると途中で切れている
+        content = make_jpeg((1000, 600)).read()
+        photo = SimpleUploadedFile('photo.jpeg', content[:len(content) // 2], content_type='image/jpeg')
+        form = ArticleForm(data={'title': 'test_title', 'body': 'test_body'}, files={'photo': photo})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()['photo'][0].code, 'invalid_image')
+
+    def test_icc_profile(self):
+        srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), (200, 100, 50)).save(buffer, 'JPEG', icc_profile=srgb)
+        photo = self.clean_photo(SimpleUploadedFile('photo.jpeg', buffer.getvalue(), content_type='image/jpeg'))
+        self.assertEqual(Image.open(photo).info.get('icc_profile'), srgb)
+
+        # RGB に変換した CMYK の画像には、元の (CMYK の) プロファイルを付けない
+        buffer = BytesIO()
+        Image.new('CMYK', (300, 200), (0, 50, 100, 0)).save(buffer, 'JPEG', icc_profile=b'cmyk-profile')
+        image = Image.open(self.clean_photo(SimpleUploadedFile('cmyk.jpeg', buffer.getvalue(),
+                                                                content_type='image/jpeg')))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertNotIn('icc_profile', image.info)
@@ -0,0 +1,194 @@
+import shutil
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.shortcuts import resolve_url
+from django.template import Context, Template
+from django.test import TestCase
+from PIL import Image
+
+from log.imaging import (MAX_ATTEMPTS, claim_jobs, enqueue_image_job, generate_variants, process_image_job,
+                         variant_name, variant_widths)
+from log.models import Article, Change, ImageJob
+
+User = get_user_model()
+
+
+def make_photo():
+    path = Path(__file__).resolve().parent / 'test_img.png'
+    with open(path, 'rb') as f:
+        return SimpleUploadedFile('test_img.png', f.read(), content_type='image/png')
+
+
+def make_jpeg(size, orientation=None):
+    """
+    指定した大きさの JPEG を作る。orientation を指定すると EXIF の Orientation を付ける
+    """
+    image = Image.new('RGB', size, (200, 100, 50))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class TestImageJobs(TestCase):
+    """
+    写真の投稿でジョブが登録され、ワーカーがサムネイルを生成することを確認する
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # テストでアップロードされた画像が保存されるディレクトリを変更
+        Article.photo.field.storage.location = 'media_test_dir'
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+
+    def test_create_and_process(self):
+        self.client.force_login(self.user)
+        self.client.post(resolve_url('log:article_create'),
+                         data={'title': 'test_title', 'body': 'test_body', 'photo': make_photo()})
+        article = Article.objects.get()
+        self.assertFalse(article.thumbnail_ready)
+        self.assertEqual(ImageJob.objects.get().photo, article.photo.name)
+
+        # 生成前はプレースホルダを表示し、サムネイルは生成しない
+        response = self.client.get(resolve_url('log:article_list'))
+        self.assertContains(response, '準備中')
+        self.assertFalse(article.thumbnail.storage.exists(article.thumbnail.name))
+
+        out = StringIO()
+        version = article.version
+        call_command('process_image_jobs', once=True, stdout=out)
+        self.assertIn('1 件', out.getvalue())
+
+        article.refresh_from_db()
+        self.assertTrue(article.thumbnail_ready)
+        self.assertTrue(article.variants_ready)
+        # 写真の大きさは API でも返すので、記事の変更として版を上げ、変更フィードに記録する
+        self.assertEqual(article.version, version + 1)
+        self.assertIsNotNone(article.photo_width)
+        last = Change.objects.order_by('pk').last()
+        self.assertEqual((last.kind, last.object_id), ('article', article.pk))
+        self.assertTrue(article.thumbnail.storage.exists(article.thumbnail.name))
+        self.assertFalse(ImageJob.objects.exists())
+
+        response = self.client.get(resolve_url('log:article_list'))
+        self.assertContains(response, article.thumbnail.url)
+
+    def test_update_without_photo_change(self):
+        article = Article.objects.create(title='test_title', body='test_body', user=self.user, photo=make_photo(),
+                                         thumbnail_ready=True)
+        self.client.force_login(self.user)
+        self.client.post(resolve_url('log:article_update', pk=article.pk),
+                         data={'title': 'new_title', 'body': 'test_body'})
+        article.refresh_from_db()
+        self.assertTrue(article.thumbnail_ready)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_photo_replaced_while_queued(self):
+        article = Article.objects.create(title='test_title', body='test_body', user=self.user, photo=make_photo())
+        job = enqueue_image_job(article)
+        article.photo = make_photo()
+        article.save()
+        enqueue_image_job(article)
+
+        # 古い写真のジョブは何もせずに終わる
+        self.assertFalse(process_image_job(job))
+        self.assertEqual(ImageJob.objects.get().photo, article.photo.name)
+
+    def test_failure_is_retried_later(self):
+        article = Article.objects.create(title='test_title', body='test_body', user=self.user, photo=make_photo())
+        enqueue_image_job(article)
+        with mock.patch('log.imaging.generate_images', side_effect=OSError('broken')):
+            with self.assertLogs('log.imaging', 'ERROR'):
+                self.assertFalse(process_image_job(claim_jobs(1)[0]))
+
+        job = ImageJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, 'broken')
+        # 再試行の時刻までは取り出されない
+        self.assertEqual(claim_jobs(1), [])
+
+        ImageJob.objects.update(attempts=MAX_ATTEMPTS, available_at=job.created_at)
+        self.assertEqual(claim_jobs(1), [])
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        media_test_dir 以下のファイルをディレクトリごと削除
+        """
+        shutil.rmtree('media_test_dir')
+        super().tearDownClass()
+
+
+class TestPhotoVariants(TestCase):
+    """
+    srcset 用の縮小版の生成とテンプレートタグのテスト
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Article.photo.field.storage.location = 'media_test_dir'
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+
+    def test_variant_widths(self):
+        self.assertEqual(variant_widths(None), [])
+        self.assertEqual(variant_widths(100), [100])
+        self.assertEqual(variant_widths(640), [320, 640])
+        self.assertEqual(variant_widths(1000), [320, 640, 1000])
+        self.assertEqual(variant_widths(4000), [320, 640, 1280, 2048])
+
+    def test_generate(self):
+        # Orientation=6 (90 度回転) なので、縦長の写真として扱われる
+        article = Article.objects.create(title='test_title', body='test_body', user=self.user,
+                                         photo=make_jpeg((700, 400), orientation=6))
+        width, height = generate_variants(article.photo.name)
+        self.assertEqual((width, height), (400, 700))
+
+        storage = article.photo.storage
+        for extension in ('webp', 'jpg'):
+            for target in (320, 400):
+                with storage.open(variant_name(article.photo.name, target, extension)) as f:
+                    self.assertEqual(Image.open(f).width, target)
+        self.assertFalse(storage.exists(variant_name(article.photo.name, 640, 'jpg')))
+
+    def test_template_tag(self):
+        article = Article.objects.create(title='test_title', body='test_body', user=self.user,
+                                         photo=make_jpeg((700, 400)))
+        template = Template('{% load log_images %}{% responsive_photo article css_class="card-img-top" %}')
+
+        html = template.render(Context({'article': article}))
+        self.assertEqual(html, f'<img src="{article.photo.url}" class="card-img-top" alt="test_title">')
+
+        enqueue_image_job(article)
+        process_image_job(claim_jobs(1)[0])
+        article.refresh_from_db()
+        html = template.render(Context({'article': article}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn(f'{article.photo.storage.url(variant_name(article.photo.name, 320, "webp"))} 320w', html)
+        self.assertIn(f'{article.photo.storage.url(variant_name(article.photo.name, 700, "jpg"))} 700w', html)
+        self.assertIn('width="700" height="400"', html)
+
+    def test_backfill_command(self):
+        for i in range(3):
+            Article.objects.create(title=f'test_title{i}', body='test_body', user=self.user,
+                                   photo=make_jpeg((500, 300)))
+        Article.objects.create(title='no_photo', body='test_body', user=self.user)
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                Article.objects.update(variants_ready=False, photo_width=None)
+                out = StringIO()
+                call_command('generate_photo_variants', workers=workers, stdout=out)
+                self.assertIn('3 件', out.getvalue())
+                self.assertEqual(Article.objects.filter(variants_ready=True, photo_width=500).count(), 3)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('media_test_dir')
+        super().tearDownClass()
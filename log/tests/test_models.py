@@ -1,11 +1,14 @@
 import shutil
+from datetime import timedelta
 from pathlib import Path
 
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
 
-from log.models import Tag, Article
+from log.models import Tag, Article, Comment
 
 User = get_user_model()
 
@@ -55,3 +58,75 @@ class TestComment(TestCase):
         article = Article.objects.create(user=user, title='タイトル1', body='本文1')
         comment = article.comments.create(user=user, article=article, body='123456789012345678901234567890')
         self.assertEqual(str(comment), 'Comment to タイトル1 : 12345678901234567890')
+
+
+class TestTracked(TestCase):
+    """
+    updated_at と version (TrackedModel) のテスト
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='タグ1', slug='tag1')
+
+    def setUp(self):
+        self.past = timezone.now() - timedelta(days=1)
+        self.article = Article.objects.create(title='タイトル1', body='本文1', user=self.user, created_at=self.past,
+                                              updated_at=self.past)
+
+    def assertTouched(self, obj, version):
+        obj.refresh_from_db()
+        self.assertGreater(obj.updated_at, self.past)
+        self.assertEqual(obj.version, version)
+
+    def test_create_keeps_updated_at(self):
+        self.assertEqual(self.article.updated_at, self.past)
+        self.assertEqual(self.article.version, 1)
+
+    def test_save(self):
+        self.article.title = 'タイトル2'
+        self.article.save()
+        self.assertTouched(self.article, 2)
+        self.article.save(update_fields=['title'])
+        self.assertTouched(self.article, 3)
+
+    def test_concurrent_save(self):
+        # 古いインスタンスから保存しても version は戻らない
+        stale = Article.objects.get(pk=self.article.pk)
+        self.article.save()
+        stale.save()
+        self.assertTouched(stale, 3)
+
+    def test_tags(self):
+        self.article.tags.add(self.tag)
+        self.assertTouched(self.article, 2)
+        self.tag.article_set.remove(self.article)
+        self.assertTouched(self.article, 3)
+        self.article.tags.add(self.tag)
+        self.tag.delete()
+        self.assertTouched(self.article, 5)
+
+    def test_touch(self):
+        Article.objects.filter(pk=self.article.pk).touch(title='タイトル2')
+        self.assertTouched(self.article, 2)
+        self.assertEqual(self.article.title, 'タイトル2')
+
+    def test_comment(self):
+        comment = Comment.objects.create(article=self.article, user=self.user, body='1', created_at=self.past,
+                                         updated_at=self.past)
+        comment.body = '2'
+        comment.save()
+        self.assertTouched(comment, 2)
+        # コメントの投稿は記事の変更ではない
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.updated_at, self.past)
+
+    def test_update_view(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('log:article_update', args=[self.article.pk]),
+                                    {'title': 'タイトル2', 'body': '本文2', 'tags': [self.tag.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.article.refresh_from_db()
+        self.assertGreater(self.article.updated_at, self.past)
+        self.assertGreater(self.article.version, 1)
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from log.models import MAX_ID, Article
+from log.pagination import CursorPaginator, InvalidCursor, decode_cursor, encode_cursor, NEXT
+
+User = get_user_model()
+
+
+class TestCursor(TestCase):
+    def test_round_trip(self):
+        user = User.objects.create(username='testuser', email='foo@bar.com', )
+        article = Article.objects.create(title='タイトル1', body='本文1', user=user)
+        created_at, pk, direction = decode_cursor(encode_cursor(article, NEXT))
+        self.assertEqual(created_at, article.created_at)
+        self.assertEqual(pk, article.pk)
+        self.assertEqual(direction, NEXT)
+
+    def test_invalid(self):
+        # 空文字 / base64 でない / 要素数が違う / 日時でない
+        for token in ['', 'xxx!', 'W10', 'WyJ4IiwxLCJuIl0']:
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(token)
+
+    def test_out_of_range(self):
+        # bool / bigint の範囲外の id / タイムゾーンのない日時
+        now = timezone.now()
+        for created_at, pk in [(now, True), (now, 0), (now, MAX_ID + 1), (datetime(2024, 1, 1), 1)]:
+            with self.subTest(created_at=created_at, pk=pk):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(encode_cursor({'created_at': created_at, 'id': pk}, NEXT))
+        self.assertEqual(decode_cursor(encode_cursor({'created_at': now, 'id': MAX_ID}, NEXT))[1], MAX_ID)
+
+
+class TestCursorPaginator(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testuser', email='foo@bar.com', )
+        now = timezone.now()
+        # created_at が重複する行も含めて 7 件作る
+        cls.articles = [
+            Article.objects.create(title=f'タイトル{i}', body='本文', user=cls.user,
+                                   created_at=now - timedelta(minutes=i // 2))
+            for i in range(7)
+        ]
+        cls.expected = list(Article.objects.order_by('-created_at', '-id'))
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Article.objects.all(), 3)
+
+        first = paginator.page()
+        self.assertEqual(first.object_list, self.expected[:3])
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(second.object_list, self.expected[3:6])
+        self.assertTrue(second.has_previous())
+
+        last = paginator.page(second.next_cursor)
+        self.assertEqual(last.object_list, self.expected[6:])
+        self.assertFalse(last.has_next())
+
+        back = paginator.page(last.previous_cursor)
+        self.assertEqual(back.object_list, self.expected[3:6])
+
+        back = paginator.page(back.previous_cursor)
+        self.assertEqual(back.object_list, self.expected[:3])
+        self.assertFalse(back.has_previous())
+
+    def test_no_count_query(self):
+        paginator = CursorPaginator(Article.objects.all(), 3)
+        with self.assertNumQueries(1):
+            page = paginator.page()
+            len(page)
@@ -0,0 +1,150 @@
+"""
+search.py (全文検索) のテスト
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from log import search
+from log.models import Article, Comment, SearchDocument
+from log.views import ArticleSearchView
+
+User = get_user_model()
+
+
+class TestTokenize(TestCase):
+    def test_index_text(self):
+        self.assertEqual(search.index_text('京都の桜'), '京都 都の の桜')
+        # 英数字は単語のまま、全角は NFKC で半角・小文字にする
+        self.assertEqual(search.index_text('Ｄｊａｎｇｏ 4.2で写真'), 'django 4 2 で写 写真')
+
+    def test_query_terms(self):
+        self.assertEqual(search.query_terms('京都 桜'), [('京都', False), ('桜', True)])
+        self.assertEqual(search.query_terms('写真写真'), [('写真', False), ('真写', False)])
+        self.assertEqual(search.query_terms(' !? '), [])
+
+
+class TestSearch(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.in_title = Article.objects.create(title='京都の紅葉', body='きれいでした', user=cls.user)
+        cls.in_body = Article.objects.create(title='散歩', body='京都の紅葉を見に行きました', user=cls.user)
+        cls.in_comment = Article.objects.create(title='写真', body='カメラ', user=cls.user)
+        Comment.objects.create(article=cls.in_comment, body='京都の紅葉ですね', user=cls.user)
+        cls.other = Article.objects.create(title='東京', body='紅茶', user=cls.user)
+
+    def test_documents_follow_signals(self):
+        document = SearchDocument.objects.get(article=self.in_comment)
+        self.assertEqual(document.comments, '京都 都の の紅 紅葉 葉で です すね')
+
+        self.in_comment.comments.all().delete()
+        self.assertEqual(search.search('紅葉'), [self.in_title.pk, self.in_body.pk])
+
+    def test_ranked_by_column_weight(self):
+        # タイトル > 本文 > コメント の順
+        self.assertEqual(search.search('京都 紅葉'), [self.in_title.pk, self.in_body.pk, self.in_comment.pk])
+        self.assertEqual(search.search('京都 紅葉', offset=1, limit=1), [self.in_body.pk])
+
+    @override_settings(LOG_SEARCH_RANK_WINDOW=2)
+    def test_rank_window(self):
+        # 一致した記事のうち新しい 2 件だけを関連度順に並べる
+        self.assertEqual(search.search('京都 紅葉'), [self.in_body.pk, self.in_comment.pk])
+
+    def test_single_character_prefix(self):
+        self.assertEqual(set(search.search('紅')), {self.in_title.pk, self.in_body.pk, self.in_comment.pk,
+                                                     self.other.pk})
+        self.assertEqual(search.search('茶'), [])
+
+    def test_no_match(self):
+        self.assertEqual(search.search('大阪'), [])
+        self.assertEqual(search.search('!!'), [])
+
+    def test_comment_appended(self):
+        # コメントの追加では記事のコメントを読み直さず、作り直したものと同じ文書になる
+        with CaptureQueriesContext(connection) as queries:
+            Comment.objects.create(article=self.in_comment, body='紅茶も', user=self.user)
+        self.assertFalse([query for query in queries if '"log_comment"."body"' in query['sql']])
+        document = SearchDocument.objects.get(article=self.in_comment)
+        self.assertEqual(document.comments, '京都 都の の紅 紅葉 葉で です すね 紅茶 茶も')
+        self.assertEqual(search.search('茶'), [self.in_comment.pk])
+        search.rebuild()
+        self.assertEqual(SearchDocument.objects.get(article=self.in_comment).comments, document.comments)
+
+        # 本文を変えない保存では作り直さない。編集では作り直す
+        comment = self.in_comment.comments.latest('pk')
+        with CaptureQueriesContext(connection) as queries:
+            comment.save()
+        self.assertFalse([query for query in queries if '"log_comment"."body"' in query['sql']
+                          and 'SELECT "log_comment"."article_id", "log_comment"."body" FROM' not in query['sql']])
+        comment.body = '緑茶'
+        comment.save()
+        self.assertEqual(search.search('紅茶'), [self.other.pk])
+        self.assertEqual(search.search('緑茶'), [self.in_comment.pk])
+
+    def test_update_and_delete(self):
+        self.other.title = '京都の紅葉'
+        self.other.save()
+        self.assertIn(self.other.pk, search.search('京都'))
+
+        self.in_title.delete()
+        self.assertNotIn(self.in_title.pk, search.search('京都'))
+        self.assertFalse(SearchDocument.objects.filter(article_id=self.in_title.pk).exists())
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(search.search('京都'), [])
+        self.assertEqual(search.rebuild(batch_size=2), 4)
+        search.optimize()
+        self.assertEqual(len(search.search('京都')), 3)
+
+    def test_filter_articles(self):
+        queryset = search.filter_articles(Article.objects.all(), '紅葉 見に')
+        self.assertEqual(list(queryset), [self.in_body])
+
+
+class TestArticleSearchView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        Article.objects.bulk_create([Article(title=f'記事{i} 北海道', body='本文', user=cls.user) for i in range(12)])
+        search.rebuild()
+
+    def test_paginate_without_count(self):
+        url = reverse('log:article_search')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'q': '北海道'})
+        self.assertEqual(len(response.context['articles']), 10)
+        self.assertTrue(response.context['has_next'])
+        self.assertContains(response, 'page=2')
+
+        response = self.client.get(url, {'q': '北海道', 'page': 2})
+        self.assertEqual(len(response.context['articles']), 2)
+        self.assertFalse(response.context['has_next'])
+        self.assertTrue(response.context['has_previous'])
+
+    def test_empty_and_invalid(self):
+        url = reverse('log:article_search')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['articles'], [])
+        self.assertContains(self.client.get(url, {'q': '沖縄'}), '一致する記事はありません')
+        self.assertEqual(self.client.get(url, {'q': '北海道', 'page': 'x'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'q': '北海道', 'page': 0}).status_code, 404)
+
+    def test_page_number_clamped(self):
+        # データベースの整数の範囲を超えるページ番号でも 500 にしない
+        response = self.client.get(reverse('log:article_search'), {'q': '北海道', 'page': '9' * 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_number'], ArticleSearchView.max_page_number)
+        self.assertEqual(response.context['articles'], [])
+
+    def test_admin_search(self):
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(reverse('admin:log_article_changelist'), {'q': '記事1'})
+        self.assertEqual(response.status_code, 200)
+        # 「記事1」は「記事10」「記事11」にも前方一致しない (bi-gram の「事1」と単語の「1」に分かれる)
+        self.assertEqual(response.context['cl'].result_count, 1)
@@ -0,0 +1,155 @@
+"""
+slowlog.py (遅いクエリ・遅いリクエストの記録) のテスト
+"""
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log import slowlog
+from log.models import Article
+
+User = get_user_model()
+
+
+class SlowLogTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(slowlog.writer.close)
+        self.directory = directory.name
+        overridden = override_settings(LOG_SLOW_QUERY_DIR=self.directory, LOG_SLOW_QUERY_MS=0,
+                                       LOG_SLOW_REQUEST_MS=0, LOG_SLOW_QUERY_SAMPLE_RATE=1.0,
+                                       LOG_SLOW_QUERY_MAX_PER_SECOND=1000)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def entries(self, type):
+        return [entry for entry in slowlog.read_entries(self.directory) if entry['type'] == type]
+
+
+class TestSlowQuery(SlowLogTestCase):
+    def test_query(self):
+        list(Article.objects.filter(title='secret'))
+        entry = self.entries('query')[-1]
+        self.assertIn('"log_article"', entry['fingerprint'])
+        self.assertIn('= ?', entry['fingerprint'])
+        # パラメータは記録しない
+        self.assertNotIn('secret', json.dumps(entry))
+        self.assertIsNone(entry['view'])
+        self.assertEqual(entry['database'], 'default')
+        self.assertTrue(entry['stack'][-1].startswith('log/tests/test_slowlog.py:'))
+
+    def test_view(self):
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        views = {entry['view'] for entry in self.entries('query')}
+        self.assertEqual(views, {'log:article_detail'})
+
+    @override_settings(LOG_SLOW_QUERY_MS=10 ** 6)
+    def test_threshold(self):
+        list(Article.objects.all())
+        self.assertEqual(self.entries('query'), [])
+
+    @override_settings(LOG_SLOW_QUERY_DIR='')
+    def test_disabled(self):
+        list(Article.objects.all())
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        self.assertEqual(list(Path(self.directory).iterdir()), [])
+
+    @override_settings(LOG_SLOW_QUERY_MAX_PER_SECOND=2)
+    def test_max_per_second(self):
+        dropped = slowlog.writer.dropped
+        for _ in range(5):
+            list(Article.objects.all())
+        # 1 秒の境目をまたぐと 4 件になりうる
+        self.assertLessEqual(len(self.entries('query')), 4)
+        self.assertGreater(slowlog.writer.dropped, dropped)
+
+    @override_settings(LOG_SLOW_QUERY_SAMPLE_RATE=0)
+    def test_sample_rate(self):
+        list(Article.objects.all())
+        self.assertEqual(self.entries('query'), [])
+
+
+class TestSlowRequest(SlowLogTestCase):
+    def test_request(self):
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]), {'q': 'secret'})
+        entry, = self.entries('request')
+        self.assertEqual(entry['view'], 'log:article_detail')
+        self.assertEqual(entry['method'], 'GET')
+        self.assertEqual(entry['path'], reverse('log:article_detail', args=[self.article.pk]))
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['queries'], len(self.entries('query')))
+
+    @override_settings(LOG_SLOW_REQUEST_MS=10 ** 6)
+    def test_threshold(self):
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        self.assertEqual(self.entries('request'), [])
+
+    def test_shared_recorder(self):
+        # クエリ数は QueryBudgetMiddleware の記録をそのまま使う
+        response = self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        recorder = response.wsgi_request.query_recorder
+        entry, = self.entries('request')
+        self.assertEqual(entry['queries'], len(recorder.queries))
+        self.assertEqual(recorder.view_name, 'log:article_detail')
+
+    @override_settings(LOG_QUERY_BUDGET='off')
+    def test_budget_off(self):
+        # QueryBudgetMiddleware を使わないときは自分で記録する
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        entry, = self.entries('request')
+        self.assertGreater(entry['queries'], 0)
+        self.assertEqual({entry['view'] for entry in self.entries('query')}, {'log:article_detail'})
+
+
+class TestAggregate(TestCase):
+    def test_order(self):
+        entries = [
+            {'type': 'query', 'fingerprint': 'A', 'ms': 150, 'view': 'x'},
+            {'type': 'query', 'fingerprint': 'B', 'ms': 300, 'view': 'x'},
+            {'type': 'query', 'fingerprint': 'A', 'ms': 200, 'view': 'y'},
+            {'type': 'request', 'view': 'x', 'method': 'GET', 'ms': 2000},
+        ]
+        groups = slowlog.aggregate(entries)
+        self.assertEqual([group['key'] for group in groups], ['A', 'B'])
+        self.assertEqual(groups[0]['count'], 2)
+        self.assertEqual(groups[0]['total_ms'], 350)
+        self.assertEqual(groups[0]['max_ms'], 200)
+        self.assertEqual(groups[0]['mean_ms'], 175)
+        self.assertEqual(groups[0]['views'], {'x': 1, 'y': 1})
+        self.assertEqual(groups[0]['example']['view'], 'y')
+        self.assertEqual([group['key'] for group in slowlog.aggregate(entries, 'request')], [('x', 'GET')])
+
+
+class TestSlowQueriesCommand(SlowLogTestCase):
+    def test_command(self):
+        self.client.get(reverse('log:article_detail', args=[self.article.pk]))
+        out = StringIO()
+        call_command('slow_queries', stdout=out)
+        self.assertIn('log:article_detail', out.getvalue())
+        self.assertIn('"log_article"', out.getvalue())
+
+        out = StringIO()
+        call_command('slow_queries', '--requests', '--json', stdout=out)
+        group, = json.loads(out.getvalue())
+        self.assertEqual(group['key'], ['log:article_detail', 'GET'])
+
+        out = StringIO()
+        call_command('slow_queries', '--view', 'log:article_list', stdout=out)
+        self.assertIn('記録がありません', out.getvalue())
+
+    @override_settings(LOG_SLOW_QUERY_DIR='')
+    def test_no_dir(self):
+        with self.assertRaises(CommandError):
+            call_command('slow_queries')
@@ -0,0 +1,102 @@
+"""
+tag_autocomplete.py (タグの入力補完) と、それを使う API・ウィジェットのテスト
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log import tag_autocomplete
+from log.forms import ArticleForm
+from log.models import Article, Tag
+from log.tag_registry import TagEntry
+
+User = get_user_model()
+
+
+class TestTagIndex(TestCase):
+    def setUp(self):
+        self.index = tag_autocomplete.TagIndex((
+            TagEntry(1, 'Photography', 'photography', 3),
+            TagEntry(2, 'Photo', 'photo', 10),
+            TagEntry(3, '写真', 'shashin', 5),
+            TagEntry(4, 'Travel', 'travel', 1),
+        ))
+
+    def test_prefix(self):
+        # 前方一致は記事数の多い順
+        self.assertEqual([tag.pk for tag in self.index.suggest('pho')], [2, 1])
+        self.assertEqual([tag.pk for tag in self.index.suggest('ＳＨＡ')], [3])
+        self.assertEqual([tag.pk for tag in self.index.suggest('写')], [3])
+
+    def test_fuzzy(self):
+        # 前方一致しなくても、似ていれば候補になる
+        self.assertEqual([tag.pk for tag in self.index.suggest('travl')], [4])
+        self.assertEqual([tag.pk for tag in self.index.suggest('fotography')], [1])
+        self.assertEqual(self.index.suggest('xyz'), [])
+
+    def test_limit(self):
+        self.assertEqual([tag.pk for tag in self.index.suggest('photo', limit=1)], [2])
+        self.assertEqual(self.index.suggest('  '), [])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-autocomplete'}},
+)
+class TestTagAutocompleteView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tags = Tag.objects.bulk_create([Tag(name=f'tag{i:03}', slug=f'slug{i:03}') for i in range(100)])
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+        cls.article.tags.add(cls.tags[5])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_results(self):
+        url = reverse('log:tag_autocomplete')
+        response = self.client.get(url, {'q': 'TAG00'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0], {'id': self.tags[5].pk, 'name': 'tag005', 'slug': 'slug005', 'article_count': 1})
+
+        self.assertEqual(len(self.client.get(url, {'q': 'tag', 'limit': 100}).json()['results']), 20)
+        self.assertEqual(self.client.get(url).json(), {'results': []})
+
+        # インデックスはタグの一覧が変わるまで使い回す
+        with self.assertNumQueries(0):
+            self.client.get(url, {'q': 'slug01'})
+
+    def test_new_tag(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='new_tag', slug='new-tag')
+        results = self.client.get(reverse('log:tag_autocomplete'), {'q': 'new'}).json()['results']
+        self.assertEqual([tag['slug'] for tag in results], ['new-tag'])
+
+
+class TestTagAutocompleteWidget(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tags = Tag.objects.bulk_create([Tag(name=f'tag{i:03}', slug=f'slug{i:03}') for i in range(100)])
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+        cls.article.tags.add(cls.tags[1], cls.tags[2])
+
+    def test_render_selected_only(self):
+        html = str(ArticleForm(instance=self.article)['tags'])
+        self.assertEqual(html.count('<option'), 2)
+        self.assertIn('data-autocomplete-url="/log/tags/autocomplete/"', html)
+        self.assertIn('tag001', html)
+        self.assertEqual(str(ArticleForm()['tags']).count('<option'), 0)
+        self.assertIn('log/js/tag_autocomplete.js', str(ArticleForm().media))
+
+    def test_validate(self):
+        data = {'title': 'test_title', 'body': 'test_body', 'tags': [self.tags[50].pk]}
+        form = ArticleForm(data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(list(form.cleaned_data['tags']), [self.tags[50]])
+
+        form = ArticleForm(data={**data, 'tags': ['x']})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(str(form['tags']).count('<option'), 0)
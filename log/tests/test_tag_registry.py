@@ -0,0 +1,102 @@
+"""
+tag_registry.py のテスト
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from log import tag_registry
+from log.models import Article, Tag
+
+User = get_user_model()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-tags'}},
+)
+class TestTagRegistry(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag_b = Tag.objects.create(name='b_name', slug='b_slug')
+        cls.tag_a = Tag.objects.create(name='a_name', slug='a_slug')
+        cls.article = Article.objects.create(title='test_title', body='test_body', user=cls.user)
+        cls.article.tags.add(cls.tag_a)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_tags(self):
+        tags = tag_registry.get_tags()
+        self.assertEqual(tags, (
+            tag_registry.TagEntry(self.tag_a.pk, 'a_name', 'a_slug', 1),
+            tag_registry.TagEntry(self.tag_b.pk, 'b_name', 'b_slug', 0),
+        ))
+        with self.assertNumQueries(0):
+            self.assertIs(tag_registry.get_tags(), tags)
+            self.assertEqual(tag_registry.get_tag('b_slug').pk, self.tag_b.pk)
+            self.assertIsNone(tag_registry.get_tag('no_such_slug'))
+
+    def test_shared_cache(self):
+        """
+        別のプロセスで読み込まれたものは共有のキャッシュから読む
+        """
+        tags = tag_registry.get_tags()
+        tag_registry._registry = (None, ())
+        with self.assertNumQueries(0):
+            self.assertEqual(tag_registry.get_tags(), tags)
+
+    def test_invalidated_by_tag_write(self):
+        tag_registry.get_tags()
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='c_name', slug='c_slug')
+        self.assertEqual([tag.slug for tag in tag_registry.get_tags()], ['a_slug', 'b_slug', 'c_slug'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag_b.delete()
+        self.assertEqual([tag.slug for tag in tag_registry.get_tags()], ['a_slug', 'c_slug'])
+
+    def test_invalidated_by_article_tags(self):
+        tag_registry.get_tags()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.tags.add(self.tag_b)
+        self.assertEqual(tag_registry.get_tag('b_slug').article_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.delete()
+        self.assertEqual([tag.article_count for tag in tag_registry.get_tags()], [0, 0])
+
+    def test_views_use_registry(self):
+        tag_registry.get_tags()
+        with self.assertNumQueries(0):
+            # タグの存在確認をデータベースで行わない(記事の取得より前に 404 になる)
+            response = self.client.get(reverse('log:article_tag_list', args=['no_such_slug']))
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(reverse('log:tag_list'))
+        self.assertContains(response, '<td>a_name</td>', html=True)
+        self.assertEqual(response.context['tags'], tag_registry.get_tags())
+
+    def test_popular(self):
+        tags = tuple(tag_registry.TagEntry(pk, f'name{pk}', f'slug{pk}', count)
+                     for pk, count in enumerate([1, 3, 0, 3, 2]))
+        self.assertEqual([tag.pk for tag in tag_registry.popular(tags, 2)], [1, 3])
+        self.assertEqual([tag.pk for tag in tag_registry.popular(tags, 2, current=tags[2])], [1, 2, 3])
+        self.assertEqual(tag_registry.popular(tags, 0), tags)
+        self.assertEqual(tag_registry.popular(tags, 5), tags)
+
+    @override_settings(LOG_LIST_TAG_LIMIT=1)
+    def test_list_tag_limit(self):
+        """
+        一覧には記事数の多いタグだけを表示し、残りはタグの一覧ページへのリンクにする
+        """
+        response = self.client.get(reverse('log:article_list'))
+        self.assertEqual([tag.slug for tag in response.context['tags']], ['a_slug'])
+        self.assertContains(response, 'ほか 1 件のタグ')
+        self.assertContains(response, reverse('log:tag_list'))
+
+        # タグ別一覧では、そのタグも表示する
+        response = self.client.get(reverse('log:article_tag_list', args=['b_slug']))
+        self.assertEqual([tag.slug for tag in response.context['tags']], ['a_slug', 'b_slug'])
+        self.assertNotContains(response, 'ほか')
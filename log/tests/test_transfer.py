@@ -0,0 +1,149 @@
+"""
+transfer.py (記事の一括エクスポート・インポート) のテスト
+"""
+import tempfile
+import zipfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from log import search, transfer
+from log.models import Article, ImageJob, SearchDocument, Tag
+
+User = get_user_model()
+
+
+class TestTransfer(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='foo@bar.com', password='test')
+        cls.kyoto = Tag.objects.create(name='京都', slug='kyoto')
+        cls.travel = Tag.objects.create(name='旅行', slug='travel')
+        cls.articles = []
+        for i in range(5):
+            article = Article.objects.create(title=f'記事{i}', body=f'京都の本文{i}', user=cls.user)
+            article.tags.add(cls.kyoto, *([cls.travel] if i % 2 else []))
+            cls.articles.append(article)
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.workdir = Path(media.name)
+
+    def export(self, format, **kwargs):
+        stream = StringIO()
+        queryset = Article.objects.filter(pk__in=[article.pk for article in self.articles])
+        count = transfer.export_articles(stream, format, queryset=queryset, batch_size=2, **kwargs)
+        self.assertEqual(count, 5)
+        stream.seek(0)
+        return stream
+
+    def test_round_trip(self):
+        for format in transfer.FORMATS:
+            with self.subTest(format=format):
+                stream = self.export(format)
+                reports = []
+                count = transfer.import_articles(stream, format, batch_size=2,
+                                                 report=lambda count, rate: reports.append(count))
+                self.assertEqual(count, 5)
+                self.assertEqual(reports, [2, 4, 5])
+
+                imported = Article.objects.filter(title='記事3').order_by('-pk').first()
+                self.assertEqual(imported.user, self.user)
+                self.assertEqual(imported.body, '京都の本文3')
+                self.assertEqual(set(imported.tags.values_list('slug', flat=True)), {'kyoto', 'travel'})
+                self.assertEqual(imported.tag_count, 2)
+                self.assertTrue(SearchDocument.objects.filter(article=imported).exists())
+        self.assertEqual(Article.objects.count(), 15)
+        self.assertEqual(len(search.search('京都', limit=100)), 15)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_photos(self):
+        article = Article.objects.get(title='記事0')
+        article.photo.save('photo.jpg', ContentFile(b'jpeg'))
+        Article.objects.create(title='写真なし', body='', user=self.user, photo='log/photos/missing.jpg')
+        archive = self.workdir / 'photos.zip'
+        stream = StringIO()
+        with self.assertLogs('log.transfer', 'WARNING'):
+            transfer.export_articles(stream, 'jsonl', photos=archive)
+        with zipfile.ZipFile(archive) as z:
+            self.assertEqual(z.namelist(), [article.photo.name])
+
+        stream.seek(0)
+        records = [line for line in stream if 'missing' not in line]
+        transfer.import_articles(records, 'jsonl', photos=transfer.PhotoArchive(archive), workers=2)
+        imported = Article.objects.filter(title='記事0').order_by('-pk').first()
+        self.assertNotEqual(imported.photo.name, article.photo.name)
+        self.assertEqual(imported.photo.read(), b'jpeg')
+        self.assertEqual(ImageJob.objects.get(article=imported).photo, imported.photo.name)
+
+    def test_tag_names(self):
+        # インポート先にないタグは、エクスポート元の名前で作る
+        streams = {format: self.export(format) for format in transfer.FORMATS}
+        Tag.objects.filter(slug='travel').delete()
+        transfer.import_articles(streams['jsonl'], 'jsonl')
+        self.assertEqual(Tag.objects.get(slug='travel').name, '旅行')
+
+        # インポート先の別のタグと名前が重複する場合は、スラッグを名前にする
+        Tag.objects.filter(slug='travel').update(slug='sightseeing')
+        transfer.import_articles(streams['csv'], 'csv')
+        self.assertEqual(Tag.objects.get(slug='travel').name, 'travel')
+
+    def test_photos_removed_on_failure(self):
+        article = Article.objects.get(title='記事0')
+        article.photo.save('photo.jpg', ContentFile(b'jpeg'))
+        archive = self.workdir / 'photos.zip'
+        stream = StringIO()
+        transfer.export_articles(stream, 'jsonl', queryset=Article.objects.filter(pk=article.pk), photos=archive)
+        article.photo.delete()
+        photos_dir = self.workdir / 'log' / 'photos'
+        self.assertEqual(list(photos_dir.iterdir()), [])
+
+        stream.seek(0)
+        with mock.patch('log.transfer.search.update_documents', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                transfer.import_articles(stream, 'jsonl', photos=transfer.PhotoArchive(archive))
+        self.assertEqual(list(photos_dir.iterdir()), [])
+
+        # アーカイブにない写真があれば、何も保存せずにエラーにする
+        stream.seek(0)
+        records = [stream.read(), '{"user": "alice", "title": "t", "body": "b", "photo": "log/photos/missing.jpg", '
+                                  '"tags": [], "created_at": "2024-01-01T00:00:00+00:00"}']
+        with self.assertRaisesMessage(transfer.TransferError, 'missing.jpg'):
+            transfer.import_articles(records, 'jsonl', photos=transfer.PhotoArchive(archive))
+        self.assertEqual(list(photos_dir.iterdir()), [])
+
+    def test_new_tags_and_users(self):
+        records = ['{"user": "bob", "title": "t", "body": "b", "photo": null, "tags": ["new-tag"], '
+                   '"created_at": "2024-01-01T00:00:00+00:00"}']
+        with self.assertRaisesMessage(transfer.TransferError, 'bob'):
+            transfer.import_articles(records, 'jsonl')
+
+        transfer.import_articles(records, 'jsonl', default_user=self.user)
+        article = Article.objects.get(title='t')
+        self.assertEqual(article.user, self.user)
+        self.assertEqual(str(article.created_at), '2024-01-01 00:00:00+00:00')
+        self.assertEqual(Tag.objects.get(slug='new-tag').name, 'new-tag')
+
+    def test_commands(self):
+        path = self.workdir / 'articles.csv'
+        out = StringIO()
+        call_command('export_articles', str(path), stdout=out)
+        self.assertIn('5 件の記事を書き出しました', out.getvalue())
+        self.assertTrue(path.read_text(encoding='utf-8').startswith('id,user,title'))
+
+        out = StringIO()
+        call_command('import_articles', str(path), batch_size=3, stdout=out)
+        self.assertIn('3 件', out.getvalue())
+        self.assertIn('5 件の記事を登録しました', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'nobody'):
+            call_command('import_articles', str(path), default_user='nobody')
@@ -4,10 +4,13 @@ from pathlib import Path
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.shortcuts import resolve_url
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from log.counters import repair_counters
 from log.models import Article, Tag, Comment
+from log.pagination import NEXT, encode_cursor
 
 User = get_user_model()
 
@@ -44,6 +47,81 @@ class ArticleListView(TestCase):
         self.assertNotContains(response, 'まだ日記がありません。')
 
 
+class TestArticleListViewQueries(TestCase):
+    """
+    ArticleListView が 1 ページ分の表示に必要なものだけを取得していることを確認する
+
+    コメントが大量にある記事があっても、クエリ数と取得するコメントの行数は増えない
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.path = reverse('log:article_list')
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='test_name', slug='test_slug')
+        for i in range(6):
+            article = Article.objects.create(title=f'test_title{i}', body='test_body', user=cls.user, )
+            article.tags.add(cls.tag)
+            Comment.objects.bulk_create(
+                [Comment(article=article, user=cls.user, body=f'comment{i}-{j}') for j in range(20)])
+        # bulk_create はシグナルを送らないので集計値をまとめて更新する
+        repair_counters()
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'log-test-queries'}},
+        LOG_PAGE_CACHE_TIMEOUT=0,
+    )
+    def test_num_queries(self):
+        # 1 回目でタグのレジストリがキャッシュされる
+        self.client.get(self.path)
+        # COUNT, 記事, 最新コメント(+ユーザ) の 3 クエリ
+        with self.assertNumQueries(3):
+            response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'test_name (6)')
+
+    def test_rows_fetched(self):
+        response = self.client.get(self.path)
+        articles = response.context['articles']
+        self.assertEqual(len(articles), 5)
+        for article in articles:
+            self.assertEqual(article.comment_count, 20)
+            self.assertEqual(len(article.latest_comments), 1)
+            self.assertEqual(article.latest_comments[0].body, f'{article.title.replace("test_title", "comment")}-19')
+            # tags / comments の全件は prefetch されていない
+            self.assertNotIn('tags', getattr(article, '_prefetched_objects_cache', {}))
+            self.assertNotIn('comments', getattr(article, '_prefetched_objects_cache', {}))
+        self.assertContains(response, 'コメント: 20件')
+
+
+class TestArticleListViewOrder(TestCase):
+    """
+    ?order=discussed でコメントの多い順に並ぶことを確認する
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.path = reverse('log:article_list')
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.quiet = Article.objects.create(title='quiet', body='test_body', user=cls.user, )
+        cls.popular = Article.objects.create(title='popular', body='test_body', user=cls.user, )
+        cls.some = Article.objects.create(title='some', body='test_body', user=cls.user, )
+        for i in range(3):
+            cls.popular.comments.create(user=cls.user, body='comment')
+        cls.some.comments.create(user=cls.user, body='comment')
+
+    def test_newest(self):
+        response = self.client.get(self.path)
+        self.assertEqual(list(response.context['articles']), [self.some, self.popular, self.quiet])
+
+    @override_settings(LOG_CURSOR_PAGINATION=True)
+    def test_discussed(self):
+        response = self.client.get(self.path, {'order': 'discussed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['articles']), [self.popular, self.some])
+        self.assertFalse(response.context['cursor_pagination'])
+
+
 class TestArticleTagListView(TestCase):
     """
     ArticleTagListView のテスト
@@ -604,3 +682,51 @@ class TestTagDeleteView(TestCase):
         self.assertEqual(str(messages[0]), 'タグを削除しました。')
 
         self.assertEqual(Tag.objects.count(), 0)
+
+
+@override_settings(LOG_CURSOR_PAGINATION=True)
+class TestArticleListViewCursor(TestCase):
+    """
+    カーソルページネーション有効時の ArticleListView / ArticleTagListView のテスト
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', email='foo@bar.com', password='test')
+        cls.tag = Tag.objects.create(name='test_name', slug='test_slug')
+        for i in range(7):
+            article = Article.objects.create(title=f'test_title{i}', body='test_body', user=cls.user, )
+            if i % 2 == 0:
+                article.tags.add(cls.tag)
+
+    def test_pages(self):
+        path = reverse('log:article_list')
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['articles']), 5)
+        self.assertEqual(list(response.context['paginator_range']), [])
+        self.assertContains(response, '次へ')
+        self.assertNotContains(response, '前へ')
+
+        response = self.client.get(path, {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['articles']), 2)
+        self.assertContains(response, '前へ')
+        self.assertNotContains(response, '次へ')
+
+    def test_tag_pages(self):
+        path = reverse('log:article_tag_list', kwargs={'slug': self.tag.slug})
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['articles']), 4)
+        self.assertFalse(response.context['page_obj'].has_other_pages())
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('log:article_list'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_oversized_cursor(self):
+        # bigint に収まらない id はデータベースに渡さない (渡すと OverflowError で 500 になる)
+        cursor = encode_cursor({'created_at': timezone.now(), 'id': 10 ** 20}, NEXT)
+        response = self.client.get(reverse('log:article_list'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
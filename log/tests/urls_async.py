@@ -0,0 +1,12 @@
+"""
+一覧・詳細を非同期版のビューにした URLconf (test_async_views.py 用)
+"""
+from django.urls import include, path
+
+from config import urls
+from log import async_views
+from log.urls import build_urlpatterns
+
+urlpatterns = [pattern for pattern in urls.urlpatterns if getattr(pattern, 'namespace', None) != 'log'] + [
+    path('log/', include((build_urlpatterns(async_views), 'log'))),
+]
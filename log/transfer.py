@@ -0,0 +1,459 @@
+"""
+記事の一括エクスポート・インポート (export_articles / import_articles コマンド)
+
+記事は 1 件ずつ JSON Lines (.jsonl) か CSV (.csv) で読み書きし、写真は別の zip アーカイブに入れる。
+どちらも一定件数ずつ処理するので、件数が増えてもメモリの使用量は変わらない。
+ユーザ自身による日記のダウンロード (log.views.ArticleExportView) も同じ形式をストリーミングで返す。
+
+1 件の記事は次の形式で表す (CSV ではタグをスペース区切りの文字列に、tag_names を JSON の文字列にする)。
+id はエクスポート元の pk で、インポートでは新しい pk が振られる。ユーザは username で対応付ける。
+タグはスラッグで対応付け、tag_names (tags と同じ順のタグ名) はインポート先にないタグを作るときの名前にする
+(tag_names のない古いファイルでは、スラッグを名前にする)。
+ダウンロードでは comments (コメントのリスト。CSV では JSON の文字列) も付ける。インポートでは無視する。
+
+    {"id": 1, "user": "alice", "title": "...", "body": "...", "photo": "log/photos/a.jpg",
+     "tags": ["kyoto", "travel"], "tag_names": ["京都", "旅行"],
+     "created_at": "2024-01-01T00:00:00+00:00", "updated_at": "...",
+     "comments": [{"user": "bob", "body": "...", "created_at": "..."}]}
+"""
+import csv
+import json
+import logging
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from log import cache, changes, search, tag_registry
+from log.counters import repair_counters
+from log.models import Article, Comment, ImageJob, Tag
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+FORMATS = ('jsonl', 'csv')
+# ダウンロードの zip で写真を入れるディレクトリ
+PHOTOS_PREFIX = 'photos/'
+FIELDS = ['id', 'user', 'title', 'body', 'photo', 'tags', 'tag_names', 'created_at', 'updated_at']
+
+
+class TransferError(Exception):
+    pass
+
+
+class Progress:
+    """
+    処理した件数と、開始からの 1 秒あたりの件数を report に渡す
+    """
+
+    def __init__(self, report=None):
+        self.report = report
+        self.count = 0
+        self.started = time.perf_counter()
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed else 0.0
+
+    def add(self, count):
+        self.count += count
+        if self.report:
+            self.report(self.count, self.rate)
+
+
+def guess_format(path):
+    for format in FORMATS:
+        if str(path).endswith(f'.{format}'):
+            return format
+    return 'jsonl'
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# エクスポート
+
+def iter_article_batches(queryset, batch_size, include_comments=False):
+    """
+    記事を pk 順に batch_size 件ずつ、レコード (dict) のリストで返す
+
+    タグとコメントはバッチごとに 1 クエリで取得する (prefetch_related のキャッシュを溜めない)。
+    """
+    queryset = queryset.select_related('user').order_by('pk')
+    last_pk = 0
+    while True:
+        articles = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not articles:
+            return
+        tags = {article.pk: [] for article in articles}
+        tag_names = {article.pk: [] for article in articles}
+        through = Article.tags.through.objects.filter(article_id__in=tags).order_by('tag__slug')
+        for article_id, slug, name in through.values_list('article_id', 'tag__slug', 'tag__name'):
+            tags[article_id].append(slug)
+            tag_names[article_id].append(name)
+        records = [{
+            'id': article.pk,
+            'user': article.user.get_username(),
+            'title': article.title,
+            'body': article.body,
+            'photo': article.photo.name or None,
+            'tags': tags[article.pk],
+            'tag_names': tag_names[article.pk],
+            'created_at': article.created_at.isoformat(),
+            'updated_at': article.updated_at.isoformat(),
+        } for article in articles]
+        if include_comments:
+            comments = {pk: [] for pk in tags}
+            queryset_comments = Comment.objects.filter(article_id__in=tags).select_related('user').order_by(
+                'created_at', 'id')
+            for comment in queryset_comments.iterator(chunk_size=batch_size):
+                comments[comment.article_id].append({
+                    'user': comment.user.get_username(),
+                    'body': comment.body,
+                    'created_at': comment.created_at.isoformat(),
+                })
+            for record in records:
+                record['comments'] = comments[record['id']]
+        yield records
+        last_pk = articles[-1].pk
+
+
+class _Echo:
+    """
+    書き込まれた文字列をそのまま返す (csv.writer で 1 行ずつ文字列にする)
+    """
+
+    def write(self, value):
+        return value
+
+
+class LineEncoder:
+    """
+    レコードを 1 行の文字列 (改行つき) にする
+    """
+
+    def __init__(self, format, include_comments=False):
+        self.format = format
+        if format == 'csv':
+            self._writer = csv.DictWriter(_Echo(), FIELDS + (['comments'] if include_comments else []))
+
+    def header(self):
+        return self._writer.writeheader() if self.format == 'csv' else ''
+
+    def encode(self, record):
+        if self.format == 'jsonl':
+            return json.dumps(record, ensure_ascii=False) + '\n'
+        row = {**record, 'tags': ' '.join(record['tags']), 'photo': record['photo'] or '',
+               'tag_names': json.dumps(record['tag_names'], ensure_ascii=False)}
+        if 'comments' in record:
+            row['comments'] = json.dumps(record['comments'], ensure_ascii=False)
+        return self._writer.writerow(row)
+
+
+def add_photo(archive, name):
+    # JPEG などは圧縮しても小さくならないので、無圧縮のまま 1 ファイルずつ書き込む
+    try:
+        src = default_storage.open(name)
+    except FileNotFoundError:
+        logger.warning('photo not found, skipped: %s', name)
+        return
+    with src, archive.open(name, 'w', force_zip64=True) as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def export_articles(stream, format='jsonl', queryset=None, photos=None, batch_size=1000, report=None):
+    """
+    記事を stream (テキスト) に書き出し、photos (zip ファイルのパスかファイル) があれば写真をそこに入れる
+
+    書き出した件数を返す。
+    """
+    encoder = LineEncoder(format)
+    queryset = Article.objects.all() if queryset is None else queryset
+    progress = Progress(report)
+    archive = zipfile.ZipFile(photos, 'w', compression=zipfile.ZIP_STORED) if photos else None
+    try:
+        stream.write(encoder.header())
+        for records in iter_article_batches(queryset, batch_size):
+            for record in records:
+                stream.write(encoder.encode(record))
+                if archive and record['photo']:
+                    add_photo(archive, record['photo'])
+            progress.add(len(records))
+    finally:
+        if archive:
+            archive.close()
+    return progress.count
+
+
+# ストリーミングでのダウンロード
+
+def iter_export(queryset, format='jsonl', batch_size=200):
+    """
+    queryset の記事をコメントつきで 1 行ずつ返すジェネレータ (StreamingHttpResponse 用)
+    """
+    encoder = LineEncoder(format, include_comments=True)
+    yield encoder.header()
+    for records in iter_article_batches(queryset, batch_size, include_comments=True):
+        yield ''.join(encoder.encode(record) for record in records)
+
+
+class _ZipSink:
+    """
+    zipfile が書き込んだバイト列をためておき、drain() でたまっていれば取り出す (シークできない出力先として使う)
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def iter_export_zip(queryset, batch_size=200, chunk_size=64 * 1024):
+    """
+    articles.jsonl (コメントつき) と photos/ 以下の写真を入れた zip を、作りながら少しずつ返すジェネレータ
+
+    写真は無圧縮で、chunk_size ずつ読んで書き込む。ストレージにない写真は入れない。
+    取り出した articles.jsonl は、この zip を --photos に指定して import_articles で登録できる。
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('articles.jsonl', 'w', force_zip64=True) as dst:
+            for line in iter_export(queryset, 'jsonl', batch_size):
+                dst.write(line.encode())
+                yield from sink.drain()
+
+        photos = queryset.exclude(photo='').exclude(photo=None).order_by('pk').values_list('photo', flat=True)
+        for name in photos.iterator(chunk_size=batch_size):
+            try:
+                src = default_storage.open(name)
+            except FileNotFoundError:
+                logger.warning('photo not found, skipped: %s', name)
+                continue
+            info = zipfile.ZipInfo(f'{PHOTOS_PREFIX}{name}', time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with src, archive.open(info, 'w', force_zip64=True) as dst:
+                while chunk := src.read(chunk_size):
+                    dst.write(chunk)
+                    yield from sink.drain()
+    yield from sink.drain()
+
+
+# インポート
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield {**row, 'tags': row.get('tags', '').split(), 'photo': row.get('photo') or None,
+               'tag_names': json.loads(row['tag_names']) if row.get('tag_names') else []}
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class PhotoArchive:
+    """
+    zip アーカイブの写真をストレージに保存する。スレッドごとに zip を開くので、並列に使える
+
+    export_articles --photos の zip (写真の名前のまま) と、ダウンロードの zip (iter_export_zip。photos/ の下) のどちらも読める。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with zipfile.ZipFile(path) as archive:
+            members = archive.namelist()
+        # {写真の名前: zip の中の名前}。同じ名前があれば photos/ のないほうを使う
+        self._members = {name[len(PHOTOS_PREFIX):]: name for name in members if name.startswith(PHOTOS_PREFIX)}
+        self._members.update((name, name) for name in members if not name.startswith(PHOTOS_PREFIX))
+        self.names = set(self._members)
+
+    def _archive(self):
+        if not hasattr(self._local, 'archive'):
+            self._local.archive = zipfile.ZipFile(self.path)
+        return self._local.archive
+
+    def save(self, name):
+        """
+        name の写真をストレージに保存し、保存した名前を返す (同名のファイルがあれば別の名前になる)
+        """
+        if name not in self.names:
+            raise TransferError(f'写真がアーカイブにありません: {name}')
+        with self._archive().open(self._members[name]) as src:
+            return default_storage.save(name, File(src, name=name))
+
+
+class ArticleImporter:
+    """
+    レコードを batch_size 件ずつ、記事の bulk_create とタグの中間テーブルの bulk_create で登録する
+
+    ユーザは username で探し、見つからない場合は default_user を使う (None ならエラー)。
+    タグはスラッグで探し、なければ tag_names の名前で作成する。写真は photos (PhotoArchive) から workers 並列で保存し、
+    その後で記事を登録できなかった場合は削除する。
+    """
+
+    def __init__(self, batch_size=1000, default_user=None, photos=None, workers=1):
+        self.batch_size = batch_size
+        self.default_user = default_user
+        self.photos = photos
+        self.workers = workers
+        self._users = {}
+        self._tags = {}
+        self.touched_tag_ids = set()
+
+    def resolve_users(self, records):
+        names = {record['user'] for record in records} - self._users.keys()
+        if names:
+            self._users.update(User.objects.filter(username__in=names).values_list('username', 'pk'))
+        result = {}
+        for name in {record['user'] for record in records}:
+            if name in self._users:
+                result[name] = self._users[name]
+            elif self.default_user is not None:
+                result[name] = self.default_user.pk
+            else:
+                raise TransferError(f'ユーザが見つかりません: {name}')
+        return result
+
+    def resolve_tags(self, records):
+        slugs = {slug for record in records for slug in record['tags']} - self._tags.keys()
+        if slugs:
+            existing = dict(Tag.objects.filter(slug__in=slugs).values_list('slug', 'pk'))
+            missing = slugs - existing.keys()
+            if missing:
+                names = {}
+                for record in records:
+                    names.update(zip(record['tags'], record.get('tag_names') or ()))
+                # 名前も一意なので、インポート先の別のタグと名前が重複するものは作成されない。それはスラッグを名前にして作り直す
+                Tag.objects.bulk_create([Tag(name=names.get(slug) or slug, slug=slug) for slug in missing],
+                                        ignore_conflicts=True)
+                existing.update(Tag.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+                if missing - existing.keys():
+                    Tag.objects.bulk_create([Tag(name=slug, slug=slug) for slug in missing - existing.keys()],
+                                            ignore_conflicts=True)
+                    existing.update(Tag.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+                changes.record(changes.TAG, sorted(existing[slug] for slug in missing if slug in existing))
+            if missing - existing.keys():
+                raise TransferError(f'タグを作成できません: {", ".join(sorted(missing - existing.keys()))}')
+            self._tags.update(existing)
+        return self._tags
+
+    def save_photos(self, records, executor):
+        """
+        写真をストレージに保存し、{レコードの名前: 保存した名前} を返す。1 つでも保存できなければ、保存したものを削除して送出する
+        """
+        names = list(dict.fromkeys(record['photo'] for record in records if record['photo']))
+        if not names:
+            return {}
+        if self.photos is None:
+            # アーカイブがない場合は、ストレージにすでにある写真を指しているものとする
+            return {name: name for name in names}
+        missing = [name for name in names if name not in self.photos.names]
+        if missing:
+            raise TransferError(f'写真がアーカイブにありません: {", ".join(missing)}')
+        futures = {name: executor.submit(self.photos.save, name) for name in names}
+        wait(futures.values())
+        saved = {name: future.result() for name, future in futures.items() if future.exception() is None}
+        errors = [future.exception() for future in futures.values() if future.exception() is not None]
+        if errors:
+            self.delete_photos(saved)
+            raise errors[0]
+        return saved
+
+    def delete_photos(self, photos):
+        """
+        save_photos() で保存した写真を削除する (アーカイブがない場合は、既存の写真なので削除しない)
+        """
+        if self.photos is None:
+            return
+        for name in photos.values():
+            default_storage.delete(name)
+
+    def import_batch(self, records, executor):
+        users = self.resolve_users(records)
+        tags = self.resolve_tags(records)
+        photos = self.save_photos(records, executor)
+        try:
+            count, links = self._create(records, users, tags, photos)
+        except BaseException:
+            # 記事を登録できなかったので、保存した写真を残さない
+            self.delete_photos(photos)
+            raise
+        self.touched_tag_ids.update(link.tag_id for link in links)
+        return count
+
+    def _create(self, records, users, tags, photos):
+        with transaction.atomic():
+            articles = Article.objects.bulk_create([
+                Article(
+                    user_id=users[record['user']],
+                    title=record['title'],
+                    body=record['body'],
+                    photo=photos.get(record['photo']) if record['photo'] else None,
+                    created_at=parse_datetime(record['created_at']),
+                    updated_at=parse_datetime(record.get('updated_at') or record['created_at']),
+                )
+                for record in records
+            ])
+            links = [
+                Article.tags.through(article_id=article.pk, tag_id=tags[slug])
+                for article, record in zip(articles, records) for slug in dict.fromkeys(record['tags'])
+            ]
+            Article.tags.through.objects.bulk_create(links)
+            ImageJob.objects.bulk_create([
+                ImageJob(article_id=article.pk, photo=article.photo.name) for article in articles if article.photo
+            ])
+
+            # bulk_create はシグナルを送らないので、集計値と検索用の文書・変更フィードはここで更新する
+            pks = [article.pk for article in articles]
+            repair_counters(Article.objects.filter(pk__in=pks), batch_size=self.batch_size)
+            search.update_documents(pks)
+            changes.record(changes.ARTICLE, pks)
+            changes.record(changes.ARTICLE_TAGS, sorted({link.article_id for link in links}))
+        return len(articles), links
+
+    def run(self, records, report=None):
+        """
+        records (イテラブル) をすべて登録し、登録した件数を返す
+        """
+        progress = Progress(report)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in batched(records, self.batch_size):
+                progress.add(self.import_batch(batch, executor))
+        if progress.count:
+            cache.bump(*cache.version_names(tag_ids=self.touched_tag_ids))
+            tag_registry.invalidate()
+        return progress.count
+
+
+def import_articles(stream, format='jsonl', **kwargs):
+    report = kwargs.pop('report', None)
+    return ArticleImporter(**kwargs).run(READERS[format](stream), report=report)
@@ -2,23 +2,43 @@
 urls for log app
 """
 
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = 'log'
 
-urlpatterns = [
-    path('', views.ArticleListView.as_view(), name='article_list'),
-    path('tag/<slug:slug>/', views.ArticleTagListView.as_view(), name='article_tag_list'),
 
-    path('<int:pk>/', views.ArticleDetailView.as_view(), name='article_detail'),
-    path('create/', views.ArticleCreateView.as_view(), name='article_create'),
-    path('update/<int:pk>/', views.ArticleUpdateView.as_view(), name='article_update'),
-    path('delete/<int:pk>/', views.ArticleDeleteView.as_view(), name='article_delete'),
+def build_urlpatterns(read_views):
+    """
+    read_views は一覧・詳細のビューを持つモジュール (views か async_views)
+    """
+    return [
+        path('', read_views.ArticleListView.as_view(), name='article_list'),
+        path('tag/<slug:slug>/', read_views.ArticleTagListView.as_view(), name='article_tag_list'),
+        path('feed/<slug:format>/', views.ArticleFeedView.as_view(), name='article_feed'),
+        path('tag/<slug:slug>/feed/<slug:format>/', views.ArticleTagFeedView.as_view(), name='article_tag_feed'),
+        path('search/', views.ArticleSearchView.as_view(), name='article_search'),
+        path('tags/autocomplete/', views.TagAutocompleteView.as_view(), name='tag_autocomplete'),
+        path('api/changes', views.ChangeFeedView.as_view(), name='api_changes'),
+        path('api/articles', views.ArticleApiListView.as_view(), name='api_article_list'),
+        path('api/articles/<int:pk>', views.ArticleApiDetailView.as_view(), name='api_article_detail'),
+        path('api/comments', views.CommentApiListView.as_view(), name='api_comment_list'),
+        path('api/tags', views.TagApiListView.as_view(), name='api_tag_list'),
 
-    path('tag/config/list/', views.TagListView.as_view(), name='tag_list'),
-    path('tag/config/create/', views.TagCreateView.as_view(), name='tag_create'),
-    path('tag/config/update/<int:pk>/', views.TagUpdateView.as_view(), name='tag_update'),
-    path('tag/config/delete/<int:pk>/', views.TagDeleteView.as_view(), name='tag_delete'),
-]
+        path('<int:pk>/', read_views.ArticleDetailView.as_view(), name='article_detail'),
+        path('create/', views.ArticleCreateView.as_view(), name='article_create'),
+        path('export/', views.ArticleExportView.as_view(), name='article_export'),
+        path('update/<int:pk>/', views.ArticleUpdateView.as_view(), name='article_update'),
+        path('delete/<int:pk>/', views.ArticleDeleteView.as_view(), name='article_delete'),
+
+        path('tag/config/list/', views.TagListView.as_view(), name='tag_list'),
+        path('tag/config/create/', views.TagCreateView.as_view(), name='tag_create'),
+        path('tag/config/update/<int:pk>/', views.TagUpdateView.as_view(), name='tag_update'),
+        path('tag/config/delete/<int:pk>/', views.TagDeleteView.as_view(), name='tag_delete'),
+    ]
+
+
+# ASGI (uvicorn のワーカー) で動かすときは LOG_ASYNC_VIEWS を有効にして、一覧・詳細を非同期版のビューにする
+urlpatterns = build_urlpatterns(async_views if settings.LOG_ASYNC_VIEWS else views)
@@ -1,44 +1,272 @@
 import logging
 
+from django.conf import settings
 from django.contrib import messages
-from django.shortcuts import get_object_or_404, redirect, resolve_url
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, resolve_url
 from django.urls import reverse
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
+from django.views.generic import View, ListView, DetailView, CreateView, UpdateView, DeleteView
 
+from log import api, changes, feeds, search, tag_autocomplete, transfer
+from log.budgets import QueryBudget
+from log.cache import AnonymousPageCacheMixin, get_versions
 from log.forms import ArticleForm, CommentForm
-from log.models import Article, Tag
+from log.imaging import enqueue_image_job
+from log.models import Article, Comment, Tag
+from log.pagination import CursorPaginator, InvalidCursor
+from log.tag_registry import get_tag, get_tags, popular
 
 logger = logging.getLogger(__name__)
 
 
-class ArticleListView(ListView):
+class ArticleListView(AnonymousPageCacheMixin, ListView):
     model = Article
     template_name = 'log/article_list.html'
     context_object_name = 'articles'
     paginate_by = 5
+    # クエリ数・重複クエリ数・処理時間の予算 (log/budgets.py)。記事の件数によらず一定のクエリ数で表示する
+    query_budget = QueryBudget(queries=6, wall_ms=500)
+    # カードに表示する最新コメントの件数
+    latest_comments_count = 1
+    # タグのレジストリの一覧 (get_registry_tags)
+    registry_tags = None
+    # タグ別一覧のタグ (TagEntry)。表示するタグの件数を絞っても、このタグは表示する
+    tag = None
+
+    def get_page_cache_versions(self):
+        return ['list', 'tag_registry']
+
+    def get_registry_tags(self):
+        """
+        タグのレジストリの一覧。1 リクエストで 1 回だけ読む
+        """
+        if self.registry_tags is None:
+            self.registry_tags = get_tags()
+        return self.registry_tags
+
+    def get_ordering_key(self):
+        """
+        ?order=discussed のときはコメントの多い順(コメントのある記事のみ)、それ以外は新着順
+        """
+        return 'discussed' if self.request.GET.get('order') == 'discussed' else 'newest'
+
+    def get_article_queryset(self):
+        """
+        絞り込みと並び順だけを指定した記事の queryset (非同期版のビュー log/async_views.py と共通)
+        """
+        if self.get_ordering_key() == 'discussed':
+            return Article.objects.filter(comment_count__gt=0).order_by('-comment_count', '-created_at', '-id')
+        return Article.objects.order_by('-created_at', '-id')
+
+    def get_latest_comments_queryset(self):
+        return Comment.objects.select_related('user').order_by('-created_at', '-id')
 
     def get_queryset(self):
-        return Article.objects.select_related('user').prefetch_related('tags', 'comments', 'comments__user', ).order_by(
-            '-created_at')
+        """
+        一覧のテンプレートが使うものだけを取得する
+
+        コメント数は Article.comment_count を使い、最新の数件だけを件数制限付きの Prefetch で取得する。
+        """
+        latest_comments = self.get_latest_comments_queryset()[:self.latest_comments_count]
+        return self.get_article_queryset().prefetch_related(
+            Prefetch('comments', queryset=latest_comments, to_attr='latest_comments'),
+        )
+
+    def use_cursor_pagination(self):
+        # カーソルは (created_at, id) の並びにしか使えないので、コメント順のときは通常のページネーション
+        return settings.LOG_CURSOR_PAGINATION and self.get_ordering_key() == 'newest'
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        LOG_CURSOR_PAGINATION が有効なときは COUNT / OFFSET を使わないカーソルページネーションにする
+        """
+        if not self.use_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise BadRequest(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['tags'] = Tag.objects.all()
-        page_obj = context['page_obj']
-        context['paginator_range'] = page_obj.paginator.get_elided_page_range(page_obj.number)
+        articles = context['articles']
+        context.update(self.get_page_context(
+            context['page_obj'], articles, self.get_registry_tags(), get_versions(*self.get_card_versions(articles))))
+        return context
+
+    def get_card_versions(self, articles):
+        return [f'article:{article.pk}' for article in articles]
+
+    def get_page_context(self, page_obj, articles, tags, versions):
+        """
+        ページネーション以外のコンテキスト (非同期版のビューと共通。DB やキャッシュにはアクセスしない)
+        """
+        # すべてのタグはタグの一覧ページ (TagListView) に表示し、ここでは記事数の多いものだけにする
+        listed_tags = popular(tags, settings.LOG_LIST_TAG_LIMIT, self.tag)
+        context = {
+            'tags': listed_tags,
+            'more_tags': len(tags) - len(listed_tags),
+            'order': self.get_ordering_key(),
+            'cursor_pagination': isinstance(page_obj.paginator, CursorPaginator),
+            'fragment_cache_timeout': settings.LOG_FRAGMENT_CACHE_TIMEOUT,
+        }
+        if context['cursor_pagination']:
+            # ページ総数が分からないので、番号付きのリンクは出さずに前後リンクだけにする
+            context['paginator_range'] = []
+        else:
+            context['paginator_range'] = page_obj.paginator.get_elided_page_range(page_obj.number)
+
+        # カードは記事のバージョンをキーにしてキャッシュする (templates/log/article_list.html)
+        for article in articles:
+            article.card_version = versions[f'article:{article.pk}']
         return context
 
 
 class ArticleTagListView(ArticleListView):
+    def get_page_cache_versions(self):
+        return [f'tag:{self.kwargs["slug"]}', 'tag_registry']
+
+    def get(self, request, *args, **kwargs):
+        # タグの存在確認もデータベースではなくレジストリで行う
+        self.tag = get_tag(self.kwargs['slug'], self.get_registry_tags())
+        if self.tag is None:
+            raise Http404('タグが見つかりません。')
+        return super().get(request, *args, **kwargs)
+
+    def get_article_queryset(self):
+        return super().get_article_queryset().filter(tags=self.tag.pk)
+
+    def get_page_context(self, page_obj, articles, tags, versions):
+        context = super().get_page_context(page_obj, articles, tags, versions)
+        context['current_tag'] = self.tag
+        return context
+
+
+class ArticleFeedView(AnonymousPageCacheMixin, View):
+    """
+    新着記事の Atom / RSS フィード (log/feeds.py)。URL の format で形式を選ぶ
+    """
+    # 記事とタグを 1 回ずつ。ETag が一致したときとキャッシュにあるときは 0 回
+    query_budget = QueryBudget(queries=2, wall_ms=500)
+    http_method_names = ['get', 'head', 'options']
+    items_count = 20
+
+    def get_page_cache_versions(self):
+        return ['feed']
+
+    def is_page_conditional(self, request):
+        # フィードはユーザやメッセージによらず同じなので、ログインしていても ETag を付けてキャッシュする
+        return request.method in ('GET', 'HEAD')
+
+    def get_feed_queryset(self):
+        return Article.objects.all()
+
+    def get_feed_title(self):
+        return '日記リスト'
+
+    def get_feed_link(self):
+        return reverse('log:article_list')
+
+    def get(self, request, *args, **kwargs):
+        feed_type = feeds.FORMATS.get(self.kwargs['format'])
+        if feed_type is None:
+            raise Http404('フィードの形式が不正です。')
+        feed = feeds.build_feed(feed_type, request, self.get_feed_queryset(), self.get_feed_title(),
+                                self.get_feed_link(), '新しい日記', self.items_count)
+        response = HttpResponse(content_type=feed.content_type)
+        feed.write(response, 'utf-8')
+        return response
+
+
+class ArticleTagFeedView(ArticleFeedView):
+    # タグの存在確認はレジストリで行う (キャッシュになければ読み込む)
+    query_budget = QueryBudget(queries=3, wall_ms=500)
+
+    def get_page_cache_versions(self):
+        return [f'feed:{self.kwargs["slug"]}']
+
+    def get(self, request, *args, **kwargs):
+        self.tag = get_tag(self.kwargs['slug'])
+        if self.tag is None:
+            raise Http404('タグが見つかりません。')
+        return super().get(request, *args, **kwargs)
+
+    def get_feed_queryset(self):
+        return super().get_feed_queryset().filter(tags=self.tag.pk)
+
+    def get_feed_title(self):
+        return f'日記リスト - {self.tag.name}'
+
+    def get_feed_link(self):
+        return reverse('log:article_tag_list', args=[self.tag.slug])
+
+
+class ArticleSearchView(ListView):
+    """
+    全文検索 (log/search.py) の結果を関連度の高い順に表示する
+
+    一致する件数は数えず、1 件多く取得して次のページの有無だけを判断する。
+    """
+    template_name = 'log/article_search.html'
+    context_object_name = 'articles'
+    query_budget = QueryBudget(queries=4, wall_ms=500)
+    per_page = 10
+    max_query_length = 100
+    # これより大きいページ番号はこのページにする (OFFSET がデータベースの整数の範囲を超えないように)。
+    # LOG_SEARCH_RANK_WINDOW 件より後は結果に含まれないので、既定の設定では空のページになる
+    max_page_number = 1000
+
+    def get_query(self):
+        return self.request.GET.get('q', '').strip()[:self.max_query_length]
+
+    def get_page_number(self):
+        try:
+            number = int(self.request.GET.get('page') or 1)
+        except ValueError:
+            raise Http404('ページ番号が不正です。')
+        if number < 1:
+            raise Http404('ページ番号が不正です。')
+        return min(number, self.max_page_number)
+
     def get_queryset(self):
-        self.tag = get_object_or_404(Tag, slug=self.kwargs['slug'])
-        return super().get_queryset().filter(tags=self.tag)
+        self.page_number = self.get_page_number()
+        pks = search.search(self.get_query(), offset=(self.page_number - 1) * self.per_page, limit=self.per_page + 1)
+        self.has_next = len(pks) > self.per_page
+        pks = pks[:self.per_page]
+        articles = Article.objects.in_bulk(pks)
+        return [articles[pk] for pk in pks if pk in articles]
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'query': self.get_query(),
+            'page_number': self.page_number,
+            'has_next': self.has_next,
+            'has_previous': self.page_number > 1,
+        })
+        return context
 
-class ArticleDetailView(DetailView):
+
+class ArticleDetailView(AnonymousPageCacheMixin, DetailView):
     model = Article
     template_name = 'log/article_detail.html'
     context_object_name = 'article'
+    # コメントの件数によらず一定のクエリ数で表示する (コメントのユーザも prefetch する)
+    query_budget = {
+        'get': QueryBudget(queries=6, wall_ms=500),
+        'post': QueryBudget(queries=10, wall_ms=1000),
+    }
+
+    def get_page_cache_versions(self):
+        return [f'article:{self.kwargs["pk"]}', 'tags']
 
     def get_queryset(self):
         return Article.objects.select_related('user').prefetch_related('tags', 'comments', 'comments__user', ).order_by(
@@ -52,12 +280,15 @@ class ArticleDetailView(DetailView):
             messages.error(self.request, 'コメントするにはログインしてください。')
             return redirect('account_login')
 
-        article = self.get_object()
+        # 投稿では表示用の関連 (タグ・コメント) は使わないので取得しない
+        article = self.get_object(Article.objects.all())
         form = CommentForm(request.POST)
         if form.is_valid():
             form.instance.article = article
             form.instance.user = self.request.user
-            form.save()
+            # コメントの保存と記事のコメント数の更新(log/signals.py)を一緒にコミットする
+            with transaction.atomic():
+                form.save()
             messages.success(self.request, 'コメントを投稿しました。')
         else:
             messages.error(self.request, 'コメントを入力してください。')
@@ -68,6 +299,12 @@ class ArticleCreateView(CreateView):
     model = Article
     template_name = 'log/article_create.html'
     form_class = ArticleForm
+    # 保存時は記事の保存とタグの付け外しのシグナル (log/signals.py) がそれぞれ変更フィードに追記する (重複 1)。
+    # キャッシュのバージョンに使う記事のタグは、コミットの後に 1 回だけ読む (log/cache.py の invalidate_on_commit)
+    query_budget = {
+        'get': QueryBudget(queries=3, wall_ms=500),
+        'post': QueryBudget(queries=18, duplicates=1, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -80,6 +317,9 @@ class ArticleCreateView(CreateView):
         messages.success(self.request, '日記を投稿しました。')
         logger.info('before: article create: user=%s title=%s', self.request.user.email, form.instance.title)
         result = super().form_valid(form)
+        if 'photo' in form.changed_data:
+            # サムネイルはワーカーで生成する
+            enqueue_image_job(self.object)
         logger.info('after  :article create: user=%s id=%s', self.request.user.email, self.object.id)
         return result
 
@@ -92,22 +332,71 @@ class ArticleCreateView(CreateView):
         return reverse('log:article_list')
 
 
+class ArticleExportView(View):
+    """
+    ログインしているユーザの記事とコメントをダウンロードさせる
+
+    ?format= は jsonl (既定) / csv / zip (articles.jsonl と写真)。記事は batch_size 件ずつ読んで書き出すので、
+    記事が多くてもメモリの使用量は増えず、最初の数百件を読んだところで送信を始める。
+    """
+    batch_size = 200
+    # 本文を送信している間のクエリはミドルウェアの後なので数えない
+    query_budget = QueryBudget(queries=3, wall_ms=500)
+    content_types = {
+        'jsonl': 'application/x-ndjson; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+        'zip': 'application/zip',
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            messages.error(request, '日記をダウンロードするにはログインしてください。')
+            return redirect('account_login')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        format = request.GET.get('format', 'jsonl')
+        if format not in self.content_types:
+            raise Http404('形式が不正です。')
+        queryset = Article.objects.filter(user=request.user)
+        if format == 'zip':
+            content = transfer.iter_export_zip(queryset, batch_size=self.batch_size)
+        else:
+            content = transfer.iter_export(queryset, format, batch_size=self.batch_size)
+        response = StreamingHttpResponse(content, content_type=self.content_types[format])
+        response['Content-Disposition'] = f'attachment; filename="diary.{format}"'
+        return response
+
+
 class ArticleUpdateView(UpdateView):
     template_name = 'log/article_update.html'
     model = Article
     form_class = ArticleForm
+    # タグの付け替え (tags.set()) は外す・付けるの 2 回のシグナルになり、それぞれ記事のタグ数を数え直して
+    # 変更フィードに追記する。記事の保存の追記と合わせて重複 3
+    query_budget = {
+        'get': QueryBudget(queries=6, wall_ms=500),
+        'post': QueryBudget(queries=23, duplicates=3, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         self.object = self.get_object()
-        if not request.user == self.object.user and not request.user.is_staff:
+        if not request.user.pk == self.object.user_id and not request.user.is_staff:
             messages.error(request, '日記を更新できるのは投稿者と管理者だけです。')
             return redirect('log:article_list')
         return super().dispatch(request, *args, **kwargs)
 
+    def get_object(self, queryset=None):
+        # dispatch で取得した記事を使い、get / post でもう一度取得しない
+        return getattr(self, 'object', None) or super().get_object(queryset)
+
     def form_valid(self, form):
         messages.success(self.request, '日記を更新しました。')
         logger.info('before: article update: user=%s id=%s', self.request.user.email, self.object.id)
-        return super().form_valid(form)
+        result = super().form_valid(form)
+        if 'photo' in form.changed_data:
+            enqueue_image_job(self.object)
+        return result
 
     def form_invalid(self, form):
         messages.error(self.request, '日記を編集できませんでした。')
@@ -121,14 +410,22 @@ class ArticleUpdateView(UpdateView):
 class ArticleDeleteView(DeleteView):
     model = Article
     template_name = 'log/article_delete.html'
+    query_budget = {
+        'get': QueryBudget(queries=4, wall_ms=500),
+        'post': QueryBudget(queries=12, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         self.object = self.get_object()
-        if not request.user == self.object.user and not request.user.is_staff:
+        if not request.user.pk == self.object.user_id and not request.user.is_staff:
             messages.error(request, '日記を削除できるのは投稿者と管理者だけです。')
             return redirect('log:article_list')
         return super().dispatch(request, *args, **kwargs)
 
+    def get_object(self, queryset=None):
+        # dispatch で取得した記事を使い、get / post でもう一度取得しない
+        return getattr(self, 'object', None) or super().get_object(queryset)
+
     def form_valid(self, form):
         messages.success(self.request, '日記を削除しました。')
         logger.info('before: article delete: user=%s id=%s', self.request.user.email, self.object.id)
@@ -138,16 +435,137 @@ class ArticleDeleteView(DeleteView):
         return reverse('log:article_list')
 
 
-class TagListView(ListView):
+class TagListView(AnonymousPageCacheMixin, ListView):
     model = Tag
     template_name = 'log/tag_list.html'
     context_object_name = 'tags'
+    query_budget = QueryBudget(queries=3, wall_ms=500)
+
+    def get_page_cache_versions(self):
+        return ['tag_registry']
+
+    def get_queryset(self):
+        return get_tags()
+
+
+class TagAutocompleteView(View):
+    """
+    タグの入力補完 (log/tag_autocomplete.py) の結果を JSON で返す
+
+    ?q= に入力中の文字列、?limit= に件数 (最大 max_limit) を指定する。
+    """
+    limit = 10
+    max_limit = 20
+    max_query_length = 50
+    query_budget = QueryBudget(queries=2, wall_ms=200)
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')[:self.max_query_length]
+        try:
+            limit = min(int(request.GET.get('limit') or self.limit), self.max_limit)
+        except ValueError:
+            limit = self.limit
+        tags = tag_autocomplete.suggest(query, max(limit, 1))
+        return JsonResponse({'results': [
+            {'id': tag.pk, 'name': tag.name, 'slug': tag.slug, 'article_count': tag.article_count} for tag in tags
+        ]})
+
+
+class ChangeFeedView(View):
+    """
+    記事・コメント・タグ・記事のタグの付け外しの変更フィード (log/changes.py) を JSON で返す
+
+    ?since= に前回のレスポンスの next (最初は 0)、?limit= に件数 (最大 LOG_CHANGES_MAX_PAGE_SIZE) を指定する。
+    """
+    # 変更の記録と、種類ごとの内容 (記事のタグは記事と中間テーブル) を 1 回ずつ取得する
+    query_budget = QueryBudget(queries=6, wall_ms=500)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET.get('since') or 0)
+            limit = int(request.GET.get('limit') or settings.LOG_CHANGES_PAGE_SIZE)
+        except ValueError:
+            since = limit = -1
+        # MAX_ID より大きい値はデータベースのドライバが OverflowError を送出する
+        if not 0 <= since <= changes.MAX_ID or limit < 1:
+            message = f'since には 0 から {changes.MAX_ID} まで、limit には 1 以上の整数を指定してください。'
+            return JsonResponse({'error': message}, status=400)
+        results, next_cursor, has_more = changes.read(since, min(limit, settings.LOG_CHANGES_MAX_PAGE_SIZE))
+        return JsonResponse({'changes': results, 'next': next_cursor, 'has_more': has_more},
+                            json_dumps_params={'ensure_ascii': False})
+
+
+class JsonApiMixin:
+    """
+    読み取り専用の JSON API (log/api.py) のビュー。レスポンスを gzip で圧縮し、不正なパラメータには 400 を返す
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    @method_decorator(gzip_page)
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except (api.InvalidQuery, InvalidCursor) as e:
+            return api.json_response({'error': str(e)}, status=400)
+
+
+class ArticleApiListView(JsonApiMixin, View):
+    """
+    記事の一覧 (新着順)。?tag=<slug> でタグの記事に絞る
+    """
+    # 記事と、include した関係ごとに 1 回。タグの絞り込みはレジストリで行う
+    query_budget = QueryBudget(queries=4, wall_ms=500)
+
+    def get(self, request, *args, **kwargs):
+        queryset = Article.objects.all()
+        slug = request.GET.get('tag')
+        if slug:
+            tag = get_tag(slug)
+            if tag is None:
+                return api.json_response({'error': 'タグが見つかりません。'}, status=404)
+            queryset = queryset.filter(tags=tag.pk)
+        return api.json_response(api.list_articles(queryset, request.GET))
+
+
+class ArticleApiDetailView(JsonApiMixin, View):
+    query_budget = QueryBudget(queries=3, wall_ms=500)
+
+    def get(self, request, *args, **kwargs):
+        payload = api.get_article(self.kwargs['pk'], request.GET)
+        if payload is None:
+            return api.json_response({'error': '記事が見つかりません。'}, status=404)
+        return api.json_response(payload)
+
+
+class CommentApiListView(JsonApiMixin, View):
+    """
+    コメントの一覧 (新しい順)。?article=<pk> で記事のコメントに絞る
+    """
+    query_budget = QueryBudget(queries=1, wall_ms=500)
+
+    def get(self, request, *args, **kwargs):
+        queryset = Comment.objects.all()
+        if request.GET.get('article'):
+            queryset = queryset.filter(article=api.parse_id(request.GET['article'], 'article'))
+        return api.json_response(api.list_comments(queryset, request.GET))
+
+
+class TagApiListView(JsonApiMixin, View):
+    # タグのレジストリがキャッシュになければ読み込む
+    query_budget = QueryBudget(queries=1, wall_ms=500)
+
+    def get(self, request, *args, **kwargs):
+        return api.json_response(api.list_tags(get_tags(), request.GET))
 
 
 class TagCreateView(CreateView):
     model = Tag
     template_name = 'log/tag_create.html'
     fields = ['name', 'slug']
+    query_budget = {
+        'get': QueryBudget(queries=3, wall_ms=500),
+        'post': QueryBudget(queries=6, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_staff:
@@ -167,6 +585,10 @@ class TagUpdateView(UpdateView):
     model = Tag
     template_name = 'log/tag_update.html'
     fields = ['name', 'slug']
+    query_budget = {
+        'get': QueryBudget(queries=4, wall_ms=500),
+        'post': QueryBudget(queries=8, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_staff:
@@ -185,6 +607,10 @@ class TagUpdateView(UpdateView):
 class TagDeleteView(DeleteView):
     model = Tag
     template_name = 'log/tag_delete.html'
+    query_budget = {
+        'get': QueryBudget(queries=4, wall_ms=500),
+        'post': QueryBudget(queries=12, duplicates=2, wall_ms=1000),
+    }
 
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_staff:
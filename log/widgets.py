@@ -0,0 +1,33 @@
+from django import forms
+from django.urls import reverse_lazy
+
+
+class TagAutocompleteWidget(forms.SelectMultiple):
+    """
+    タグの複数選択を入力補完にするウィジェット
+
+    選択済みのタグだけを <option> として出力し、ほかのタグは入力に応じて
+    入力補完の API (log:tag_autocomplete) から取得する (static/log/js/tag_autocomplete.js)。
+    """
+
+    class Media:
+        js = ['log/js/tag_autocomplete.js']
+
+    def __init__(self, attrs=None, url=reverse_lazy('log:tag_autocomplete')):
+        super().__init__(attrs)
+        self.url = url
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = str(self.url)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        # すべてのタグではなく、選択済みのタグだけを選択肢にする
+        choices = self.choices
+        selected = [v for v in value if str(v).isdigit()]
+        self.choices = [(tag.pk, str(tag)) for tag in choices.queryset.filter(pk__in=selected)] if selected else []
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
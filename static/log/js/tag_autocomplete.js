@@ -0,0 +1,115 @@
+/*
+ * タグの入力補完 (log/widgets.py の TagAutocompleteWidget)
+ *
+ * <select multiple data-autocomplete-url="..."> を隠し、選択済みのタグのバッジと入力欄を表示する。
+ * 入力に応じて API からタグを取得し、選んだタグは <option selected> として select に追加する。
+ */
+(function () {
+    'use strict';
+
+    const DELAY = 200;
+
+    function setup(select) {
+        const container = document.createElement('div');
+        const badges = document.createElement('div');
+        const input = document.createElement('input');
+        const list = document.createElement('div');
+
+        badges.className = 'mb-2';
+        input.type = 'text';
+        input.className = 'form-control';
+        input.placeholder = 'タグ名を入力';
+        input.autocomplete = 'off';
+        input.setAttribute('aria-label', 'タグを追加');
+        list.className = 'list-group position-absolute w-100 shadow-sm';
+        list.style.zIndex = 1000;
+        container.className = 'position-relative';
+        container.append(badges, input, list);
+        select.classList.add('d-none');
+        select.after(container);
+
+        function renderBadges() {
+            badges.replaceChildren();
+            for (const option of select.selectedOptions) {
+                const badge = document.createElement('span');
+                const remove = document.createElement('button');
+                badge.className = 'badge bg-secondary me-1';
+                badge.textContent = option.textContent;
+                remove.type = 'button';
+                remove.className = 'btn-close btn-close-white ms-1';
+                remove.setAttribute('aria-label', `${option.textContent} を外す`);
+                remove.addEventListener('click', () => {
+                    option.remove();
+                    renderBadges();
+                });
+                badge.append(remove);
+                badges.append(badge);
+            }
+        }
+
+        function add(tag) {
+            if (!select.querySelector(`option[value="${tag.id}"]`)) {
+                select.append(new Option(tag.name, tag.id, true, true));
+            }
+            input.value = '';
+            list.replaceChildren();
+            renderBadges();
+            input.focus();
+        }
+
+        let timer = null;
+        let controller = null;
+
+        async function load() {
+            const query = input.value.trim();
+            if (controller) {
+                controller.abort();
+            }
+            if (!query) {
+                list.replaceChildren();
+                return;
+            }
+            controller = new AbortController();
+            const url = new URL(select.dataset.autocompleteUrl, window.location.href);
+            url.searchParams.set('q', query);
+            let data;
+            try {
+                const response = await fetch(url, {signal: controller.signal});
+                data = await response.json();
+            } catch (e) {
+                return;
+            }
+            const selected = new Set(Array.from(select.selectedOptions, (option) => option.value));
+            list.replaceChildren(...data.results.filter((tag) => !selected.has(String(tag.id))).map((tag) => {
+                const item = document.createElement('button');
+                item.type = 'button';
+                item.className = 'list-group-item list-group-item-action';
+                item.textContent = `${tag.name} (${tag.article_count})`;
+                item.addEventListener('click', () => add(tag));
+                return item;
+            }));
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(load, DELAY);
+        });
+        input.addEventListener('keydown', (event) => {
+            // Enter でフォームを送信せずに、候補の先頭を選ぶ
+            if (event.key === 'Enter') {
+                event.preventDefault();
+                const first = list.querySelector('button');
+                if (first) {
+                    first.click();
+                }
+            } else if (event.key === 'Escape') {
+                list.replaceChildren();
+            }
+        });
+        renderBadges();
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(setup);
+    });
+})();